@@ -0,0 +1,69 @@
+"""
+Đo thời gian từng stage, đếm token/kích thước payload và log payload theo tỷ lệ mẫu.
+Metric được in ra stdout theo CloudWatch Embedded Metric Format (EMF), CloudWatch tự
+tạo metric để xem p50/p99 theo Function và Stage.
+"""
+import os
+import json
+import time
+import random
+from contextlib import contextmanager
+
+NAMESPACE = 'CallCenterAnalysis'
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+# Tắt metric khi chạy ngoài Lambda (ví dụ tools/rescore.py)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Tỷ lệ payload đầy đủ (event, transcript, response...) được ghi log
+PAYLOAD_SAMPLE_RATE = float(os.environ.get('PAYLOAD_SAMPLE_RATE', '0.01'))
+# Độ dài tối đa của payload trong một dòng log mẫu
+MAX_LOGGED_PAYLOAD_CHARS = 20000
+
+def emit_metric(name, value, unit='Count', stage=None):
+    """In một metric EMF với dimension Function (và Stage nếu có)"""
+    if not METRICS_ENABLED:
+        return
+    dimensions = {'Function': FUNCTION_NAME}
+    if stage:
+        dimensions['Stage'] = stage
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit}]
+            }]
+        },
+        name: value,
+        **dimensions
+    }
+    print(json.dumps(record), flush=True)
+
+@contextmanager
+def stage_timer(stage):
+    """Đo thời gian của một stage (HttpCall, BedrockCall, JsonRepair, DynamoDBWrite...)"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit_metric('Latency', round((time.perf_counter() - started_at) * 1000, 3), 'Milliseconds', stage)
+
+def payload_size(payload):
+    """Kích thước payload (byte, UTF-8)"""
+    if not isinstance(payload, (str, bytes)):
+        payload = json.dumps(payload, default=str)
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    return len(payload)
+
+def record_payload(stage, payload):
+    """Đếm kích thước payload của stage, chỉ log nội dung đầy đủ theo PAYLOAD_SAMPLE_RATE"""
+    emit_metric('PayloadBytes', payload_size(payload), 'Bytes', stage)
+    log_sampled(stage, payload)
+
+def log_sampled(label, payload):
+    if random.random() >= PAYLOAD_SAMPLE_RATE:
+        return
+    if not isinstance(payload, str):
+        payload = json.dumps(payload, default=str, ensure_ascii=False)
+    print(f"[sampled payload] {label}: {payload[:MAX_LOGGED_PAYLOAD_CHARS]}", flush=True)
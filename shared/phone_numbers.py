@@ -0,0 +1,23 @@
+"""
+Chuẩn hóa số điện thoại về format +84, dùng chung giữa contact flow (get-customer-profile.py)
+và bộ lọc theo số điện thoại của UI (get-results-UI.py) để cùng khớp với PhoneNumber đã lưu.
+"""
+
+def format_phone_number(phone):
+    """
+    Chuẩn hóa số điện thoại về format +84
+    """
+    # Loại bỏ tất cả các ký tự không phải số
+    phone = ''.join(filter(str.isdigit, phone))
+    
+    # Nếu số điện thoại bắt đầu bằng 0, thay thế bằng +84
+    if phone.startswith('0'):
+        phone = '+84' + phone[1:]
+    # Nếu số điện thoại chưa có +84 và không bắt đầu bằng 84
+    elif not phone.startswith('84'):
+        phone = '+84' + phone
+    # Nếu số điện thoại bắt đầu bằng 84 nhưng không có dấu +
+    elif phone.startswith('84'):
+        phone = '+' + phone
+    
+    return phone
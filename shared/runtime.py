@@ -0,0 +1,73 @@
+"""
+Khởi tạo lười cho các Lambda: module nặng (boto3, requests, ...) chỉ được import và client AWS
+chỉ được tạo khi dùng lần đầu. Client / resource / Table được cache theo container và dùng chung
+giữa handler và các module trong layer (text_storage, transcribe_queue, ...), mỗi service
+chỉ tạo một lần thay vì mỗi module một bản.
+
+init_timings ghi thời gian import / tạo client lần đầu (ms), tools/coldstart.py đọc để báo cáo.
+"""
+import time
+import importlib
+import threading
+
+init_timings = {}
+clients = {}
+clients_lock = threading.RLock()
+
+class LazyModule:
+    """Module chỉ được import khi truy cập thuộc tính đầu tiên"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            started_at = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            init_timings.setdefault(f"import:{self._name}", round((time.perf_counter() - started_at) * 1000, 3))
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+def lazy_import(name):
+    return LazyModule(name)
+
+boto3 = lazy_import('boto3')
+botocore_config = lazy_import('botocore.config')
+
+def cache_key(kind, name, region_name, config):
+    return (kind, name, region_name, repr(sorted((config or {}).items())))
+
+def get_or_create(key, create):
+    """Tạo một lần cho mỗi key, an toàn khi nhiều thread cùng gọi lần đầu"""
+    with clients_lock:
+        if key not in clients:
+            started_at = time.perf_counter()
+            clients[key] = create()
+            init_timings[':'.join(str(part) for part in key[:3] if part)] = round((time.perf_counter() - started_at) * 1000, 3)
+        return clients[key]
+
+def build_config(config):
+    """config là dict tham số của botocore Config, để import botocore được hoãn lại"""
+    return botocore_config.Config(**config) if config else None
+
+def client(service_name, region_name=None, config=None):
+    return get_or_create(
+        cache_key('client', service_name, region_name, config),
+        lambda: boto3.client(service_name, region_name=region_name, config=build_config(config))
+    )
+
+def resource(service_name, region_name=None, config=None):
+    return get_or_create(
+        cache_key('resource', service_name, region_name, config),
+        lambda: boto3.resource(service_name, region_name=region_name, config=build_config(config))
+    )
+
+def table(table_name, region_name=None, config=None):
+    """DynamoDB Table trên resource dùng chung của cùng region / config"""
+    return get_or_create(
+        cache_key('table', table_name, region_name, config),
+        lambda: resource('dynamodb', region_name, config).Table(table_name)
+    )
@@ -0,0 +1,76 @@
+"""
+Inverted index cho tìm kiếm trên kết quả phân tích (TranscriptionText, violations, recommendations).
+search-indexer.py cập nhật index từ stream của bảng kết quả, get-results-UI.py đọc index khi có ?q=.
+
+Bảng analysis-search-index:
+- posting: Term (HASH) + ContactId (RANGE), Rank = '<weight>#<CallDate>'
+- GSI Term-Rank-index (Term HASH, Rank RANGE, KEYS_ONLY): posting có weight cao, cuộc gọi mới đọc trước
+- item '#doc#<ContactId>' (không có Rank nên không vào GSI) giữ các term đã index của cuộc gọi để cập nhật / xóa
+"""
+import re
+import unicodedata
+
+INDEX_TABLE_NAME = 'analysis-search-index'
+RANK_INDEX = 'Term-Rank-index'
+DOC_PREFIX = '#doc#'
+
+# Từ trong violations / recommendations được ưu tiên hơn lời thoại
+FIELD_WEIGHTS = {'transcript': 1, 'violations': 3, 'recommendations': 2}
+# Giới hạn số lần đếm một từ trong một field, tránh hội thoại dài lấn át
+MAX_TERM_FREQUENCY = 5
+MAX_WEIGHT = 9999
+# Giới hạn số term của một cuộc gọi (giữ các term có weight cao nhất)
+MAX_DOC_TERMS = 2000
+MIN_TERM_LENGTH = 2
+
+# Âm tiết xuất hiện trong hầu hết cuộc gọi, đã bỏ dấu. Không gồm các âm tiết trùng với từ nghiệp vụ
+# sau khi bỏ dấu (thẻ, lãi, nợ, vay, mã)
+STOPWORDS = {
+    'a', 'ah', 'ak', 'alo', 'anh', 'ay', 'ba', 'ban', 'bi', 'ca', 'cac', 'cai', 'chi', 'cho', 'co', 'con',
+    'cua', 'da', 'dang', 'de', 'den', 'di', 'do', 'duoc', 'em', 'gi', 'ha', 'hay', 'khi', 'la', 'lam',
+    'minh', 'mot', 'nay', 'ne', 'nha', 'nhe', 'nhi', 'nhung', 'o', 'oi', 'ok', 'ong', 'ra', 'roi', 'se',
+    'thi', 'toi', 'tu', 'uh', 'um', 'va', 'vang', 'voi'
+}
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+def fold_text(text):
+    """Chữ thường, bỏ dấu tiếng Việt ('Thẻ tín dụng' -> 'the tin dung')"""
+    text = str(text).lower().replace('đ', 'd')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(char for char in decomposed if unicodedata.category(char) != 'Mn')
+
+def tokenize(text):
+    """Các âm tiết đã bỏ dấu, không gồm stopword"""
+    if not text:
+        return []
+    return [
+        token for token in TOKEN_PATTERN.findall(fold_text(text))
+        if len(token) >= MIN_TERM_LENGTH and token not in STOPWORDS
+    ]
+
+def term_weights(fields):
+    """{term: weight} của một cuộc gọi từ {field: text hoặc list text}"""
+    weights = {}
+    for field, value in fields.items():
+        texts = value if isinstance(value, list) else [value]
+        counts = {}
+        for text in texts:
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            weights[token] = weights.get(token, 0) + FIELD_WEIGHTS[field] * min(count, MAX_TERM_FREQUENCY)
+
+    if len(weights) > MAX_DOC_TERMS:
+        weights = dict(sorted(weights.items(), key=lambda entry: entry[1], reverse=True)[:MAX_DOC_TERMS])
+    return weights
+
+def rank_key(weight, call_date):
+    """Sort key trên RANK_INDEX, weight cố định 4 chữ số để so sánh theo chuỗi"""
+    return f"{min(weight, MAX_WEIGHT):04d}#{call_date or ''}"
+
+def rank_weight(rank):
+    return int(rank.split('#', 1)[0])
+
+def doc_key(contact_id):
+    return {'Term': f"{DOC_PREFIX}{contact_id}", 'ContactId': contact_id}
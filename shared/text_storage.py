@@ -0,0 +1,82 @@
+"""
+Lưu các trường text lớn (TranscriptionText, TranscriptSegments, RawResponse) gọn hơn trong DynamoDB:
+- nhỏ hơn COMPRESS_MIN_BYTES: giữ nguyên chuỗi
+- lớn hơn: nén zlib, lưu dạng Binary
+- sau khi nén vẫn lớn hơn OFFLOAD_MIN_BYTES và có LARGE_TEXT_BUCKET: đưa lên S3, item chỉ giữ con trỏ
+Mọi handler đọc lại bằng unpack_text / unpack_json, không cần biết giá trị được lưu theo cách nào.
+"""
+import os
+import json
+import zlib
+import runtime
+from decimal import Decimal
+from boto3.dynamodb.types import Binary
+
+COMPRESS_MIN_BYTES = 1024
+OFFLOAD_MIN_BYTES = 64 * 1024
+COMPRESSION_LEVEL = 6
+# Bucket cho text quá lớn, không cấu hình thì chỉ nén
+LARGE_TEXT_BUCKET = os.environ.get('LARGE_TEXT_BUCKET')
+LARGE_TEXT_PREFIX = 'large-text/'
+
+# Client dùng chung giữa các lần invoke trên cùng container (warm start), cùng bản với handler qua runtime
+s3_client = None
+
+def get_s3_client():
+    global s3_client
+    if s3_client is None:
+        s3_client = runtime.client('s3')
+    return s3_client
+
+def is_pointer(value):
+    return isinstance(value, dict) and 'StorageKey' in value
+
+def pack_text(text, storage_key):
+    """
+    Giá trị để ghi vào DynamoDB cho text. storage_key (ví dụ 'customer-call-analysis/<ContactId>/TranscriptionText')
+    là key trên S3 nếu text bị đưa ra ngoài
+    """
+    if text is None:
+        return None
+    data = text.encode('utf-8')
+    if len(data) < COMPRESS_MIN_BYTES:
+        return text
+
+    compressed = zlib.compress(data, COMPRESSION_LEVEL)
+    if len(compressed) >= OFFLOAD_MIN_BYTES and LARGE_TEXT_BUCKET:
+        key = f"{LARGE_TEXT_PREFIX}{storage_key}.zlib"
+        get_s3_client().put_object(Bucket=LARGE_TEXT_BUCKET, Key=key, Body=compressed)
+        return {'StorageBucket': LARGE_TEXT_BUCKET, 'StorageKey': key, 'Size': len(data)}
+    # Nén không giảm được (hiếm) thì giữ chuỗi gốc
+    return Binary(compressed) if len(compressed) < len(data) else text
+
+def unpack_text(value):
+    """Đọc lại giá trị do pack_text tạo (hoặc chuỗi của các item cũ)"""
+    if value is None or isinstance(value, str):
+        return value
+    if is_pointer(value):
+        body = get_s3_client().get_object(Bucket=value['StorageBucket'], Key=value['StorageKey'])['Body'].read()
+        return zlib.decompress(body).decode('utf-8')
+    if isinstance(value, Binary):
+        value = value.value
+    return zlib.decompress(bytes(value)).decode('utf-8')
+
+def json_default(value):
+    """Decimal của DynamoDB -> số JSON"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+def pack_json(data, storage_key):
+    """List/dict nhỏ được giữ nguyên kiểu DynamoDB, lớn thì lưu như text JSON"""
+    if data is None:
+        return None
+    text = json.dumps(data, default=json_default, ensure_ascii=False)
+    if len(text.encode('utf-8')) < COMPRESS_MIN_BYTES:
+        return data
+    return pack_text(text, storage_key)
+
+def unpack_json(value):
+    if value is None or (isinstance(value, (list, dict)) and not is_pointer(value)):
+        return value
+    return json.loads(unpack_text(value))
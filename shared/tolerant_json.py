@@ -0,0 +1,143 @@
+import re
+import json
+
+CLOSERS = {'{': '}', '[': ']'}
+STRUCTURE = re.compile(r'[{}\[\],"]')
+STRING_END = re.compile(r'["\\]')
+# Cho phép xuống dòng trong string như loads
+DECODER = json.JSONDecoder(strict=False)
+
+def scan_json_object(text, start=0):
+    """
+    Quét văn bản một lần từ dấu { đầu tiên, bỏ qua ký tự trong string.
+    Trả về (start, end, suffix, safe_end, safe_suffix):
+    - end: vị trí kết thúc object (hoặc len(text) nếu bị cắt)
+    - suffix: chuỗi cần thêm để đóng string/object đang dở
+    - safe_end, safe_suffix: điểm cắt sau phần tử hoàn chỉnh cuối cùng
+    """
+    start = text.find('{', start)
+    if start == -1:
+        return None
+    
+    stack = []
+    in_string = False
+    escaped = False
+    safe_end = None
+    safe_suffix = ''
+    
+    # Nhảy thẳng tới ký tự cấu trúc / hết string bằng regex thay vì duyệt từng ký tự
+    i = start
+    while True:
+        if in_string:
+            match = STRING_END.search(text, i)
+            if match is None:
+                break
+            if match.group() == '\\':
+                if match.end() == len(text):
+                    escaped = True
+                    break
+                i = match.end() + 1
+                continue
+            in_string = False
+            i = match.end()
+            continue
+        
+        match = STRUCTURE.search(text, i)
+        if match is None:
+            break
+        char = match.group()
+        i = match.end()
+        if char == '"':
+            in_string = True
+        elif char in CLOSERS:
+            stack.append(CLOSERS[char])
+        elif char == '}' or char == ']':
+            if stack:
+                stack.pop()
+            if not stack:
+                # Object đủ ngoặc nhưng không parse được (dấu phẩy thừa...) thì lùi về dấu phẩy cuối
+                return start, i, '', safe_end, safe_suffix
+        else:
+            # Phần trước dấu phẩy là một phần tử hoàn chỉnh
+            safe_end = i - 1
+            safe_suffix = ''.join(reversed(stack))
+    
+    # Văn bản bị cắt giữa chừng: đóng string và các object/array còn mở
+    end = len(text)
+    suffix = ''
+    if in_string:
+        if escaped:
+            end -= 1
+        suffix = '"'
+    suffix += ''.join(reversed(stack))
+    return start, end, suffix, safe_end, safe_suffix
+
+def loads(json_str):
+    """json.loads cho phép xuống dòng trong string (model hay trả về như vậy)"""
+    return json.loads(json_str, strict=False)
+
+def complete_json_object(text):
+    """
+    Đóng object JSON đầu tiên trong văn bản và parse nó. Đoạn {...} đủ ngoặc mà không phải JSON
+    (ví dụ trong phần tóm tắt) thì tìm tiếp sau nó.
+    Trả về (start, json_str, data). Raise ValueError nếu không tìm thấy JSON.
+    """
+    start = text.find('{')
+    if start == -1:
+        raise ValueError("Could not find valid JSON data in response")
+    
+    while True:
+        # Đường nhanh: object hợp lệ được parse thẳng bằng C decoder,
+        # chỉ quét từng token khi object bị cắt / sai cú pháp
+        try:
+            data, end = DECODER.raw_decode(text, start)
+            return start, text[start:end], data
+        except json.JSONDecodeError:
+            pass
+        
+        scanned = scan_json_object(text, start)
+        try:
+            return parse_scanned(text, scanned)
+        except json.JSONDecodeError:
+            # Object bị cắt kéo dài tới cuối văn bản nên không tìm tiếp được
+            start = text.find('{', scanned[1])
+            if start == -1:
+                raise
+
+def parse_scanned(text, scanned):
+    """Parse object do scan_json_object tìm được, raise json.JSONDecodeError nếu không được"""
+    start, end, suffix, safe_end, safe_suffix = scanned
+    json_str = text[start:end].rstrip()
+    
+    # Bỏ dấu phẩy thừa trước khi đóng object
+    if suffix and json_str.endswith(','):
+        json_str = json_str[:-1]
+    json_str += suffix
+    
+    try:
+        return start, json_str, loads(json_str)
+    except json.JSONDecodeError:
+        if safe_end is None:
+            raise
+    
+    # Phần tử cuối bị cắt dở (key thiếu value...), bỏ đi và đóng lại
+    json_str = text[start:safe_end] + safe_suffix
+    return start, json_str, loads(json_str)
+
+def extract_json(text):
+    """
+    Tách phần tóm tắt trước JSON và object JSON đầu tiên trong output của model.
+    Trả về (prefix, data).
+    """
+    start, _, data = complete_json_object(text)
+    return text[:start].strip(), data
+
+def repair_json(text):
+    """Trả về văn bản với object JSON đầu tiên đã được đóng đầy đủ"""
+    text = text.strip()
+    try:
+        start, json_str, _ = complete_json_object(text)
+    except ValueError:
+        # Không sửa được thì trả nguyên văn bản để phía nhận tự xử lý
+        return text
+    return text[:start] + json_str
@@ -11,7 +11,8 @@ import {
   Box,
   Tabs,
   CollectionPreferences,
-  TextFilter
+  TextFilter,
+  Button
 } from '@cloudscape-design/components';
 import { I18nProvider } from '@cloudscape-design/components/i18n';
 import messages from '@cloudscape-design/components/i18n/messages/all.en';
@@ -24,44 +25,23 @@ import './AppLayoutPreview.css';
 const LOCALE = 'en';
 const API_URL = 'https://9mehg9f4y9.execute-api.ap-southeast-1.amazonaws.com/dev/';
 const CUSTOMER_API_URL = 'https://r1y81iqs4c.execute-api.ap-southeast-1.amazonaws.com/dev/';
+const PAGE_SIZE = 50;
 
 // Thành phần thống kê tổng hợp
-const AnalyticsSummary = ({ data }) => {
+// Số liệu lấy từ rollup đã tính sẵn ở server (view=metrics)
+const AnalyticsSummary = ({ metrics }) => {
   const summary = useMemo(() => {
-    if (!data || !data.length) return null;
+    if (!metrics || !metrics.callCount) return null;
 
-    // Chuyển đổi điểm sang số và tính trung bình
-    const validScores = data
-      .filter(item => item?.Analysis?.compliance_score != null)
-      .map(item => Number(item.Analysis.compliance_score));
-
-    console.log('Valid scores:', validScores);
-
-    const sum = validScores.reduce((acc, score) => acc + score, 0);
-    console.log('Sum:', sum);
-
-    const avgCompliance = sum / validScores.length;
-    console.log('Average:', avgCompliance);
-
-    // Đếm số cuộc gọi
-    const totalCalls = data.length;
-
-    // Thống kê cảm xúc
-    const emotionCounts = data.reduce((acc, item) => {
-      const emotion = item.Analysis.customer_emotion;
-      acc[emotion] = (acc[emotion] || 0) + 1;
-      return acc;
-    }, {});
-
-    const mostCommonEmotion = Object.entries(emotionCounts)
-      .sort(([,a], [,b]) => b - a)[0][0];
+    const emotionEntries = Object.entries(metrics.emotions)
+      .sort(([,a], [,b]) => b - a);
 
     return {
-      avgCompliance: avgCompliance.toFixed(2),
-      totalCalls,
-      mostCommonEmotion
+      avgCompliance: metrics.avgCompliance != null ? metrics.avgCompliance.toFixed(2) : 'N/A',
+      totalCalls: metrics.callCount,
+      mostCommonEmotion: emotionEntries.length ? emotionEntries[0][0] : 'N/A'
     };
-  }, [data]);
+  }, [metrics]);
 
   if (!summary) return null;
 
@@ -114,21 +94,15 @@ const AnalyticsSummary = ({ data }) => {
 };
 
 // Biểu đồ tròn cảm xúc
-const EmotionPieChart = ({ data }) => {
+const EmotionPieChart = ({ metrics }) => {
   const emotionData = useMemo(() => {
-    if (!data || !data.length) return [];
-    
-    const emotionCounts = data.reduce((acc, item) => {
-      const emotion = item.Analysis.customer_emotion;
-      acc[emotion] = (acc[emotion] || 0) + 1;
-      return acc;
-    }, {});
+    if (!metrics) return [];
 
-    return Object.entries(emotionCounts).map(([name, value]) => ({
+    return Object.entries(metrics.emotions).map(([name, value]) => ({
       name,
       value
     }));
-  }, [data]);
+  }, [metrics]);
 
   // Màu sắc theo loại cảm xúc
   const getEmotionColor = (emotion) => {
@@ -171,31 +145,28 @@ const EmotionPieChart = ({ data }) => {
 };
 
 // Biểu đồ cột điểm compliance
-const ComplianceBarChart = ({ data }) => {
+const ComplianceBarChart = ({ metrics }) => {
   const complianceData = useMemo(() => {
-    if (!data || !data.length) return [];
+    if (!metrics) return [];
 
-    // Tạo các khoảng điểm với màu sắc tương ứng
+    // Các khoảng điểm (giống metrics-rollup.py) với màu sắc tương ứng
     const ranges = [
-      { range: '0-2', min: 0, max: 1.99, color: '#FF4D4D' },    // Đỏ đậm
-      { range: '2-4', min: 2, max: 3.99, color: '#FF7043' },    // Đỏ cam
-      { range: '4-6', min: 4, max: 5.99, color: '#9E9E9E' },    // Xám (trung bình)
-      { range: '6-8', min: 6, max: 7.99, color: '#81C784' },    // Xanh lá nhạt
-      { range: '8-10', min: 8, max: 10, color: '#00C49F' }      // Xanh lá đậm
+      { range: '0-2', color: '#FF4D4D' },    // Đỏ đậm
+      { range: '2-4', color: '#FF7043' },    // Đỏ cam
+      { range: '4-6', color: '#9E9E9E' },    // Xám (trung bình)
+      { range: '6-8', color: '#81C784' },    // Xanh lá nhạt
+      { range: '8-10', color: '#00C49F' }    // Xanh lá đậm
     ];
 
-    // Đếm số lượng trong mỗi khoảng
+    // Số lượng mỗi khoảng đã được đếm sẵn trong rollup
     const distribution = ranges.map(range => ({
       name: range.range,
-      count: data.filter(item => 
-        item.Analysis.compliance_score >= range.min && 
-        item.Analysis.compliance_score <= range.max
-      ).length,
+      count: metrics.scoreBuckets[range.range] || 0,
       color: range.color  // Thêm màu vào dữ liệu
     }));
 
     return distribution;
-  }, [data]);
+  }, [metrics]);
 
   return (
     <Box padding="l">
@@ -224,19 +195,19 @@ const ComplianceBarChart = ({ data }) => {
   );
 };
 // Thêm component Analytics Dashboard
-const AnalyticsDashboard = ({ data }) => {
-  if (!data) return <NoDataMessage />;
+const AnalyticsDashboard = ({ metrics }) => {
+  if (!metrics) return <NoDataMessage />;
 
   return (
     <Container>
       <div className="analytics-container">
         {/* Statistical Summary */}
-        <AnalyticsSummary data={data} />
+        <AnalyticsSummary metrics={metrics} />
         
         {/* Charts */}
         <div className="charts-grid">
-          <EmotionPieChart data={data} />
-          <ComplianceBarChart data={data} />
+          <EmotionPieChart metrics={metrics} />
+          <ComplianceBarChart metrics={metrics} />
         </div>
       </div>
     </Container>
@@ -261,31 +232,93 @@ const NoDataMessage = () => (
 );
 
 // Custom Hooks
-const useAnalysisData = (url) => {
+// Danh sách kết quả có phân trang, đã được sắp xếp theo CallDate ở server (order=asc|desc);
+// không sắp xếp lại ở client vì chỉ có các trang đã tải.
+// Khi có query thì dùng kết quả tìm kiếm đã xếp hạng ở server (q=)
+const useAnalysisData = (url, query, order) => {
   const [data, setData] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState(null);
 
+  const fetchPage = async (cursor) => {
+    setIsLoading(true);
+    try {
+      const params = new URLSearchParams({ limit: PAGE_SIZE });
+      if (cursor) params.set('cursor', cursor);
+      if (query) params.set('q', query);
+      else params.set('order', order);
+      const response = await fetch(`${url}?${params}`);
+      const result = await response.json();
+      const analysisData = JSON.parse(result.body);
+      if (analysisData.success && analysisData.data) {
+        setData(prev => (cursor && prev ? [...prev, ...analysisData.data] : analysisData.data));
+        setNextCursor(analysisData.nextCursor);
+      }
+    } catch (err) {
+      setError(err.message);
+    } finally {
+      setIsLoading(false);
+    }
+  };
+
   useEffect(() => {
-    const fetchData = async () => {
+    fetchPage(null);
+  }, [url, query, order]);
+
+  const loadMore = () => nextCursor && fetchPage(nextCursor);
+
+  return { data, isLoading, error, hasMore: !!nextCursor, loadMore };
+};
+
+// Chi tiết phân tích đầy đủ của một cuộc gọi, chỉ tải khi được chọn
+const useAnalysisDetail = (url, contactId) => {
+  const [detail, setDetail] = useState(null);
+
+  useEffect(() => {
+    if (!contactId) return;
+    setDetail(null);
+    const fetchDetail = async () => {
       try {
-        const response = await fetch(url);
+        const response = await fetch(`${url}?contactId=${encodeURIComponent(contactId)}`);
         const result = await response.json();
-        const analysisData = JSON.parse(result.body);
-        if (analysisData.success && analysisData.data) {
-          setData(analysisData.data);
+        const detailData = JSON.parse(result.body);
+        if (detailData.success && detailData.data) {
+          setDetail(detailData.data);
         }
       } catch (err) {
-        setError(err.message);
-      } finally {
-        setIsLoading(false);
+        console.error('Error loading analysis detail:', err);
       }
     };
 
-    fetchData();
+    fetchDetail();
+  }, [url, contactId]);
+
+  return detail;
+};
+
+// Rollup dashboard (mặc định 30 ngày gần nhất) từ endpoint view=metrics
+const useMetricsData = (url) => {
+  const [metrics, setMetrics] = useState(null);
+
+  useEffect(() => {
+    const fetchMetrics = async () => {
+      try {
+        const response = await fetch(`${url}?view=metrics`);
+        const result = await response.json();
+        const metricsData = JSON.parse(result.body);
+        if (metricsData.success && metricsData.data) {
+          setMetrics(metricsData.data.totals);
+        }
+      } catch (err) {
+        console.error('Error loading metrics:', err);
+      }
+    };
+
+    fetchMetrics();
   }, [url]);
 
-  return { data, isLoading, error };
+  return metrics;
 };
 
 const useCustomerData = (url) => {
@@ -452,12 +485,22 @@ export default function CallAnalysisDashboard() {
   const [navigationOpen, setNavigationOpen] = useState(false);
   const [selectedItemId, setSelectedItemId] = useState(0);
   const [activeTab, setActiveTab] = useState('analysis');
+  const [searchText, setSearchText] = useState('');
+  const [searchQuery, setSearchQuery] = useState('');
+
+  // Chỉ cột thời gian sắp xếp được (theo CallDate ở server)
+  const [sortingDescending, setSortingDescending] = useState(true);
 
-  const { data, isLoading: analysisLoading, error: analysisError } = useAnalysisData(API_URL);
+  const { data, isLoading: analysisLoading, error: analysisError, hasMore, loadMore } = useAnalysisData(
+    API_URL, searchQuery, sortingDescending ? 'desc' : 'asc'
+  );
   const { customerData, isLoading: customerLoading, error: customerError } = useCustomerData(CUSTOMER_API_URL);
+  const detail = useAnalysisDetail(API_URL, data?.[selectedItemId]?.ContactId);
+  const metrics = useMetricsData(API_URL);
 
   const error = analysisError || customerError;
-  const isLoading = analysisLoading || customerLoading;
+  // Chỉ hiện spinner toàn trang ở lần tải đầu tiên
+  const isLoading = (analysisLoading && !data) || customerLoading;
 
   const navigationItems = useMemo(() => {
     if (!data) return [];
@@ -473,41 +516,14 @@ export default function CallAnalysisDashboard() {
     }));
   }, [data, selectedItemId]);
 
-  // Thêm state để theo dõi trạng thái sắp xếp
-const [sortingColumn, setSortingColumn] = useState({ sortingField: "Timestamp", sortingDescending: true });
-
-// Hàm sắp xếp dữ liệu
-const getSortedItems = (items, column, descending) => {
-  if (!column) return items;
-
-  return [...items].sort((a, b) => {
-    let valueA, valueB;
-    
-    // Xử lý các trường hợp đặc biệt
-    if (column === 'Timestamp') {
-      valueA = new Date(a.AnalysisTimestamp.replace(' ', 'T')).getTime();
-      valueB = new Date(b.AnalysisTimestamp.replace(' ', 'T')).getTime();
-    } else if (column === 'Name') {
-      valueA = `\${a.CustomerInfo?.FirstName || ''} \${a.CustomerInfo?.MiddleName || ''} \${a.CustomerInfo?.LastName || ''}`.trim();
-      valueB = `\${b.CustomerInfo?.FirstName || ''} \${b.CustomerInfo?.MiddleName || ''} \${b.CustomerInfo?.LastName || ''}`.trim();
-    } else {
-      valueA = a[column];
-      valueB = b[column];
-    }
-
-    // So sánh
-    if (valueA < valueB) return descending ? 1 : -1;
-    if (valueA > valueB) return descending ? -1 : 1;
-    return 0;
-  });
-};
   const renderSelectedItem = () => {
     if (!data || selectedItemId === null) return null;
     
-    const item = data[selectedItemId];
+    const item = detail;
     return (
       <>
         {/* Analysis Details Container */}
+        {!item ? (data.length ? <LoadingSpinner /> : null) : (
         <Container
   header={
       <Header
@@ -623,6 +639,7 @@ const getSortedItems = (items, column, descending) => {
             </div>
           </div>
         </Container>
+        )}
 
         {/* Analysis History Table */}
         <Container
@@ -640,26 +657,23 @@ const getSortedItems = (items, column, descending) => {
               {
                 id: 'fileName',
                 header: 'ContactId',
-                cell: item => item.ContactId,
-                sortingField: 'ContactId'
+                cell: item => item.ContactId
               },
               {
                 id: 'Name',
                 header: 'Name',
-                cell: item => item.CustomerInfo?.FirstName+" " +item.CustomerInfo?.MiddleName+" " +item.CustomerInfo?.LastName,
-                sortingField: 'Name'
+                cell: item => item.CustomerInfo?.FirstName+" " +item.CustomerInfo?.MiddleName+" " +item.CustomerInfo?.LastName
               },
               {
                 id: 'phoneNumber',
                 header: 'Phone Number',
-                cell: item => item.PhoneNumber,
-                sortingField: 'PhoneNumber'
+                cell: item => item.PhoneNumber
               },
               {
                 id: 'timestamp',
                 header: 'Timestamp',
                 cell: item => new Date(item.AnalysisTimestamp.replace(' ', 'T')).toLocaleString(),
-                sortingField: 'Timestamp'
+                sortingField: 'CallDate'
               },
               {
                 id: 'score',
@@ -672,12 +686,11 @@ const getSortedItems = (items, column, descending) => {
                   >
                     {item.Analysis.compliance_score}
                   </Box>
-                ),
-                sortingField: 'score'
+                )
               }
             ]}
-            items={getSortedItems(data, sortingColumn.sortingField, sortingColumn.sortingDescending)}
-            selectedItems={[data[selectedItemId]]}
+            items={data}
+            selectedItems={data[selectedItemId] ? [data[selectedItemId]] : []}
             selectionType="single"
             onSelectionChange={({ detail }) => {
               const selectedIndex = data.findIndex(item => item === detail.selectedItems[0]);
@@ -685,12 +698,37 @@ const getSortedItems = (items, column, descending) => {
                 setSelectedItemId(selectedIndex);
               }
             }}
-            sortingColumn={sortingColumn}
-            onSortingChange={({ detail }) => setSortingColumn(detail)}
+            sortingColumn={{ sortingField: 'CallDate' }}
+            sortingDescending={sortingDescending}
+            sortingDisabled={!!searchQuery}
+            onSortingChange={({ detail }) => {
+              setSelectedItemId(0);
+              setSortingDescending(detail.isDescending);
+            }}
             variant="container"
             stickyHeader
             stripedRows
             wrapLines={false}
+            filter={
+              <TextFilter
+                filteringPlaceholder="Search transcripts, violations, recommendations"
+                filteringText={searchText}
+                onChange={({ detail }) => setSearchText(detail.filteringText)}
+                onDelayedChange={({ detail }) => {
+                  setSelectedItemId(0);
+                  setSearchQuery(detail.filteringText.trim());
+                }}
+              />
+            }
+            footer={
+              hasMore && (
+                <Box textAlign="center">
+                  <Button onClick={loadMore} loading={analysisLoading}>
+                    Load more
+                  </Button>
+                </Box>
+              )
+            }
           />
         </Container>
       </>
@@ -751,7 +789,7 @@ const getSortedItems = (items, column, descending) => {
                   <h3>Error Loading Data</h3>
                   <p>{error}</p>
                 </div>
-              ) : !data || data.length === 0 ? (
+              ) : !data || (data.length === 0 && !searchQuery) ? (
                 <NoDataMessage />
               ) : (
                 <Tabs
@@ -776,7 +814,7 @@ const getSortedItems = (items, column, descending) => {
                     {
                       label: "Analytics Dashboard",
                       id: "analytics",
-                      content: <AnalyticsDashboard data={data} />
+                      content: <AnalyticsDashboard metrics={metrics} />
                     }
                   ]}
                 />
@@ -1,231 +1,409 @@
+import os
 import json
-import requests
-import re
-from urllib.parse import urlencode
-import boto3
 from datetime import datetime
 from decimal import Decimal
 import logging
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+import runtime
+from tolerant_json import complete_json_object, extract_json
+from text_storage import pack_text, unpack_text, unpack_json
+from instrumentation import stage_timer, record_payload, log_sampled
 
 # Cấu hình logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def lambda_handler(event, context):
-    API_ENDPOINT = "https://dkk8q33lo5.execute-api.us-west-2.amazonaws.com/dev/"
+API_ENDPOINT = os.environ.get('ANALYSIS_API_ENDPOINT', "https://dkk8q33lo5.execute-api.us-west-2.amazonaws.com/dev/")
+# Số request phân tích chạy song song trong một batch
+MAX_WORKERS = 8
+# (connect timeout, read timeout) tính bằng giây, API Gateway tự cắt ở 29s
+API_TIMEOUT = (3.05, 30)
+# Mỗi POST phân tích gọi model (tốn phí, không idempotent) nên chỉ gửi lại khi API chắc chắn chưa xử lý:
+# lỗi kết nối và 429. 5xx / timeout khi đọc có thể đã gọi model, record được stream retry dưới claim
+HTTP_RETRY = {
+    'total': 3,
+    'connect': 3,
+    'read': 0,
+    'other': 0,
+    'backoff_factor': 0.5,
+    'status_forcelist': [429],
+    'allowed_methods': ['POST']
+}
+
+RESULTS_TABLE_NAME = 'analysis-results-it-got-talent'
+# Bảng claim chống phân tích trùng khi stream retry, TTL attribute ExpiresAt
+IDEMPOTENCY_TABLE_NAME = 'analysis-idempotency'
+# Thời gian giữ claim IN_PROGRESS, phải lớn hơn timeout của Lambda
+CLAIM_LEASE_SECONDS = 300
+# Thời gian giữ claim COMPLETED để nhận biết record bị replay
+CLAIM_TTL_SECONDS = 7 * 24 * 3600
+
+idempotency_stats = {'claimed': 0, 'duplicates_suppressed': 0, 'in_progress_retried': 0, 'stale_writes_skipped': 0,
+                     'failed_permanently': 0}
+stats_lock = threading.Lock()
+
+# requests chỉ cần khi batch có record INSERT, import khi tạo session
+requests = runtime.lazy_import('requests')
+requests_adapters = runtime.lazy_import('requests.adapters')
+urllib3_retry = runtime.lazy_import('urllib3.util.retry')
+
+# Client dùng chung giữa các lần invoke trên cùng container (warm start)
+http_session = None
+dynamodb = None
+
+def get_http_session():
+    """Session keep-alive với connection pool, retry theo HTTP_RETRY có backoff"""
+    global http_session
+    if http_session is None:
+        retry = urllib3_retry.Retry(**HTTP_RETRY)
+        adapter = requests_adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Content-Type': 'application/json'})
+        http_session = session
+    return http_session
+
+def get_dynamodb():
+    """Khởi tạo DynamoDB resource một lần cho mỗi container"""
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = runtime.resource('dynamodb')
+    return dynamodb
+
+def count_stat(stat):
+    with stats_lock:
+        idempotency_stats[stat] += 1
+
+class ClaimInProgressError(Exception):
+    """Record đang được một lần invoke khác xử lý"""
+
+class PermanentRecordError(Exception):
+    """Lỗi mà retry không sửa được (transcript rỗng, output không parse được), không báo batchItemFailures"""
+
+def get_idempotency_key(record_data):
+    """ContactId + hash của transcript: cùng cuộc gọi, cùng nội dung thì chỉ phân tích một lần"""
+    transcript_hash = hashlib.sha256(record_data['prompt'].encode('utf-8')).hexdigest()
+    return f"{record_data['contactId']}#{transcript_hash}", transcript_hash
+
+def claim_record(idempotency_key):
+    """
+    Ghi claim có điều kiện trước khi gọi API. Trả về True nếu được xử lý, False nếu đã xử lý xong
+    hoặc đã lỗi vĩnh viễn (FAILED); raise ClaimInProgressError nếu đang xử lý
+    """
+    now = int(time.time())
+    table = get_dynamodb().Table(IDEMPOTENCY_TABLE_NAME)
+    try:
+        table.put_item(
+            Item={
+                'IdempotencyKey': idempotency_key,
+                'Status': 'IN_PROGRESS',
+                'LeaseExpiresAt': now + CLAIM_LEASE_SECONDS,
+                'ExpiresAt': now + CLAIM_TTL_SECONDS
+            },
+            # Chưa có claim, hoặc claim IN_PROGRESS đã hết hạn (lần xử lý trước bị dừng giữa chừng)
+            ConditionExpression='attribute_not_exists(IdempotencyKey) OR (#s = :in_progress AND LeaseExpiresAt < :now)',
+            ExpressionAttributeNames={'#s': 'Status'},
+            ExpressionAttributeValues={':in_progress': 'IN_PROGRESS', ':now': now},
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+        count_stat('claimed')
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        existing = e.response.get('Item', {})
+        if existing.get('Status', {}).get('S') in ('COMPLETED', 'FAILED'):
+            count_stat('duplicates_suppressed')
+            return False
+        count_stat('in_progress_retried')
+        raise ClaimInProgressError(f"Record {idempotency_key} is being processed by another invocation")
+
+def complete_claim(idempotency_key):
+    get_dynamodb().Table(IDEMPOTENCY_TABLE_NAME).update_item(
+        Key={'IdempotencyKey': idempotency_key},
+        UpdateExpression='SET #s = :completed',
+        ExpressionAttributeNames={'#s': 'Status'},
+        ExpressionAttributeValues={':completed': 'COMPLETED'}
+    )
+
+def fail_claim(idempotency_key, reason):
+    """
+    Lỗi vĩnh viễn (transcript rỗng, output không parse được): giữ claim ở FAILED tới hết TTL thay vì xóa,
+    để record được giao lại không phân tích lại cùng transcript
+    """
+    count_stat('failed_permanently')
+    try:
+        get_dynamodb().Table(IDEMPOTENCY_TABLE_NAME).update_item(
+            Key={'IdempotencyKey': idempotency_key},
+            UpdateExpression='SET #s = :failed, FailureReason = :reason',
+            ExpressionAttributeNames={'#s': 'Status'},
+            ExpressionAttributeValues={':failed': 'FAILED', ':reason': reason[:1000]}
+        )
+    except Exception as e:
+        # Claim IN_PROGRESS tự hết hạn sau CLAIM_LEASE_SECONDS
+        logger.error(f"Error marking claim {idempotency_key} failed: {str(e)}")
+
+def is_result_saved(contact_id, transcript_hash):
+    """Kết quả của đúng transcript này đã được lưu (claim có thể còn IN_PROGRESS nếu complete_claim lỗi)"""
+    item = get_dynamodb().Table(RESULTS_TABLE_NAME).get_item(
+        Key={'ContactId': contact_id},
+        ProjectionExpression='TranscriptHash',
+        ConsistentRead=True
+    ).get('Item')
+    return bool(item) and item.get('TranscriptHash') == transcript_hash
+
+def release_claim(idempotency_key):
+    """Xóa claim khi xử lý lỗi để lần retry được phân tích lại ngay"""
+    try:
+        get_dynamodb().Table(IDEMPOTENCY_TABLE_NAME).delete_item(Key={'IdempotencyKey': idempotency_key})
+    except Exception as e:
+        # Claim sẽ tự hết hạn sau CLAIM_LEASE_SECONDS
+        logger.error(f"Error releasing claim {idempotency_key}: {str(e)}")
+
+def get_queue_name(queue_info):
+    """QueueInfo là object Queue của Amazon Connect hoặc chuỗi 'No Queue'"""
+    if 'M' in queue_info:
+        return queue_info['M'].get('Name', {}).get('S', 'No Queue')
+    return queue_info.get('S', 'No Queue')
+
+def parse_segments(image_value):
+    """TranscriptSegments dạng DynamoDB Stream -> list dict gửi được qua JSON"""
+    if not image_value:
+        return None
+    # List đoạn nhỏ, hoặc text JSON đã nén / đưa lên S3 với cuộc gọi dài
+    segments = unpack_json(TypeDeserializer().deserialize(image_value))
+    return [
+        {
+            'speaker': segment['speaker'],
+            'start': float(segment['start']),
+            'end': float(segment['end']),
+            'text': segment['text']
+        }
+        for segment in segments
+    ]
+
+def has_new_transcript(record):
+    """
+    Record có TranscriptionText mới. Bản ghi cuộc gọi (get-customer-profile / contact-writer) được
+    INSERT khi chưa có transcript; transcribe-complete thêm transcript bằng update_item nên là MODIFY
+    """
+    if record['eventName'] not in ('INSERT', 'MODIFY'):
+        return False
+    stream_data = record['dynamodb']
+    new_text = stream_data.get('NewImage', {}).get('TranscriptionText')
+    if not new_text:
+        return False
+    # Stream NEW_AND_OLD_IMAGES: bỏ các MODIFY không đổi transcript (cập nhật trạng thái...)
+    return new_text != stream_data.get('OldImage', {}).get('TranscriptionText')
+
+def parse_record(record):
+    """Lấy thông tin cần phân tích từ new image của DynamoDB Stream record"""
+    new_image = record['dynamodb']['NewImage']
+    # Item do audio-text tạo khi bản ghi cuộc gọi chưa tới thì thiếu CallDate / PhoneNumber
+    call_date = new_image.get('CallDate') or new_image.get('TranscriptionTimestamp')
+    return {
+        'sequenceNumber': record['dynamodb']['SequenceNumber'],
+        # Thời điểm ghi transcript, dùng làm version khi ghi kết quả
+        'source_timestamp': Decimal(str(record['dynamodb'].get('ApproximateCreationDateTime', 0))),
+        'contactId': new_image['ContactId']['S'],
+        'call_date': call_date['S'],
+        'phone_number': new_image.get('PhoneNumber', {}).get('S', 'Unknown'),
+        'queue_name': get_queue_name(new_image.get('QueueInfo', {})),
+        'prompt': unpack_text(TypeDeserializer().deserialize(new_image['TranscriptionText'])),
+        'segments': parse_segments(new_image.get('TranscriptSegments'))
+    }
+
+def analyze_record(record_data):
+    """Gọi API phân tích cho một record, trả về (analysis_result, raw_response)"""
+    contactId = record_data['contactId']
+    prompt = record_data['prompt']
     
-    logger.info(f"Received event: {json.dumps(event)}")
+    logger.info(f"ContactId: {contactId}")
     
+    if not prompt:
+        logger.error("Empty transcription text received")
+        raise PermanentRecordError("Empty transcription text")
+    
+    payload = {
+        "prompt": prompt
+    }
+    # Các đoạn theo người nói để API tách lời nhân viên / khách hàng
+    if record_data.get('segments'):
+        payload['segments'] = record_data['segments']
+    
+    record_payload('HttpRequest', payload)
+    with stage_timer('HttpCall'):
+        response = get_http_session().post(
+            API_ENDPOINT,
+            json=payload,
+            timeout=API_TIMEOUT
+        )
+    
+    logger.info(f"API Response status code: {response.status_code}")
+    record_payload('HttpResponse', response.text)
+    
+    if response.status_code != 200:
+        logger.error(f"API request failed with status {response.status_code}: {response.text}")
+        # 4xx (trừ 429) là request sai, gửi lại cũng bị từ chối
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            raise PermanentRecordError(f"API rejected request: {response.text}")
+        raise Exception(f"API request failed: {response.text}")
+    
+    with stage_timer('JsonRepair'):
+        analysis_result = process_response(response.text)
+    return analysis_result, response.text
+
+def process_record(record_data):
+    """Claim -> gọi API -> ghi kết quả có điều kiện -> đánh dấu hoàn tất"""
+    idempotency_key, transcript_hash = get_idempotency_key(record_data)
     try:
-        # Xử lý DynamoDB Stream event
-        for record in event['Records']:
-            logger.info(f"Processing record: {json.dumps(record)}")
-            
-            # Chỉ xử lý các records mới được insert
-            if record['eventName'] == 'INSERT':
-                # Lấy thông tin từ new image
-                new_image = record['dynamodb']['NewImage']
-                contactId = new_image['ContactId']['S']
-                call_date = new_image['CallDate']['S']
-                phone_number = new_image['PhoneNumber']['S']
-                prompt = new_image['TranscriptionText']['S']
-                
-                logger.info(f"ContactId: {contactId}")
-                logger.info(f"Transcription text: {prompt}")
-                
-                if not prompt:
-                    logger.error("Empty transcription text received")
-                    raise ValueError("Empty transcription text")
-                
-                headers = {
-                    'Content-Type': 'application/json'
-                }
-                payload = {
-                    "prompt": prompt
-                }
-                
-                logger.info(f"Sending request to API: {API_ENDPOINT}")
-                logger.debug(f"Request payload: {json.dumps(payload)}")
-                
-                response = requests.post(
-                    API_ENDPOINT,
-                    headers=headers,
-                    json=payload
-                )
-                
-                logger.info(f"API Response status code: {response.status_code}")
-                logger.info(f"API Response content: {response.text}")
-                
-                if response.status_code == 200:
-                    try:
-                        analysis_result = process_response(response.text)
-                        logger.info(f"Analysis result: {json.dumps(analysis_result)}")
-                        
-                        save_result = save_analysis_result(
-                            contactId=contactId,
-                            call_date=call_date,
-                            phone_number=phone_number,
-                            analysis=analysis_result,
-                            raw_response=response.text
-                        )
-                        return {
-                            'statusCode': 200,
-                            'body': json.dumps({
-                                'message': 'Analysis completed and saved successfully',
-                                'analysis': analysis_result,
-                                'contactId': contactId
-                            })
-                        }
-                    except Exception as e:
-                        logger.error(f"Error processing response: {str(e)}", exc_info=True)
-                        return error_response(500, str(e))
-                else:
-                    logger.error(f"API request failed with status {response.status_code}: {response.text}")
-                    return error_response(response.status_code, f"API request failed: {response.text}")
-                    
- 
+        claimed = claim_record(idempotency_key)
+    except ClaimInProgressError:
+        # Lần trước đã lưu kết quả nhưng không đánh dấu được COMPLETED: không cần chờ hết lease
+        if not is_result_saved(record_data['contactId'], transcript_hash):
+            raise
+        claimed = False
+        try:
+            complete_claim(idempotency_key)
+        except Exception as e:
+            logger.error(f"Error completing claim {idempotency_key}: {str(e)}")
+    if not claimed:
+        logger.info(f"Skipping already processed ContactId {record_data['contactId']}")
+        return
+    
+    try:
+        analysis_result, raw_response = analyze_record(record_data)
+        save_analysis_result(
+            contactId=record_data['contactId'],
+            call_date=record_data['call_date'],
+            phone_number=record_data['phone_number'],
+            queue_name=record_data['queue_name'],
+            analysis=analysis_result,
+            raw_response=raw_response,
+            source_timestamp=record_data['source_timestamp'],
+            transcript_hash=transcript_hash
+        )
+    except PermanentRecordError as e:
+        fail_claim(idempotency_key, str(e))
+        raise
+    except Exception:
+        release_claim(idempotency_key)
+        raise
+    
+    # Kết quả đã lưu: lỗi ở đây không được làm record bị retry, lần giao lại (nếu có) thấy kết quả qua is_result_saved
+    try:
+        complete_claim(idempotency_key)
     except Exception as e:
-        logger.error(f"Error in lambda handler: {str(e)}", exc_info=True)
-        return error_response(500, str(e))
+        logger.error(f"Error completing claim {idempotency_key}: {str(e)}")
+
+def lambda_handler(event, context):
+    logger.info(f"Received {len(event['Records'])} stream records")
+    log_sampled('event', event)
+    
+    # Chỉ xử lý các records vừa có transcript, bản ghi cuộc gọi chưa có transcript được bỏ qua
+    records = [record for record in event['Records'] if has_new_transcript(record)]
+    failed_sequence_numbers = []
+    skipped = 0
+    
+    if not records:
+        return {'batchItemFailures': []}
+    
+    # Khởi tạo trước khi chia cho các worker thread
+    get_http_session()
+    get_dynamodb()
+    
+    # Xử lý đồng thời các records trong batch, giới hạn số worker
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(records))) as executor:
+        futures = {}
+        for record in records:
+            try:
+                record_data = parse_record(record)
+            except Exception as e:
+                # Record sai cấu trúc: retry chỉ chặn shard, không bao giờ thành công
+                logger.error(f"Invalid stream record, skipping: {str(e)}", exc_info=True)
+                skipped += 1
+                continue
+            futures[executor.submit(process_record, record_data)] = record_data
+        
+        for future in as_completed(futures):
+            record_data = futures[future]
+            try:
+                future.result()
+            except PermanentRecordError as e:
+                logger.error(f"Skipping ContactId {record_data['contactId']}: {str(e)}")
+                skipped += 1
+            except Exception as e:
+                logger.error(f"Error analyzing ContactId {record_data['contactId']}: {str(e)}", exc_info=True)
+                failed_sequence_numbers.append(record_data['sequenceNumber'])
+    
+    logger.info(f"Processed {len(records)} records, {len(failed_sequence_numbers)} failed, {skipped} skipped")
+    logger.info(f"Idempotency stats: {json.dumps(idempotency_stats)}")
+    
+    # Chỉ các records lỗi được DynamoDB Stream retry (ReportBatchItemFailures)
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': sequence_number} for sequence_number in failed_sequence_numbers
+        ]
+    }
 
 def process_response(response_text):
     try:
-        # Parse JSON response 
-        response_text = fix_json_string(response_text)
-        logger.info(f"Fixed JSON string: {response_text}")
-        response_data = json.loads(response_text)
+        # Parse JSON response (body của API, sửa nếu bị cắt)
+        _, _, response_data = complete_json_object(response_text)
         
-        # Lấy và xử lý nội dung result
+        # Lấy và xử lý nội dung result: phần tóm tắt + object JSON đầu tiên
         result_content = response_data.get('result', '')
+        summary, analysis_data = extract_json(result_content)
         
-        # Tìm vị trí bắt đầu của JSON object
-        start_idx = result_content.find('{')
+        # Extract thông tin
+        analysis_result = {
+            'summary': summary,
+            'compliance_score': analysis_data.get('compliance_score', 0),
+            'violations': analysis_data.get('violations', []),
+            'recommendations': analysis_data.get('recommendations', []),
+            'detailed_analysis': analysis_data.get('detailed_analysis', ''),
+            "customer_emotion": analysis_data.get('customer_emotion', 'trung tính'),
+            "emotion_details": analysis_data.get('emotion_details', ''),
+        }
+        # Version quy định compliance mà API đã dùng để chấm
+        if response_data.get('ruleVersion'):
+            analysis_result['rule_version'] = response_data['ruleVersion']
         
-        if start_idx != -1:
-            # Lấy phần JSON và sửa nếu cần
-            inner_json = result_content[start_idx:]
-            inner_json = fix_inner_json(inner_json)
-            
-            logger.info(f"Inner JSON after fixing: {inner_json}")
-            analysis_data = json.loads(inner_json)
-            
-            # Extract thông tin
-            analysis_result = {
-                'summary': result_content[:start_idx].strip(),
-                'compliance_score': analysis_data.get('compliance_score', 0),
-                'violations': analysis_data.get('violations', []),
-                'recommendations': analysis_data.get('recommendations', []),
-                'detailed_analysis': analysis_data.get('detailed_analysis', ''),
-                "customer_emotion": analysis_data.get('customer_emotion', 'trung tính'),
-                "emotion_details": analysis_data.get('emotion_details', ''),
-            }
+        return analysis_result
             
-            return analysis_result
-        else:
-            raise Exception("Could not find valid JSON data in response")
-            
-    except json.JSONDecodeError as e:
+    except ValueError as e:
+        # Gồm json.JSONDecodeError và không tìm thấy JSON trong output
         logger.error(f"JSON decode error: {str(e)}")
         logger.error(f"Problematic text: {response_text}")
-        raise Exception(f"Failed to parse JSON response: {str(e)}")
+        raise PermanentRecordError(f"Failed to parse JSON response: {str(e)}")
     except Exception as e:
         logger.error(f"Error processing response: {str(e)}")
         raise
 
-def fix_inner_json(json_str):
-    """Sửa JSON string bên trong"""
-    try:
-        # Nếu JSON đã hợp lệ, return luôn
-        if is_valid_json(json_str):
-            return json_str
-            
-        # Đếm số dấu { và }
-        open_braces = json_str.count('{')
-        close_braces = json_str.count('}')
-        
-        # Nếu thiếu dấu đóng
-        if open_braces > close_braces:
-            # Kiểm tra xem có phải thiếu .\"\n}" không
-            if json_str.rstrip().endswith('"'):
-                json_str = json_str.rstrip() + '.\"\n}'
-                logger.info("Added .\"\\n} to the end")
-            else:
-                # Thêm số lượng } còn thiếu
-                json_str = json_str + ('}' * (open_braces - close_braces))
-                logger.info(f"Added {open_braces - close_braces} closing braces")
-                
-        # Thử sửa một số trường hợp cụ thể
-        if not is_valid_json(json_str):
-            # Nếu kết thúc bằng dấu " mà chưa có }
-            if json_str.rstrip().endswith('"'):
-                json_str = json_str.rstrip() + '}'
-                logger.info("Added closing brace after quote")
-                
-            # Nếu thiếu dấu " trước }
-            elif json_str.rstrip().endswith('}'):
-                json_str = json_str.rstrip()[:-1] + '"}'
-                logger.info("Added quote before closing brace")
-        
-        return json_str
-        
-    except Exception as e:
-        logger.error(f"Error fixing inner JSON: {str(e)}")
-        return json_str
-
-def fix_json_string(json_str):
-    """Sửa JSON string không hợp lệ"""
-    try:
-        # Nếu JSON đã hợp lệ, return luôn
-        if is_valid_json(json_str):
-            return json_str
-            
-        # Đếm số dấu { và }
-        open_braces = json_str.count('{')
-        close_braces = json_str.count('}')
-        
-        # Nếu thiếu dấu }, thêm vào
-        if open_braces > close_braces:
-            missing_braces = open_braces - close_braces
-            json_str = json_str + ('"}' * missing_braces)
-            logger.warning(f"Fixed JSON by adding {missing_braces} closing quote and brace(s)")
-        
-        # Loại bỏ các ký tự không hợp lệ ở cuối
-        json_str = json_str.strip()
-        
-        # Nếu vẫn không hợp lệ, thử thêm "} vào cuối
-        if not is_valid_json(json_str):
-            test_str = json_str + '"}'
-            if is_valid_json(test_str):
-                json_str = test_str
-                logger.warning("Fixed JSON by adding closing quote and brace at the end")
-                
-        return json_str
-        
-    except Exception as e:
-        logger.error(f"Error fixing JSON string: {str(e)}")
-        return json_str
-
-def is_valid_json(json_str):
-    """Kiểm tra JSON có hợp lệ không"""
-    try:
-        json.loads(json_str)
-        return True
-    except:
-        return False
-
-
-def save_analysis_result(contactId, call_date, phone_number, analysis, raw_response=None):
-    """Lưu kết quả phân tích vào DynamoDB"""
+def save_analysis_result(contactId, call_date, phone_number, analysis, raw_response=None, queue_name='No Queue',
+                         source_timestamp=None, transcript_hash=None):
+    """
+    Lưu kết quả phân tích vào DynamoDB. Có source_timestamp thì chỉ ghi đè kết quả
+    của transcript cũ hơn, trả về None nếu đã có kết quả mới hơn
+    """
     logger.info(f"Starting save_analysis_result for contactId: {contactId}")
     try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('analysis-results-it-got-talent')
+        table = get_dynamodb().Table(RESULTS_TABLE_NAME)
         
         # Chuẩn bị item để lưu
         item = {
             'ContactId': contactId,
             'CallDate': call_date,
+            # Partition key của GSI CallDay-CallDate-index (lọc theo ngày)
+            'CallDay': call_date[:10],
             'PhoneNumber': phone_number,
+            'QueueName': queue_name,
             'Analysis': {
                 'compliance_score': str(analysis.get('compliance_score', 0)),
                 'violations': analysis.get('violations', []),
@@ -237,31 +415,37 @@ def save_analysis_result(contactId, call_date, phone_number, analysis, raw_respo
             'AnalysisTimestamp': datetime.now().isoformat()
         }
         
+        # Lưu version quy định để chỉ chấm lại các cuộc gọi của version cũ (tools/rescore.py --stale-rules)
+        if analysis.get('rule_version'):
+            item['Analysis']['rule_version'] = analysis['rule_version']
+            item['RuleVersion'] = analysis['rule_version']
+        
         if raw_response:
-            item['RawResponse'] = raw_response
+            item['RawResponse'] = pack_text(raw_response, f"{RESULTS_TABLE_NAME}/{contactId}/RawResponse")
+        
+        put_kwargs = {'Item': item}
+        if source_timestamp is not None:
+            item['SourceTimestamp'] = source_timestamp
+            item['TranscriptHash'] = transcript_hash
+            put_kwargs['ConditionExpression'] = 'attribute_not_exists(SourceTimestamp) OR SourceTimestamp <= :src'
+            put_kwargs['ExpressionAttributeValues'] = {':src': source_timestamp}
             
-        logger.info(f"Prepared DynamoDB item: {json.dumps(item)}")
+        record_payload('DynamoDBItem', item)
         
         # Lưu vào DynamoDB
-        response = table.put_item(Item=item)
+        try:
+            with stage_timer('DynamoDBWrite'):
+                response = table.put_item(**put_kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            count_stat('stale_writes_skipped')
+            logger.info(f"Newer analysis already stored for contactId: {contactId}, skipping write")
+            return None
         
-        logger.info(f"DynamoDB put_item response: {json.dumps(response)}")
+        logger.debug(f"DynamoDB put_item response: {json.dumps(response)}")
         return response
         
     except Exception as e:
         logger.error(f"Error in save_analysis_result: {str(e)}", exc_info=True)
         raise
-
-def error_response(status_code, message):
-    """Tạo response lỗi theo format chuẩn"""
-    error_body = {
-        'error': message
-    }
-    logger.error(f"Returning error response: {json.dumps(error_body)}")
-    return {
-        'statusCode': status_code,
-        'body': json.dumps(error_body),
-        'headers': {
-            'Content-Type': 'application/json'
-        }
-    }
\ No newline at end of file
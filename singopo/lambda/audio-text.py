@@ -1,20 +1,81 @@
 import json
-import boto3
 import datetime
 import uuid
-import time
 import urllib.parse
+import logging
+from decimal import Decimal
+import runtime
+from instrumentation import stage_timer, emit_metric
+from transcribe_queue import enqueue_job, admit_jobs, get_priority, resolve_queue_name
 
-def lambda_handler(event, context):
-    s3 = boto3.client('s3')
-    transcribe = boto3.client('transcribe')
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table('customer-call-analysis')
+try:
+    from audio_preprocess import PROCESSED_PREFIX, preprocess_recording
+except ImportError:
+    # Chưa gắn layer NumPy: gửi file gốc cho Transcribe
+    PROCESSED_PREFIX, preprocess_recording = 'processed/', None
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Client tạo khi dùng lần đầu qua runtime, dùng chung với transcribe_queue
+s3 = None
+table = None
+
+def get_s3():
+    global s3
+    if s3 is None:
+        s3 = runtime.client('s3')
+    return s3
+
+def get_table():
+    global table
+    if table is None:
+        table = runtime.table('customer-call-analysis')
+    return table
+
+def prepare_media(bucket_name, file_key):
+    """
+    Thu gọn file ghi âm (8 kHz, bỏ lặng / nhạc chờ đầu và cuối) để giảm số giây Transcribe tính phí.
+    Trả về (media_key, media_info); lỗi thì dùng file gốc với media_info rỗng
+    """
+    if preprocess_recording is None:
+        return file_key, {}
+    try:
+        with stage_timer('AudioPreprocess'):
+            processed = preprocess_recording(get_s3(), bucket_name, file_key)
+    except Exception as e:
+        logger.warning(f"Audio pre-processing failed for {file_key}, using original: {str(e)}")
+        return file_key, {}
+    if processed is None:
+        logger.warning(f"No speech detected in {file_key}, using original")
+        return file_key, {}
     
+    processed_key, sample_rate, stats = processed
+    emit_metric('TrimmedSeconds', round(stats['originalSeconds'] - stats['processedSeconds'], 2), 'Seconds', 'AudioPreprocess')
+    logger.info(f"Pre-processed {file_key} -> {processed_key}: {json.dumps(stats)}")
+    return processed_key, {
+        'SampleRate': sample_rate,
+        'Channels': stats['channels'],
+        'TimeOffset': Decimal(str(stats['leadingSeconds']))
+    }
+
+def get_stored_queue_name(contact_id):
+    """Tên queue do get-customer-profile.py lưu lúc đầu cuộc gọi (có thể chưa có)"""
+    item = get_table().get_item(
+        Key={'ContactId': contact_id},
+        ProjectionExpression='QueueInfo'
+    ).get('Item') or {}
+    queue_info = item.get('QueueInfo')
+    if isinstance(queue_info, dict):
+        return queue_info.get('Name')
+    return queue_info
+
+def lambda_handler(event, context):
     bucket_name = event['Records'][0]['s3']['bucket']['name']
     file_key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'])
     
-    if not file_key.lower().endswith('.wav') or 'transcribed' in file_key:
+    # Bỏ qua file kết quả và file đã thu gọn (cũng được ghi vào bucket này)
+    if not file_key.lower().endswith('.wav') or 'transcribed' in file_key or file_key.startswith(PROCESSED_PREFIX):
         return {'statusCode': 200, 'body': 'Skipped file'}
 
     file_name = file_key.split('/')[-1]
@@ -22,71 +83,54 @@ def lambda_handler(event, context):
     job_name = f"transcribe_{str(uuid.uuid4())[:8]}"
     
     try:
-        # Update trạng thái processing
-        table.update_item(
-            Key={'ContactId': contact_id},
-            UpdateExpression="set TranscriptionStatus = :s",
-            ExpressionAttributeValues={
-                ':s': 'PROCESSING'
-            }
-        )
+        # Queue quyết định độ ưu tiên; tra từ Amazon Connect và lưu lại để kết quả phân tích có tên queue
+        queue_name = resolve_queue_name(contact_id)
+        if queue_name:
+            get_table().update_item(
+                Key={'ContactId': contact_id},
+                UpdateExpression="set TranscriptionStatus = :s, QueueInfo = :q",
+                ExpressionAttributeValues={
+                    ':s': 'QUEUED',
+                    ':q': {'Name': queue_name}
+                }
+            )
+        else:
+            queue_name = get_stored_queue_name(contact_id)
+            # File ghi âm vào hàng đợi, job chỉ được submit khi Transcribe còn slot
+            get_table().update_item(
+                Key={'ContactId': contact_id},
+                UpdateExpression="set TranscriptionStatus = :s",
+                ExpressionAttributeValues={
+                    ':s': 'QUEUED'
+                }
+            )
         
-        # Bắt đầu transcription
-        response = transcribe.start_transcription_job(
-            TranscriptionJobName=job_name,
-            Media={'MediaFileUri': f's3://{bucket_name}/{file_key}'},
-            MediaFormat='wav',
-            LanguageCode='vi-VN',
-            OutputBucketName=bucket_name,  # Thêm bucket đích
-            OutputKey=f"transcribed/{job_name}.json",  # Thêm key đích
-            Settings={'ShowSpeakerLabels': False}
-        )
+        media_key, media_info = prepare_media(bucket_name, file_key)
+        priority = get_priority(queue_name)
+        enqueue_job(job_name, contact_id, bucket_name, file_key, media_key, media_info, priority)
         
-        # Chờ transcription hoàn thành
-        max_attempts = 60
-        attempts = 0
+        # Submit ngay nếu còn slot (theo thứ tự ưu tiên của cả hàng đợi);
+        # lỗi ở bước này không làm mất file đã vào hàng đợi, transcribe-scheduler sẽ admit lại
+        try:
+            with stage_timer('TranscribeSubmit'):
+                admitted = admit_jobs()
+        except Exception as e:
+            logger.warning(f"Admission failed, {job_name} stays queued: {str(e)}")
+            admitted = 0
         
-        while attempts < max_attempts:
-            status = transcribe.get_transcription_job(
-                TranscriptionJobName=job_name
-            )['TranscriptionJob']['TranscriptionJobStatus']
-            
-            if status == 'COMPLETED':
-                # Đọc file kết quả từ S3
-                output_key = f"transcribed/{job_name}.json"
-                response = s3.get_object(Bucket=bucket_name, Key=output_key)
-                transcript_data = json.loads(response['Body'].read().decode('utf-8'))
-                transcript_text = transcript_data['results']['transcripts'][0]['transcript']
-                
-                # Cập nhật DynamoDB với kết quả transcription
-                table.update_item(
-                    Key={'ContactId': contact_id},
-                    UpdateExpression="set TranscriptionText = :t, TranscriptionStatus = :s, TranscriptionTimestamp = :ts",
-                    ExpressionAttributeValues={
-                        ':t': transcript_text,
-                        ':s': 'COMPLETED',
-                        ':ts': datetime.datetime.now().isoformat()
-                    }
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'body': 'Successfully processed recording',
-                    'contactId': contact_id,
-                    'transcriptionText': transcript_text
-                }
-                
-            elif status == 'FAILED':
-                raise Exception(f'Transcription job {job_name} failed')
-            
-            attempts += 1
-            time.sleep(5)
-            
-        raise Exception(f'Transcription job {job_name} timed out')
+        return {
+            'statusCode': 202,
+            'body': 'Transcription job queued',
+            'contactId': contact_id,
+            'jobName': job_name,
+            'queueName': queue_name,
+            'priority': priority,
+            'admitted': admitted
+        }
             
     except Exception as e:
         # Cập nhật lỗi trong DynamoDB
-        table.update_item(
+        get_table().update_item(
             Key={'ContactId': contact_id},
             UpdateExpression="set TranscriptionStatus = :s, TranscriptionError = :e, LastUpdatedAt = :t",
             ExpressionAttributeValues={
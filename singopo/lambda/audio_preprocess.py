@@ -0,0 +1,315 @@
+"""
+Thu gọn file ghi âm trước khi gửi Transcribe: đọc WAV từ S3 theo từng chunk, giữ 2 kênh
+(Connect ghi nhân viên và khách hàng ở 2 kênh riêng, Transcribe tách bằng ChannelIdentification),
+hạ sample rate về 8 kHz (đủ cho audio điện thoại, lọc thông thấp trước để không bị aliasing),
+cắt khoảng lặng / nhạc chờ ở đầu và cuối cuộc gọi, rồi ghi lại file WAV 16-bit lên S3. Khoảng lặng ở giữa được giữ nguyên để mốc thời gian
+của Transcribe chỉ lệch so với file gốc đúng phần đầu đã cắt (leadingSeconds).
+Không đọc cả cuộc gọi vào bộ nhớ: mỗi lần chỉ giữ một block 1 giây và padding sau lần nói gần nhất,
+khoảng lặng dài hơn được ghi tạm ra /tmp cho tới khi biết nó ở giữa hay ở cuối cuộc gọi.
+"""
+import os
+import wave
+import struct
+import tempfile
+from collections import deque
+import numpy as np
+
+# Transcribe chấp nhận 8 kHz cho audio điện thoại, không upsample file có rate thấp hơn
+TARGET_SAMPLE_RATE = 8000
+# ChannelIdentification của Transcribe nhận tối đa 2 kênh, nhiều hơn thì gộp về mono
+MAX_CHANNELS = 2
+PROCESSED_PREFIX = 'processed/'
+# Số byte đọc từ S3 mỗi lần (được làm tròn theo block_align)
+READ_BYTES = 256 * 1024
+FRAME_SECONDS = 0.02
+BLOCK_SECONDS = 1.0
+# Frame có năng lượng thấp hơn ngưỡng này là lặng
+SILENCE_DBFS = -45.0
+# Nhạc chờ: block gần như liên tục có âm thanh nhưng năng lượng ít dao động (lời nói dao động theo âm tiết)
+MUSIC_MIN_VOICED_RATIO = 0.9
+MUSIC_MAX_VARIATION = 0.2
+# Khoảng không có lời nói được giữ lại trước lần nói đầu và sau lần nói cuối
+PADDING_SECONDS = 0.5
+# Bộ lọc chống aliasing khi hạ rate: cắt ở 90% Nyquist mới, mỗi bên 16 lần điểm 0 của sinc
+FILTER_CUTOFF = 0.9
+FILTER_ZERO_CROSSINGS = 16
+
+def read_exact(body, size):
+    """Đọc đủ size byte từ stream (StreamingBody có thể trả ít hơn), ít hơn nếu hết file"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = body.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+def read_wav_header(body):
+    """Đọc header RIFF tới chunk 'data', trả về (channels, sample_rate, sample_width, data_size)"""
+    riff = read_exact(body, 12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise ValueError('Not a RIFF/WAVE file')
+
+    fmt = None
+    while True:
+        header = read_exact(body, 8)
+        if len(header) < 8:
+            raise ValueError('No data chunk in WAV file')
+        chunk_id, size = struct.unpack('<4sI', header)
+        if chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('WAV data chunk before fmt chunk')
+            return fmt + (size,)
+        # Chunk có độ dài lẻ được pad thêm 1 byte
+        data = read_exact(body, size + size % 2)
+        if chunk_id == b'fmt ':
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', data[:16])
+            # WAVE_FORMAT_EXTENSIBLE: format thật nằm ở 2 byte đầu của SubFormat
+            if audio_format == 0xFFFE and len(data) >= 26:
+                audio_format = struct.unpack('<H', data[24:26])[0]
+            if audio_format != 1 or bits not in (8, 16, 32):
+                raise ValueError(f'Unsupported WAV encoding: format {audio_format}, {bits} bits')
+            fmt = (channels, sample_rate, bits // 8)
+
+def decode_samples(data, channels, sample_width):
+    """PCM bytes -> float32 trong [-1, 1], shape (số mẫu, số kênh đầu ra)"""
+    if sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+    else:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2147483648
+    samples = samples.reshape(-1, channels)
+    if channels > MAX_CHANNELS:
+        samples = samples.mean(axis=1, keepdims=True)
+    return samples
+
+def lowpass_taps(step):
+    """
+    FIR thông thấp windowed-sinc (cửa sổ Hamming) chống aliasing khi hạ rate theo tỷ lệ step:
+    cắt ở FILTER_CUTOFF Nyquist mới, độ dài lẻ, đối xứng nên không làm lệch mốc thời gian
+    """
+    half = int(np.ceil(FILTER_ZERO_CROSSINGS * step))
+    cutoff = FILTER_CUTOFF * 0.5 / step
+    n = np.arange(-half, half + 1)
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(len(n))
+    return (taps / taps.sum()).astype(np.float32)
+
+class Resampler:
+    """
+    Hạ sample rate theo từng chunk (mẫu x kênh), giữ trạng thái giữa các chunk. Lọc thông thấp trước khi
+    lấy mẫu, chỉ tính giá trị đã lọc tại các mẫu nguồn cần cho đầu ra
+    """
+    def __init__(self, source_rate, channels, target_rate=TARGET_SAMPLE_RATE):
+        self.source_rate = source_rate
+        self.output_rate = min(source_rate, target_rate)
+        self.step = source_rate / self.output_rate
+        self.factor = int(self.step) if source_rate % self.output_rate == 0 else None
+        self.taps = lowpass_taps(self.step)
+        self.half = len(self.taps) // 2
+        # Mẫu chưa dùng hết và half mẫu trước đó cho bộ lọc; đầu file được đệm 0
+        self.buffer = np.zeros((self.half, channels), dtype=np.float32)
+        # Vị trí (theo mẫu nguồn, tính từ đầu buffer) của mẫu đầu ra tiếp theo
+        self.position = float(self.half)
+
+    def filtered(self, windows, indexes):
+        """Giá trị đã lọc tại các mẫu nguồn indexes (tính từ đầu buffer), shape (số mẫu, số kênh)"""
+        return windows[indexes - self.half] @ self.taps
+
+    def process(self, samples):
+        if self.step == 1:
+            return samples
+        samples = np.concatenate([self.buffer, samples])
+        # Tỷ lệ lẻ (44.1 kHz, 22.05 kHz...) nội suy tuyến tính giữa 2 mẫu đã lọc nên cần thêm mẫu kế tiếp
+        last = len(samples) - self.half - 2
+        positions = np.arange(self.position, last + 1, self.step)
+        windows = np.lib.stride_tricks.sliding_window_view(samples, len(self.taps), axis=0)
+        indexes = positions.astype(np.int64)
+        output = self.filtered(windows, indexes)
+        if not self.factor and len(indexes):
+            weights = (positions - indexes).astype(np.float32)[:, None]
+            output = output + (self.filtered(windows, indexes + 1) - output) * weights
+
+        next_position = positions[-1] + self.step if len(positions) else self.position
+        keep_from = min(max(int(next_position) - self.half, 0), len(samples))
+        self.buffer = samples[keep_from:]
+        self.position = next_position - keep_from
+        return output.astype(np.float32)
+
+    def flush(self):
+        """Cuối file: đệm 0 để lấy nốt các mẫu đầu ra còn chờ mẫu phía sau cho bộ lọc"""
+        if self.step == 1:
+            return self.buffer[:0]
+        return self.process(np.zeros((self.half + 1, self.buffer.shape[1]), dtype=np.float32))
+
+def to_pcm16(samples):
+    return (np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes()
+
+class SpeechTrimmer:
+    """
+    Voice activity detection theo năng lượng từng frame 20 ms (lấy kênh to nhất). Chỉ bỏ lặng / nhạc chờ
+    ở đầu và cuối cuộc gọi; khoảng không có lời nói ở giữa được giữ nguyên
+    """
+    def __init__(self, sample_rate):
+        self.frame_size = int(sample_rate * FRAME_SECONDS)
+        self.padding_frames = int(PADDING_SECONDS / FRAME_SECONDS)
+        self.started = False
+        # Padding trước lần nói đầu tiên
+        self.lead = deque(maxlen=self.padding_frames)
+        # Frame không có lời nói từ lần nói gần nhất (PCM 16-bit), chỉ bị bỏ nếu là phần cuối cuộc gọi.
+        # Trong bộ nhớ chỉ giữ phần padding sau lần nói cuối, phần dài hơn (nhạc chờ...) ghi ra file tạm
+        self.gap = []
+        self.spill = None
+        self.spilled_frames = 0
+        self.leading_frames = 0
+        self.dropped_frames = 0
+
+    def classify(self, frames):
+        """True với frame có lời nói, frames có shape (số frame, frame_size, số kênh)"""
+        rms = np.sqrt(np.mean(frames ** 2, axis=1)).max(axis=1) + 1e-9
+        voiced = 20 * np.log10(rms) > SILENCE_DBFS
+        if voiced.mean() >= MUSIC_MIN_VOICED_RATIO and rms.std() / rms.mean() < MUSIC_MAX_VARIATION:
+            return np.zeros(len(frames), dtype=bool)
+        return voiced
+
+    def add_gap(self, frame):
+        if len(self.gap) < self.padding_frames:
+            self.gap.append(to_pcm16(frame))
+            return
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile(dir='/tmp')
+        self.spill.write(to_pcm16(frame))
+        self.spilled_frames += 1
+
+    def read_spill(self):
+        """Phần khoảng lặng đã ghi ra file tạm, từng đoạn READ_BYTES, rồi làm rỗng file"""
+        self.spill.seek(0)
+        while True:
+            data = self.spill.read(READ_BYTES)
+            if not data:
+                break
+            yield data
+        self.spill.seek(0)
+        self.spill.truncate()
+        self.spilled_frames = 0
+
+    def process(self, block):
+        """
+        Nhận một block (số mẫu là bội số frame_size), trả về lần lượt các đoạn PCM 16-bit của các mẫu
+        được giữ lại
+        """
+        frames = block.reshape(-1, self.frame_size, block.shape[1])
+        output = []
+        for frame, is_speech in zip(frames, self.classify(frames)):
+            if is_speech:
+                if self.started:
+                    output.extend(self.gap)
+                    if self.spilled_frames:
+                        yield b''.join(output)
+                        output = []
+                        yield from self.read_spill()
+                else:
+                    self.started = True
+                    self.leading_frames = self.dropped_frames
+                    output.extend(to_pcm16(lead_frame) for lead_frame in self.lead)
+                self.gap = []
+                self.lead.clear()
+                output.append(to_pcm16(frame))
+            elif self.started:
+                self.add_gap(frame)
+            else:
+                if len(self.lead) == self.padding_frames:
+                    self.dropped_frames += 1
+                self.lead.append(frame)
+        yield b''.join(output)
+
+    def flush(self):
+        """Cuối file: chỉ giữ phần padding sau lần nói cuối"""
+        kept = self.gap if self.started else []
+        self.dropped_frames += len(self.gap) - len(kept) + self.spilled_frames + len(self.lead)
+        self.gap = []
+        self.lead.clear()
+        self.close()
+        return b''.join(kept)
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+            self.spilled_frames = 0
+
+def preprocess_recording(s3, bucket_name, file_key):
+    """
+    Tạo bản thu gọn của file ghi âm ở PROCESSED_PREFIX + tên file.
+    Trả về (processed_key, sample_rate, stats), hoặc None nếu không phát hiện lời nói.
+    stats có channels và leadingSeconds (cộng vào mốc thời gian của Transcribe để khớp file gốc)
+    """
+    body = s3.get_object(Bucket=bucket_name, Key=file_key)['Body']
+    channels, source_rate, sample_width, data_size = read_wav_header(body)
+    block_align = channels * sample_width
+    read_size = READ_BYTES - READ_BYTES % block_align
+    output_channels = channels if channels <= MAX_CHANNELS else 1
+
+    resampler = Resampler(source_rate, output_channels)
+    trimmer = SpeechTrimmer(resampler.output_rate)
+    block_size = int(resampler.output_rate * BLOCK_SECONDS)
+    block_size -= block_size % trimmer.frame_size
+    pending = np.zeros((0, output_channels), dtype=np.float32)
+    output_bytes = 0
+    remaining = data_size
+
+    fd, temp_path = tempfile.mkstemp(suffix='.wav', dir='/tmp')
+    os.close(fd)
+    try:
+        with wave.open(temp_path, 'wb') as output:
+            output.setnchannels(output_channels)
+            output.setsampwidth(2)
+            output.setframerate(resampler.output_rate)
+
+            def write(kept):
+                nonlocal output_bytes
+                output.writeframes(kept)
+                output_bytes += len(kept)
+
+            while remaining > 0:
+                data = read_exact(body, min(read_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                data = data[:len(data) - len(data) % block_align]
+                pending = np.concatenate([pending, resampler.process(decode_samples(data, channels, sample_width))])
+
+                # VAD theo block 1 giây để nhận biết nhạc chờ
+                usable = len(pending) - len(pending) % block_size
+                for start in range(0, usable, block_size):
+                    for kept in trimmer.process(pending[start:start + block_size]):
+                        write(kept)
+                pending = pending[usable:]
+
+            # Phần cuối chưa đủ block, bỏ phần lẻ không đủ một frame
+            pending = np.concatenate([pending, resampler.flush()])
+            usable = len(pending) - len(pending) % trimmer.frame_size
+            if usable:
+                for kept in trimmer.process(pending[:usable]):
+                    write(kept)
+            write(trimmer.flush())
+
+        if not trimmer.started:
+            return None
+
+        processed_key = PROCESSED_PREFIX + file_key.split('/')[-1]
+        s3.upload_file(temp_path, bucket_name, processed_key)
+        stats = {
+            'originalSeconds': round(data_size / block_align / source_rate, 2),
+            'processedSeconds': round(output_bytes / (2 * output_channels) / resampler.output_rate, 2),
+            'leadingSeconds': round(trimmer.leading_frames * FRAME_SECONDS, 2),
+            'channels': output_channels,
+            'originalBytes': data_size,
+            'processedBytes': os.path.getsize(temp_path)
+        }
+        return processed_key, resampler.output_rate, stats
+    finally:
+        trimmer.close()
+        os.remove(temp_path)
@@ -0,0 +1,99 @@
+import json
+import time
+import logging
+from decimal import Decimal
+from botocore.exceptions import ClientError
+import runtime
+from instrumentation import stage_timer, emit_metric
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Bản ghi cuộc gọi do get-customer-profile gửi qua SQS (CONTACT_QUEUE_URL)
+TABLE_NAME = 'customer-call-analysis'
+
+# Table tạo khi dùng lần đầu qua runtime
+table = None
+
+def get_table():
+    global table
+    if table is None:
+        table = runtime.table(TABLE_NAME)
+    return table
+
+def parse_records(records):
+    """
+    Gộp message theo ContactId (SQS giao ít nhất một lần nên có thể trùng), giữ bản có Timestamp mới nhất.
+    Trả về {ContactId: item}, {ContactId: [messageId]} và messageId không đọc được
+    """
+    items = {}
+    message_ids = {}
+    invalid = []
+    for record in records:
+        try:
+            item = json.loads(record['body'], parse_float=Decimal)
+            contact_id = item['ContactId']
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Invalid contact message {record['messageId']}: {str(e)}")
+            invalid.append(record['messageId'])
+            continue
+        if contact_id not in items or item.get('Timestamp', 0) >= items[contact_id].get('Timestamp', 0):
+            items[contact_id] = item
+        message_ids.setdefault(contact_id, []).append(record['messageId'])
+    return items, message_ids, invalid
+
+def write_contact(item):
+    """
+    Ghi item mới bằng put_item có điều kiện, True nếu đã ghi. Item đã tồn tại (audio-text cập nhật trước,
+    message được giao lại, hoặc được tạo giữa lúc kiểm tra và lúc ghi) thì chỉ merge, False
+    """
+    try:
+        get_table().put_item(Item=item, ConditionExpression='attribute_not_exists(ContactId)')
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    merge_contact(item)
+    return False
+
+def merge_contact(item):
+    """Item đã tồn tại: chỉ điền thuộc tính còn thiếu, không ghi đè trạng thái do pipeline cập nhật"""
+    attributes = [name for name in item if name != 'ContactId']
+    get_table().update_item(
+        Key={'ContactId': item['ContactId']},
+        UpdateExpression='SET ' + ', '.join(f"#a{i} = if_not_exists(#a{i}, :v{i})" for i in range(len(attributes))),
+        ExpressionAttributeNames={f"#a{i}": name for i, name in enumerate(attributes)},
+        ExpressionAttributeValues={f":v{i}": item[name] for i, name in enumerate(attributes)}
+    )
+
+def get_queue_lag_ms(records):
+    """Thời gian lâu nhất từ lúc message được gửi tới lúc được xử lý"""
+    sent = [int(record['attributes']['SentTimestamp']) for record in records
+            if record.get('attributes', {}).get('SentTimestamp')]
+    return round(max(time.time() * 1000 - min(sent), 0), 3) if sent else 0
+
+def lambda_handler(event, context):
+    """
+    Event source SQS với ReportBatchItemFailures: message lỗi được giao lại,
+    quá maxReceiveCount thì chuyển sang DLQ của hàng đợi
+    """
+    records = event['Records']
+    items, message_ids, failed = parse_records(records)
+
+    written = merged = 0
+    for contact_id, item in items.items():
+        try:
+            with stage_timer('ContactWrite'):
+                if write_contact(item):
+                    written += 1
+                else:
+                    merged += 1
+        except Exception as e:
+            logger.error(f"Error writing contact {contact_id}: {str(e)}", exc_info=True)
+            failed.extend(message_ids[contact_id])
+
+    emit_metric('ContactsWritten', written, 'Count', 'ContactWrite')
+    emit_metric('ContactsMerged', merged, 'Count', 'ContactWrite')
+    emit_metric('ContactQueueLag', get_queue_lag_ms(records), 'Milliseconds', 'ContactWrite')
+    logger.info(f"Wrote {len(items)} contacts from {len(records)} messages, {len(failed)} failed")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
@@ -1,35 +1,238 @@
+import os
 import json
-import boto3
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 import logging
+from boto3.dynamodb.conditions import Key
+import runtime
+from instrumentation import stage_timer, log_sampled, emit_metric
+from phone_numbers import format_phone_number
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('customer-call-analysis')
+# GSI của customer-call-analysis: PhoneNumber (HASH) + CallDate (RANGE)
+PHONE_INDEX = 'PhoneNumber-CallDate-index'
+# Số cuộc gọi gần nhất trong profile
+PROFILE_HISTORY_SIZE = 5
+# Cache profile trong container cho khách gọi nhiều lần
+PROFILE_CACHE_TTL_SECONDS = 300
+PROFILE_CACHE_SIZE = 1024
+# Giới hạn số điện thoại mỗi request batch của UI
+MAX_BATCH_PHONES = 100
+BATCH_MAX_WORKERS = 8
 
-def format_phone_number(phone):
+profile_cache = OrderedDict()
+cache_stats = {'hits': 0, 'misses': 0}
+cache_lock = threading.Lock()
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Content-Type': 'application/json'
+}
+
+# Contact flow chỉ chờ Lambda tối đa 8 giây: timeout ngắn, ít retry
+PROFILE_DB_CONFIG = {
+    'connect_timeout': 1,
+    'read_timeout': 2,
+    'retries': {'max_attempts': 2, 'mode': 'standard'}
+}
+# Tạo ngay lúc init thay vì lười: mọi cuộc gọi trong contact flow đều cần bảng này,
+# và với provisioned concurrency phần init chạy trước khi có cuộc gọi
+table = runtime.table('customer-call-analysis', config=PROFILE_DB_CONFIG)
+
+# Hàng đợi SQS mà contact-writer ghi theo batch vào customer-call-analysis.
+# Không cấu hình thì ghi thẳng DynamoDB trong contact flow như trước
+CONTACT_QUEUE_URL = os.environ.get('CONTACT_QUEUE_URL')
+CONTACT_QUEUE_CONFIG = {
+    'connect_timeout': 1,
+    'read_timeout': 1,
+    'retries': {'max_attempts': 2, 'mode': 'standard'}
+}
+sqs = runtime.client('sqs', config=CONTACT_QUEUE_CONFIG) if CONTACT_QUEUE_URL else None
+# Gửi SQS (tối đa 2 lần x 2 giây) cộng ghi thẳng DynamoDB có thể vượt 8 giây của contact flow:
+# cả việc lưu bản ghi chỉ được dùng SAVE_BUDGET_SECONDS kể từ lúc nhận event
+SAVE_BUDGET_SECONDS = 6
+# Ghi thẳng sau khi gửi SQS lỗi: một lần, không retry, chỉ khi còn đủ DIRECT_WRITE_SECONDS
+DIRECT_WRITE_CONFIG = {
+    'connect_timeout': 0.5,
+    'read_timeout': 1,
+    'retries': {'max_attempts': 1, 'mode': 'standard'}
+}
+DIRECT_WRITE_SECONDS = 1.5
+# Table cho fallback, chỉ tạo khi gửi SQS lỗi
+direct_table = None
+# Gửi bản ghi cuộc gọi song song với lookup profile. Lần lưu quá deadline của invoke trước vẫn chạy tiếp
+# (tối đa vài giây theo timeout của client) khi container nhận invoke mới, nên pool có nhiều thread
+# để bản ghi mới không phải xếp hàng sau nó
+SAVE_MAX_WORKERS = 4
+save_executor = ThreadPoolExecutor(max_workers=SAVE_MAX_WORKERS)
+
+def get_queue_name(queue_info):
+    """QueueInfo là object Queue của Amazon Connect hoặc chuỗi 'No Queue'"""
+    if isinstance(queue_info, dict):
+        return queue_info.get('Name', 'No Queue')
+    return queue_info or 'No Queue'
+
+def get_cached_profile(phone_number):
+    with cache_lock:
+        entry = profile_cache.get(phone_number)
+        if entry and entry[0] > time.time():
+            profile_cache.move_to_end(phone_number)
+            cache_stats['hits'] += 1
+            return entry[1]
+        cache_stats['misses'] += 1
+        return None
+
+def remember_profile(phone_number, profile):
+    with cache_lock:
+        profile_cache[phone_number] = (time.time() + PROFILE_CACHE_TTL_SECONDS, profile)
+        profile_cache.move_to_end(phone_number)
+        while len(profile_cache) > PROFILE_CACHE_SIZE:
+            profile_cache.popitem(last=False)
+
+def build_profile(phone_number, calls):
+    """previousCallCount tính trên tối đa PROFILE_HISTORY_SIZE cuộc gọi gần nhất"""
+    return {
+        'phoneNumber': phone_number,
+        'previousCallCount': len(calls),
+        'lastCallDate': calls[0]['callDate'] if calls else None,
+        'lastQueue': calls[0]['queue'] if calls else None,
+        'recentCalls': calls
+    }
+
+def load_profile(phone_number):
+    """Các cuộc gọi gần nhất của số điện thoại, query GSI theo CallDate giảm dần"""
+    with stage_timer('ProfileLookup'):
+        response = table.query(
+            IndexName=PHONE_INDEX,
+            KeyConditionExpression=Key('PhoneNumber').eq(phone_number),
+            ProjectionExpression='#cid, #cd, #q',
+            ExpressionAttributeNames={'#cid': 'ContactId', '#cd': 'CallDate', '#q': 'QueueInfo'},
+            ScanIndexForward=False,
+            Limit=PROFILE_HISTORY_SIZE
+        )
+    calls = [
+        {
+            'contactId': item['ContactId'],
+            'callDate': item.get('CallDate'),
+            'queue': get_queue_name(item.get('QueueInfo'))
+        }
+        for item in response.get('Items', [])
+    ]
+    return build_profile(phone_number, calls)
+
+def get_profile(phone_number):
+    """Profile theo số đã chuẩn hóa, ưu tiên cache trong container"""
+    profile = get_cached_profile(phone_number)
+    if profile is None:
+        profile = load_profile(phone_number)
+        remember_profile(phone_number, profile)
+    return profile
+
+def add_call_to_profile(profile, item):
+    """Cập nhật profile trong cache với cuộc gọi vừa ghi, không cần query lại"""
+    call = {
+        'contactId': item['ContactId'],
+        'callDate': item['CallDate'],
+        'queue': get_queue_name(item['QueueInfo'])
+    }
+    calls = [call] + [c for c in profile['recentCalls'] if c['contactId'] != call['contactId']]
+    remember_profile(profile['phoneNumber'], build_profile(profile['phoneNumber'], calls[:PROFILE_HISTORY_SIZE]))
+
+def get_direct_table():
+    global direct_table
+    if direct_table is None:
+        direct_table = runtime.table('customer-call-analysis', config=DIRECT_WRITE_CONFIG)
+    return direct_table
+
+def save_contact(item, deadline):
     """
-    Chuẩn hóa số điện thoại về format +84
+    Đưa bản ghi cuộc gọi vào hàng đợi của contact-writer. Gửi lỗi (hoặc không có hàng đợi)
+    thì ghi thẳng DynamoDB để không mất cuộc gọi nếu còn kịp trước deadline (time.monotonic);
+    trả về 'queued' hoặc 'direct'
     """
-    # Loại bỏ tất cả các ký tự không phải số
-    phone = ''.join(filter(str.isdigit, phone))
+    if sqs is None:
+        with stage_timer('DynamoDBWrite'):
+            table.put_item(Item=item)
+        return 'direct'
+    
+    try:
+        with stage_timer('ContactEnqueue'):
+            sqs.send_message(
+                QueueUrl=CONTACT_QUEUE_URL,
+                MessageBody=json.dumps(item, default=str, ensure_ascii=False)
+            )
+        return 'queued'
+    except Exception as e:
+        logger.warning(f"Enqueue failed for {item['ContactId']}: {str(e)}")
+        emit_metric('ContactEnqueueFailed', 1)
+    
+    if deadline - time.monotonic() < DIRECT_WRITE_SECONDS:
+        raise RuntimeError('No time left in the contact flow for a direct write')
+    with stage_timer('DynamoDBWrite'):
+        get_direct_table().put_item(Item=item)
+    return 'direct'
+
+def get_profiles(phone_numbers):
+    """Batch lookup cho UI: số có trong cache trả ngay, các số còn lại query song song"""
+    profiles = {}
+    missing = []
+    for phone_number in phone_numbers:
+        profile = get_cached_profile(phone_number)
+        if profile is None:
+            missing.append(phone_number)
+        else:
+            profiles[phone_number] = profile
+    
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(missing))) as executor:
+            for phone_number, profile in zip(missing, executor.map(load_profile, missing)):
+                remember_profile(phone_number, profile)
+                profiles[phone_number] = profile
+    return profiles
+
+def build_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': CORS_HEADERS,
+        'body': json.dumps(body, default=str, ensure_ascii=False)
+    }
+
+def batch_lookup_handler(event):
+    """API cho UI: POST {"phoneNumbers": [...]} hoặc GET ?phones=a,b"""
+    body = json.loads(event['body']) if isinstance(event.get('body'), str) else (event.get('body') or {})
+    phone_numbers = body.get('phoneNumbers')
+    if phone_numbers is None:
+        phones = (event.get('queryStringParameters') or {}).get('phones', '')
+        phone_numbers = [phone for phone in phones.split(',') if phone.strip()]
     
-    # Nếu số điện thoại bắt đầu bằng 0, thay thế bằng +84
-    if phone.startswith('0'):
-        phone = '+84' + phone[1:]
-    # Nếu số điện thoại chưa có +84 và không bắt đầu bằng 84
-    elif not phone.startswith('84'):
-        phone = '+84' + phone
-    # Nếu số điện thoại bắt đầu bằng 84 nhưng không có dấu +
-    elif phone.startswith('84'):
-        phone = '+' + phone
+    if not isinstance(phone_numbers, list) or not phone_numbers:
+        return build_response(400, {'error': 'phoneNumbers is required'})
+    if len(phone_numbers) > MAX_BATCH_PHONES:
+        return build_response(400, {'error': f'At most {MAX_BATCH_PHONES} phone numbers per request'})
     
-    return phone
+    try:
+        # Chuẩn hóa giống contact flow, bỏ số trùng
+        normalized = list(dict.fromkeys(format_phone_number(str(phone)) for phone in phone_numbers))
+        profiles = get_profiles(normalized)
+    except Exception as e:
+        logger.error(f"Error looking up profiles: {str(e)}", exc_info=True)
+        return build_response(500, {'error': str(e)})
+    
+    logger.info(f"Profile cache stats: {json.dumps(cache_stats)}")
+    return build_response(200, {'profiles': profiles})
 
 def lambda_handler(event, context):
-    logger.info(f"Incoming event: {json.dumps(event, indent=2)}")
+    deadline = time.monotonic() + SAVE_BUDGET_SECONDS
+    log_sampled('event', event)
+    
+    # Không phải event của contact flow: request batch từ UI qua API Gateway
+    if 'Details' not in event:
+        return batch_lookup_handler(event)
     
     try:
         # Lấy và chuẩn hóa số điện thoại
@@ -57,15 +260,49 @@ def lambda_handler(event, context):
             'ProcessingStatus': 'INITIATED'
         }
         
-        # Lưu vào DynamoDB
-        table.put_item(Item=item)
-        logger.info(f"Successfully saved to DynamoDB with formatted phone: {phone_number}")
+        # Gửi bản ghi trong lúc lookup profile thay vì chờ lần lượt
+        saving = save_executor.submit(save_contact, item, deadline)
         
-        return {
+        # Lỗi lookup không được làm hỏng contact flow
+        try:
+            profile = get_profile(phone_number)
+        except Exception as e:
+            logger.warning(f"Profile lookup failed for {phone_number}: {str(e)}")
+            profile = None
+        # Khi ghi thẳng DynamoDB song song, lookup có thể đã thấy chính cuộc gọi này
+        if profile is not None and any(call['contactId'] == contact_id for call in profile['recentCalls']):
+            profile = build_profile(
+                phone_number, [call for call in profile['recentCalls'] if call['contactId'] != contact_id]
+            )
+        
+        # Chờ gửi xong trước khi trả về: container bị đóng băng sau khi handler trả kết quả.
+        # Lưu lỗi cả hai đường hoặc quá deadline thì contact flow vẫn tiếp tục, cuộc gọi chỉ thiếu bản ghi
+        saved_by = None
+        try:
+            saved_by = saving.result(timeout=max(deadline - time.monotonic(), 0))
+            logger.info(f"Contact record {saved_by} with formatted phone: {phone_number}")
+        except FutureTimeoutError:
+            logger.error(f"Saving contact {contact_id} did not finish within {SAVE_BUDGET_SECONDS}s")
+            emit_metric('ContactWriteFailed', 1)
+        except Exception as e:
+            logger.error(f"Error saving contact {contact_id}: {str(e)}", exc_info=True)
+            emit_metric('ContactWriteFailed', 1)
+        
+        result = {
             'phoneNumber': phone_number,
             'contactId': contact_id,
             'timestamp': str(timestamp)
         }
+        # Contact flow chỉ nhận các giá trị dạng chuỗi, không lồng nhau
+        if profile is not None:
+            # Chỉ đưa cuộc gọi vào cache khi bản ghi đã được lưu (vào hàng đợi hoặc DynamoDB)
+            if saved_by:
+                add_call_to_profile(profile, item)
+            result['isReturningCaller'] = 'true' if profile['previousCallCount'] else 'false'
+            result['previousCallCount'] = str(profile['previousCallCount'])
+            result['lastCallDate'] = profile['lastCallDate'] or ''
+            result['lastQueue'] = profile['lastQueue'] or ''
+        return result
         
     except Exception as e:
         logger.error(f"Error: {str(e)}")
@@ -1,8 +1,59 @@
-import boto3
 import json
 import decimal
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from boto3.dynamodb.conditions import Key
-from botocore.exceptions import ClientError
+import runtime
+from text_storage import unpack_text
+from search_index import INDEX_TABLE_NAME, RANK_INDEX, tokenize, rank_weight
+from phone_numbers import format_phone_number
+
+TABLE_NAME = 'analysis-results-it-got-talent'
+# GSI: PhoneNumber (HASH) + CallDate (RANGE)
+PHONE_INDEX = 'PhoneNumber-CallDate-index'
+# GSI: CallDay (HASH, YYYY-MM-DD) + CallDate (RANGE)
+DAY_INDEX = 'CallDay-CallDate-index'
+
+# Bảng rollup do metrics-rollup.py cập nhật từ stream
+METRICS_TABLE_NAME = 'analysis-metrics'
+MAX_METRIC_DAYS = 366
+MAX_METRIC_HOURS = 7 * 24
+# Giới hạn số key trong một batch_get_item
+MAX_BATCH_GET_KEYS = 100
+
+# Tìm kiếm: số posting tốt nhất đọc cho mỗi term, giữ độ trễ ổn định khi bảng lớn dần
+MAX_TERM_POSTINGS = 1000
+MAX_QUERY_TERMS = 8
+# Khi lọc theo khoảng ngày: số posting tối đa đọc cho mỗi term (Rank bắt đầu bằng weight nên không lọc CallDate
+# trong key condition được)
+MAX_TERM_SCANNED = 10 * MAX_TERM_POSTINGS
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Khoảng ngày mặc định khi không truyền from/to (không áp dụng khi lọc theo số điện thoại)
+DEFAULT_RANGE_DAYS = 30
+# Danh sách theo ngày: số ngày được query song song mỗi lượt
+DAY_QUERY_WORKERS = 8
+
+# Chỉ lấy các cột mà bảng danh sách cần, Analysis đầy đủ lấy theo ContactId
+LIST_ATTRIBUTES = {
+    '#cid': 'ContactId',
+    '#cd': 'CallDate',
+    '#pn': 'PhoneNumber',
+    '#ts': 'AnalysisTimestamp',
+    '#ci': 'CustomerInfo',
+    '#an': 'Analysis',
+    '#sc': 'compliance_score',
+    '#em': 'customer_emotion'
+}
+LIST_PROJECTION = '#cid, #cd, #pn, #ts, #ci, #an.#sc, #an.#em'
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Credentials': True,
+    'Content-Type': 'application/json'
+}
 
 # Helper class để xử lý Decimal
 class DecimalEncoder(json.JSONEncoder):
@@ -11,46 +62,375 @@ class DecimalEncoder(json.JSONEncoder):
             return float(obj)
         return super(DecimalEncoder, self).default(obj)
 
+# Resource dùng chung giữa các lần invoke trên cùng container (warm start)
+dynamodb = None
+
+def get_dynamodb():
+    """Khởi tạo DynamoDB resource một lần cho mỗi container"""
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = runtime.resource('dynamodb')
+    return dynamodb
+
+def encode_cursor(cursor):
+    """Mã hóa vị trí phân trang thành chuỗi cho client"""
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Giải mã chuỗi cursor do encode_cursor tạo ra"""
+    if not cursor:
+        return None
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(decoded, dict):
+        raise ValueError('Invalid cursor')
+    return decoded
+
+def parse_day(value, name):
+    """Kiểm tra tham số ngày dạng YYYY-MM-DD"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid {name} date, expected YYYY-MM-DD')
+
+def parse_list_params(params, default_range=True):
+    """
+    Đọc tham số phân trang, lọc và sắp xếp từ query string. default_range=False: không truyền from/to
+    thì from_day / to_day là None (không giới hạn ngày ở phía đó)
+    """
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('Invalid limit')
+    
+    if params.get('to'):
+        to_day = parse_day(params['to'], 'to')
+    else:
+        to_day = datetime.now().date() if default_range else None
+    if params.get('from'):
+        from_day = parse_day(params['from'], 'from')
+    else:
+        from_day = to_day - timedelta(days=DEFAULT_RANGE_DAYS - 1) if default_range else None
+    if from_day and to_day and from_day > to_day:
+        raise ValueError('from must not be after to')
+    
+    return {
+        'limit': max(1, min(limit, MAX_PAGE_SIZE)),
+        'from_day': from_day,
+        'to_day': to_day,
+        # Cùng format +84 với PhoneNumber đã lưu (get-customer-profile)
+        'phone': format_phone_number(params['phone']) if params.get('phone') else None,
+        'descending': params.get('order', 'desc') != 'asc',
+        'cursor': decode_cursor(params.get('cursor'))
+    }
+
+def query_page(table, index_name, key_condition, limit, descending, start_key):
+    """Query một trang trên GSI, chỉ lấy các cột của bảng danh sách"""
+    kwargs = {
+        'IndexName': index_name,
+        'KeyConditionExpression': key_condition,
+        'ProjectionExpression': LIST_PROJECTION,
+        'ExpressionAttributeNames': LIST_ATTRIBUTES,
+        'ScanIndexForward': not descending,
+        'Limit': limit
+    }
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    response = table.query(**kwargs)
+    return response['Items'], response.get('LastEvaluatedKey')
+
+def list_by_phone(table, params):
+    """Các cuộc gọi của một số điện thoại (trong khoảng ngày nếu có), sắp xếp theo CallDate"""
+    key_condition = Key('PhoneNumber').eq(params['phone'])
+    from_date = params['from_day'] and params['from_day'].isoformat()
+    to_date = params['to_day'] and f"{params['to_day'].isoformat()}T23:59:59.999999"
+    if from_date and to_date:
+        key_condition &= Key('CallDate').between(from_date, to_date)
+    elif from_date:
+        key_condition &= Key('CallDate').gte(from_date)
+    elif to_date:
+        key_condition &= Key('CallDate').lte(to_date)
+    cursor = params['cursor'] or {}
+    items, last_key = query_page(
+        table, PHONE_INDEX, key_condition,
+        params['limit'], params['descending'], cursor.get('key')
+    )
+    return items, ({'key': last_key} if last_key else None)
+
+def get_day_key(item, day):
+    """Key của item trên DAY_INDEX, dùng làm ExclusiveStartKey khi trang dừng giữa các item của một ngày"""
+    return {'ContactId': item['ContactId'], 'CallDay': day, 'CallDate': item['CallDate']}
+
+def list_by_day(table, params):
+    """
+    Duyệt các ngày trên DAY_INDEX cho đến khi đủ một trang. Trang đầu của DAY_QUERY_WORKERS ngày liên tiếp
+    được query song song rồi ghép theo thứ tự ngày, các trang tiếp theo của một ngày đọc lần lượt
+    """
+    step = timedelta(days=-1 if params['descending'] else 1)
+    last_day = params['from_day'] if params['descending'] else params['to_day']
+    
+    cursor = params['cursor']
+    if cursor:
+        # Cursor của list_by_phone / search (không có day) cũng bị từ chối ở đây
+        day = parse_day(cursor.get('day'), 'cursor')
+        if not params['from_day'] <= day <= params['to_day']:
+            raise ValueError('Invalid cursor')
+        start_key = cursor.get('key')
+    else:
+        day = params['to_day'] if params['descending'] else params['from_day']
+        start_key = None
+    
+    days = [day + step * i for i in range(abs((last_day - day).days) + 1)]
+    limit = params['limit']
+    items = []
+    
+    def read_day(day, key, page_limit):
+        return query_page(table, DAY_INDEX, Key('CallDay').eq(day.isoformat()), page_limit, params['descending'], key)
+    
+    with ThreadPoolExecutor(max_workers=min(DAY_QUERY_WORKERS, len(days))) as executor:
+        for i in range(0, len(days), DAY_QUERY_WORKERS):
+            window = days[i:i + DAY_QUERY_WORKERS]
+            keys = [start_key if i == 0 and j == 0 else None for j in range(len(window))]
+            pages = executor.map(read_day, window, keys, [limit - len(items)] * len(window))
+            
+            for day, (page, next_key) in zip(window, pages):
+                while True:
+                    needed = limit - len(items)
+                    # Các ngày sau trong lượt có thể trả nhiều hơn phần còn thiếu của trang
+                    if len(page) > needed:
+                        items.extend(page[:needed])
+                        return items, {'day': day.isoformat(), 'key': get_day_key(page[needed - 1], day.isoformat())}
+                    items.extend(page)
+                    if not next_key:
+                        break
+                    if len(items) >= limit:
+                        return items, {'day': day.isoformat(), 'key': next_key}
+                    page, next_key = read_day(day, next_key, limit - len(items))
+                
+                if day == last_day:
+                    return items, None
+                if len(items) >= limit:
+                    return items, {'day': (day + step).isoformat()}
+    return items, None
+
+def read_postings(term, day_range=None):
+    """
+    {ContactId: (weight, CallDate)} của các posting có weight cao nhất, cùng weight thì cuộc gọi mới trước.
+    day_range (from_day, to_day): chỉ giữ cuộc gọi trong khoảng ngày, đọc tối đa MAX_TERM_SCANNED posting
+    """
+    index_table = get_dynamodb().Table(INDEX_TABLE_NAME)
+    kwargs = {
+        'IndexName': RANK_INDEX,
+        'KeyConditionExpression': Key('Term').eq(term),
+        'ScanIndexForward': False,
+        'Limit': MAX_TERM_POSTINGS
+    }
+    first_day, last_day = (day.isoformat() for day in day_range) if day_range else (None, None)
+    postings = {}
+    scanned = 0
+    while len(postings) < MAX_TERM_POSTINGS and scanned < MAX_TERM_SCANNED:
+        response = index_table.query(**kwargs)
+        scanned += len(response['Items'])
+        for item in response['Items']:
+            call_date = item['Rank'].split('#', 1)[1]
+            if first_day and not first_day <= call_date[:10] <= last_day:
+                continue
+            postings[item['ContactId']] = (rank_weight(item['Rank']), call_date)
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        kwargs['Limit'] = min(MAX_TERM_POSTINGS - len(postings), MAX_TERM_SCANNED - scanned)
+    return postings
+
+def rank_matches(query, day_range=None):
+    """[(ContactId, score)] chứa tất cả các từ của query, sắp xếp theo tổng weight rồi CallDate giảm dần"""
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        raise ValueError('Search query has no searchable words')
+
+    matches = read_postings(terms[0], day_range)
+    for term in terms[1:]:
+        if not matches:
+            break
+        postings = read_postings(term, day_range)
+        matches = {
+            contact_id: (weight + postings[contact_id][0], call_date)
+            for contact_id, (weight, call_date) in matches.items() if contact_id in postings
+        }
+    ranked = sorted(matches.items(), key=lambda entry: entry[1], reverse=True)
+    return [(contact_id, weight) for contact_id, (weight, _) in ranked]
+
+def batch_get_results(contact_ids):
+    """Các cột của bảng danh sách cho một trang kết quả tìm kiếm, giữ nguyên thứ tự"""
+    items = {}
+    for i in range(0, len(contact_ids), MAX_BATCH_GET_KEYS):
+        request = {TABLE_NAME: {
+            'Keys': [{'ContactId': contact_id} for contact_id in contact_ids[i:i + MAX_BATCH_GET_KEYS]],
+            'ProjectionExpression': LIST_PROJECTION,
+            'ExpressionAttributeNames': LIST_ATTRIBUTES
+        }}
+        while request:
+            response = get_dynamodb().batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(TABLE_NAME, []):
+                items[item['ContactId']] = item
+            request = response.get('UnprocessedKeys')
+    return [items[contact_id] for contact_id in contact_ids if contact_id in items]
+
+def search(params):
+    """
+    Một trang kết quả tìm kiếm, cursor là vị trí trong danh sách đã xếp hạng.
+    Chỉ lọc theo ngày khi có from/to, không thì tìm trên mọi cuộc gọi
+    """
+    list_params = parse_list_params(params)
+    offset = (list_params['cursor'] or {}).get('offset', 0)
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError('Invalid cursor')
+    day_range = None
+    if params.get('from') or params.get('to'):
+        day_range = (list_params['from_day'], list_params['to_day'])
+    matches = rank_matches(params['q'], day_range)
+    page = matches[offset:offset + list_params['limit']]
+
+    items = batch_get_results([contact_id for contact_id, _ in page]) if page else []
+    scores = dict(page)
+    for item in items:
+        item['SearchScore'] = scores[item['ContactId']]
+
+    next_offset = offset + len(page)
+    return items, len(matches), ({'offset': next_offset} if next_offset < len(matches) else None)
+
+def get_detail(table, contact_id):
+    """Lấy đầy đủ kết quả phân tích của một cuộc gọi"""
+    item = table.get_item(Key={'ContactId': contact_id}).get('Item')
+    # RawResponse có thể đang được nén hoặc lưu trên S3
+    if item and 'RawResponse' in item:
+        item['RawResponse'] = unpack_text(item['RawResponse'])
+    return item
+
+def get_metric_keys(params):
+    """Key của các rollup trong khoảng ngày theo granularity day/hour và queue"""
+    list_params = parse_list_params(params)
+    from_day, to_day = list_params['from_day'], list_params['to_day']
+    days = [from_day + timedelta(days=i) for i in range((to_day - from_day).days + 1)]
+    
+    granularity = params.get('granularity', 'day')
+    if granularity == 'hour':
+        if len(days) * 24 > MAX_METRIC_HOURS:
+            raise ValueError(f'Hourly metrics are limited to {MAX_METRIC_HOURS // 24} days')
+        return [f"HOUR#{day.isoformat()}T{hour:02d}" for day in days for hour in range(24)]
+    if granularity != 'day':
+        raise ValueError('granularity must be day or hour')
+    if len(days) > MAX_METRIC_DAYS:
+        raise ValueError(f'Daily metrics are limited to {MAX_METRIC_DAYS} days')
+    
+    if params.get('queue'):
+        return [f"QUEUE#{params['queue']}#{day.isoformat()}" for day in days]
+    return [f"DAY#{day.isoformat()}" for day in days]
+
+def batch_get_metrics(keys):
+    """Đọc các rollup theo key, O(số bucket) không phụ thuộc kích thước bảng kết quả"""
+    items = []
+    for i in range(0, len(keys), MAX_BATCH_GET_KEYS):
+        request = {METRICS_TABLE_NAME: {'Keys': [{'MetricKey': key} for key in keys[i:i + MAX_BATCH_GET_KEYS]]}}
+        while request:
+            response = get_dynamodb().batch_get_item(RequestItems=request)
+            items.extend(response['Responses'].get(METRICS_TABLE_NAME, []))
+            request = response.get('UnprocessedKeys')
+    return items
+
+def summarize_metrics(rollups):
+    """Gộp các rollup thành số liệu cho dashboard"""
+    buckets = []
+    totals = {'callCount': 0, 'scoreCount': 0, 'scoreSum': 0, 'scoreBuckets': {}, 'emotions': {}}
+    
+    for rollup in sorted(rollups, key=lambda item: item['MetricKey']):
+        bucket = {
+            'key': rollup['MetricKey'],
+            'callCount': int(rollup.get('CallCount', 0)),
+            'scoreCount': int(rollup.get('ScoreCount', 0)),
+            'scoreSum': float(rollup.get('ScoreSum', 0)),
+            'scoreBuckets': {},
+            'emotions': {}
+        }
+        for name, value in rollup.items():
+            if name.startswith('ScoreBucket#'):
+                bucket['scoreBuckets'][name[len('ScoreBucket#'):]] = int(value)
+            elif name.startswith('Emotion#'):
+                bucket['emotions'][name[len('Emotion#'):]] = int(value)
+        buckets.append(bucket)
+        
+        for field in ('callCount', 'scoreCount', 'scoreSum'):
+            totals[field] += bucket[field]
+        for field in ('scoreBuckets', 'emotions'):
+            for name, value in bucket[field].items():
+                totals[field][name] = totals[field].get(name, 0) + value
+    
+    totals['avgCompliance'] = totals['scoreSum'] / totals['scoreCount'] if totals['scoreCount'] else None
+    return {'buckets': buckets, 'totals': totals}
+
+def build_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': CORS_HEADERS,
+        # Sử dụng DecimalEncoder để serialize JSON
+        'body': json.dumps(body, cls=DecimalEncoder)
+    }
+
 def lambda_handler(event, context):
     try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('analysis-results-it-got-talent')
+        table = get_dynamodb().Table(TABLE_NAME)
+        params = event.get('queryStringParameters') or {}
+        
+        # Số liệu tổng hợp cho dashboard
+        if params.get('view') == 'metrics':
+            rollups = batch_get_metrics(get_metric_keys(params))
+            return build_response(200, {
+                'success': True,
+                'data': summarize_metrics(rollups)
+            })
         
-        response = table.scan()
-        items = response['Items']
+        # Chi tiết một cuộc gọi
+        if params.get('contactId'):
+            item = get_detail(table, params['contactId'])
+            if not item:
+                return build_response(404, {'error': 'Analysis not found'})
+            return build_response(200, {
+                'success': True,
+                'data': item
+            })
         
-        # Xử lý pagination nếu có
-        while 'LastEvaluatedKey' in response:
-            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-            items.extend(response['Items'])
+        # Tìm kiếm theo nội dung cuộc gọi, vi phạm và đề xuất
+        if params.get('q'):
+            items, total, next_cursor = search(params)
+            return build_response(200, {
+                'success': True,
+                'data': items,
+                'count': len(items),
+                'total': total,
+                'nextCursor': encode_cursor(next_cursor)
+            })
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Credentials': True,
-                'Content-Type': 'application/json'
-            },
-            # Sử dụng DecimalEncoder để serialize JSON
-            'body': json.dumps(
-                {
-                    'success': True,
-                    'data': items,
-                    'count': len(items)
-                },
-                cls=DecimalEncoder
-            )
-        }
+        # Danh sách có phân trang, lọc theo ngày/số điện thoại. Lọc theo số điện thoại là một query
+        # trên GSI nên không cần khoảng ngày mặc định: không truyền from/to thì lấy mọi cuộc gọi của số đó
+        list_params = parse_list_params(params, default_range=not params.get('phone'))
+        if list_params['phone']:
+            items, next_cursor = list_by_phone(table, list_params)
+        else:
+            items, next_cursor = list_by_day(table, list_params)
         
+        return build_response(200, {
+            'success': True,
+            'data': items,
+            'count': len(items),
+            'nextCursor': encode_cursor(next_cursor)
+        })
+        
+    except ValueError as ve:
+        return build_response(400, {'error': str(ve)})
     except Exception as e:
         print(f"Error: {str(e)}")  # Log error để debug
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'error': str(e)
-            })
-        }
\ No newline at end of file
+        return build_response(500, {'error': str(e)})
\ No newline at end of file
@@ -0,0 +1,197 @@
+import time
+import logging
+import runtime
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Bảng rollup, key MetricKey dạng DAY#<ngày>, HOUR#<ngày>T<giờ>, QUEUE#<queue>#<ngày>
+METRICS_TABLE_NAME = 'analysis-metrics'
+# Giống các khoảng điểm của biểu đồ trên dashboard
+SCORE_BUCKETS = ['0-2', '2-4', '4-6', '6-8', '8-10']
+# Giới hạn số item trong một transact_write_items
+MAX_TRANSACTION_ITEMS = 100
+# Marker APPLIED#<sequence number> của record đã cộng, giữ lâu hơn thời gian lưu của stream (24 giờ)
+# rồi xóa bằng TTL trên ExpiresAt
+APPLIED_PREFIX = 'APPLIED#'
+MARKER_TTL_SECONDS = 2 * 24 * 3600
+
+deserializer = TypeDeserializer()
+
+# Resource tạo khi dùng lần đầu qua runtime
+dynamodb = None
+
+def get_dynamodb():
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = runtime.resource('dynamodb')
+    return dynamodb
+
+def deserialize_image(image):
+    """Chuyển DynamoDB Stream image về dict Python"""
+    return {key: deserializer.deserialize(value) for key, value in image.items()}
+
+def get_score_bucket(score):
+    """Khoảng điểm compliance, None nếu điểm không hợp lệ"""
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        return None
+    return SCORE_BUCKETS[min(max(int(score // 2), 0), len(SCORE_BUCKETS) - 1)]
+
+def get_metric_keys(item):
+    """Các rollup mà một kết quả phân tích thuộc về"""
+    call_date = item.get('CallDate', '')
+    day = call_date[:10]
+    if not day:
+        return []
+    keys = [f"DAY#{day}", f"QUEUE#{item.get('QueueName', 'No Queue')}#{day}"]
+    if len(call_date) >= 13:
+        keys.append(f"HOUR#{call_date[:13]}")
+    return keys
+
+def get_deltas(item, sign):
+    """Giá trị cộng dồn (sign = 1) hoặc trừ đi (sign = -1) của một kết quả"""
+    analysis = item.get('Analysis', {})
+    deltas = {'CallCount': sign}
+    
+    score = analysis.get('compliance_score')
+    bucket = get_score_bucket(score)
+    if bucket:
+        deltas['ScoreCount'] = sign
+        deltas['ScoreSum'] = sign * float(score)
+        deltas[f"ScoreBucket#{bucket}"] = sign
+    
+    emotion = str(analysis.get('customer_emotion', 'trung tính')).strip().lower()
+    deltas[f"Emotion#{emotion}"] = sign
+    return deltas
+
+def merge_deltas(updates, item, sign):
+    """Gộp delta của một item vào tất cả rollup tương ứng"""
+    for metric_key in get_metric_keys(item):
+        metric_deltas = updates.setdefault(metric_key, {})
+        for name, value in get_deltas(item, sign).items():
+            metric_deltas[name] = metric_deltas.get(name, 0) + value
+
+def build_update(metric_key, deltas):
+    """Update bằng ADD, không cần đọc rollup trước"""
+    names = {}
+    values = {}
+    expressions = []
+    for i, (name, value) in enumerate(deltas.items()):
+        if value == 0:
+            continue
+        names[f"#a{i}"] = name
+        values[f":v{i}"] = Decimal(str(value))
+        expressions.append(f"#a{i} :v{i}")
+    
+    if not expressions:
+        return None
+    return {
+        'Update': {
+            'TableName': METRICS_TABLE_NAME,
+            'Key': {'MetricKey': metric_key},
+            'UpdateExpression': 'ADD ' + ', '.join(expressions),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values
+        }
+    }
+
+def build_marker(sequence_number, expires_at):
+    """Đánh dấu record đã được cộng vào rollup, ghi trong cùng transaction với delta của record"""
+    return {
+        'Put': {
+            'TableName': METRICS_TABLE_NAME,
+            'Item': {'MetricKey': f"{APPLIED_PREFIX}{sequence_number}", 'ExpiresAt': expires_at},
+            'ConditionExpression': 'attribute_not_exists(MetricKey)'
+        }
+    }
+
+def build_chunks(records):
+    """
+    Chia các record (sequence number, updates) thành các transaction: marker của từng record cộng với
+    update đã gộp theo rollup, không quá MAX_TRANSACTION_ITEMS item
+    """
+    chunks = []
+    chunk, metric_keys = [], set()
+    for sequence_number, updates in records:
+        keys = metric_keys | set(updates)
+        if chunk and len(chunk) + 1 + len(keys) > MAX_TRANSACTION_ITEMS:
+            chunks.append(chunk)
+            chunk, keys = [], set(updates)
+        chunk.append((sequence_number, updates))
+        metric_keys = keys
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def apply_chunk(chunk):
+    """
+    Ghi một transaction. Record có marker rồi (đã cộng ở lần giao trước, kể cả khi batch bị chia đôi hoặc
+    đổi kích thước) làm transaction bị hủy: bỏ các record đó và ghi lại phần còn lại.
+    Trả về số record bỏ qua
+    """
+    expires_at = int(time.time()) + MARKER_TTL_SECONDS
+    skipped = 0
+    while chunk:
+        merged = {}
+        for _, updates in chunk:
+            for metric_key, deltas in updates.items():
+                metric_deltas = merged.setdefault(metric_key, {})
+                for name, value in deltas.items():
+                    metric_deltas[name] = metric_deltas.get(name, 0) + value
+        # Marker đứng đầu để CancellationReasons khớp thứ tự với chunk
+        actions = [build_marker(sequence_number, expires_at) for sequence_number, _ in chunk]
+        actions += [action for action in (build_update(key, deltas) for key, deltas in merged.items()) if action]
+        try:
+            get_dynamodb().meta.client.transact_write_items(TransactItems=actions)
+            return skipped
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            reasons = e.response.get('CancellationReasons', [])
+            applied = {sequence_number for (sequence_number, _), reason in zip(chunk, reasons)
+                       if reason.get('Code') == 'ConditionalCheckFailed'}
+            if not applied:
+                raise
+            skipped += len(applied)
+            chunk = [(sequence_number, updates) for sequence_number, updates in chunk if sequence_number not in applied]
+    return skipped
+
+def apply_updates(records):
+    """
+    Ghi delta của các record vào rollup, mỗi record đúng một lần: batch lỗi được giao lại (nguyên vẹn,
+    chia đôi khi BisectBatchOnFunctionError hoặc với kích thước khác), marker theo sequence number
+    cho biết record nào đã được cộng. Trả về số record đã cộng từ trước
+    """
+    return sum(apply_chunk(chunk) for chunk in build_chunks(records))
+
+def lambda_handler(event, context):
+    # Delta của từng record gộp theo rollup, các record trong một transaction dùng chung update_item
+    records = []
+    
+    for record in event['Records']:
+        dynamodb_record = record['dynamodb']
+        updates = {}
+        
+        # MODIFY = trừ kết quả cũ, cộng kết quả mới
+        if 'OldImage' in dynamodb_record and record['eventName'] in ('MODIFY', 'REMOVE'):
+            merge_deltas(updates, deserialize_image(dynamodb_record['OldImage']), -1)
+        if 'NewImage' in dynamodb_record and record['eventName'] in ('INSERT', 'MODIFY'):
+            merge_deltas(updates, deserialize_image(dynamodb_record['NewImage']), 1)
+        records.append((dynamodb_record['SequenceNumber'], updates))
+    
+    try:
+        skipped = apply_updates(records)
+    except Exception as e:
+        # Record đã cộng có marker nên retry cả batch không cộng trùng
+        logger.error(f"Error updating metrics: {str(e)}", exc_info=True)
+        return {
+            'batchItemFailures': [{'itemIdentifier': records[0][0]}]
+        }
+    
+    logger.info(f"Updated rollups from {len(records) - skipped} records ({skipped} already applied)")
+    return {'batchItemFailures': []}
@@ -0,0 +1,175 @@
+import os
+import math
+import logging
+import runtime
+from datetime import date, datetime, timedelta
+from boto3.dynamodb.conditions import Key
+import pyarrow as pa
+import pyarrow.parquet as pq
+from instrumentation import stage_timer, emit_metric
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+RESULTS_TABLE_NAME = 'analysis-results-it-got-talent'
+# GSI: CallDay (HASH, YYYY-MM-DD) + CallDate (RANGE)
+DAY_INDEX = 'CallDay-CallDate-index'
+EXPORT_BUCKET = os.environ.get('EXPORT_BUCKET')
+# Mỗi ngày một partition kiểu Hive: analysis-results/call_day=YYYY-MM-DD/part-00000.parquet
+EXPORT_PREFIX = os.environ.get('EXPORT_PREFIX', 'analysis-results/')
+MAX_EXPORT_DAYS = 366
+
+EXPORT_ATTRIBUTES = {
+    '#cid': 'ContactId',
+    '#cd': 'CallDate',
+    '#pn': 'PhoneNumber',
+    '#qn': 'QueueName',
+    '#ts': 'AnalysisTimestamp',
+    '#rv': 'RuleVersion',
+    '#an': 'Analysis',
+    '#sc': 'compliance_score',
+    '#em': 'customer_emotion',
+    '#vi': 'violations',
+    '#re': 'recommendations'
+}
+EXPORT_PROJECTION = '#cid, #cd, #pn, #qn, #ts, #rv, #an.#sc, #an.#em, #an.#vi, #an.#re'
+
+# call_day nằm trong đường dẫn partition, không lặp lại trong file
+SCHEMA = pa.schema([
+    ('contact_id', pa.string()),
+    ('call_date', pa.timestamp('ms')),
+    ('analysis_timestamp', pa.timestamp('ms')),
+    ('phone_number', pa.string()),
+    ('queue_name', pa.string()),
+    ('rule_version', pa.string()),
+    ('compliance_score', pa.float32()),
+    ('customer_emotion', pa.string()),
+    ('violation_count', pa.int16()),
+    ('recommendation_count', pa.int16()),
+    ('violations', pa.list_(pa.string()))
+])
+
+# Client tạo khi dùng lần đầu qua runtime
+s3 = None
+
+def get_s3():
+    global s3
+    if s3 is None:
+        s3 = runtime.client('s3')
+    return s3
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+def parse_score(value):
+    """compliance_score được lưu dạng chuỗi, giá trị lỗi thành NaN"""
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return score if 0 <= score <= 10 else math.nan
+
+def flatten_item(item):
+    analysis = item.get('Analysis', {})
+    violations = [str(violation) for violation in analysis.get('violations', [])]
+    return {
+        'contact_id': item['ContactId'],
+        'call_date': parse_timestamp(item.get('CallDate')),
+        'analysis_timestamp': parse_timestamp(item.get('AnalysisTimestamp')),
+        'phone_number': item.get('PhoneNumber'),
+        'queue_name': item.get('QueueName', 'No Queue'),
+        'rule_version': item.get('RuleVersion'),
+        'compliance_score': parse_score(analysis.get('compliance_score')),
+        'customer_emotion': analysis.get('customer_emotion'),
+        'violation_count': len(violations),
+        'recommendation_count': len(analysis.get('recommendations', [])),
+        'violations': violations
+    }
+
+def query_day(table, day):
+    """Tất cả kết quả của một ngày trên DAY_INDEX, chỉ lấy các cột cần export"""
+    kwargs = {
+        'IndexName': DAY_INDEX,
+        'KeyConditionExpression': Key('CallDay').eq(day),
+        'ProjectionExpression': EXPORT_PROJECTION,
+        'ExpressionAttributeNames': EXPORT_ATTRIBUTES
+    }
+    while True:
+        response = table.query(**kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def to_arrow(rows):
+    columns = {field.name: [row[field.name] for row in rows] for field in SCHEMA}
+    return pa.Table.from_pydict(columns, schema=SCHEMA)
+
+def export_day(table, day):
+    """
+    Ghi đè partition của một ngày (chạy lại an toàn), trả về số dòng.
+    Ngày không còn kết quả thì xóa partition cũ để report không đọc lại dữ liệu đã bị thay thế
+    """
+    with stage_timer('ExportQuery'):
+        rows = [flatten_item(item) for item in query_day(table, day)]
+    key = f"{EXPORT_PREFIX}call_day={day}/part-00000.parquet"
+    if not rows:
+        # delete_object không lỗi khi key không tồn tại
+        get_s3().delete_object(Bucket=EXPORT_BUCKET, Key=key)
+        return 0
+
+    buffer = pa.BufferOutputStream()
+    with stage_timer('ParquetWrite'):
+        pq.write_table(to_arrow(rows), buffer, compression='zstd')
+    get_s3().put_object(Bucket=EXPORT_BUCKET, Key=key, Body=buffer.getvalue().to_pybytes())
+    return len(rows)
+
+def get_export_days(event):
+    """
+    Ngày hôm qua khi chạy theo lịch, khoảng {"from", "to"} (YYYY-MM-DD) khi backfill,
+    hoặc danh sách {"days": [...]} (tools/rescore.py export lại các ngày đã chấm lại)
+    """
+    if event.get('days'):
+        days = sorted({date.fromisoformat(day).isoformat() for day in event['days']})
+        if len(days) > MAX_EXPORT_DAYS:
+            raise ValueError(f"Export is limited to {MAX_EXPORT_DAYS} days")
+        return days
+    if event.get('from'):
+        from_day = date.fromisoformat(event['from'])
+        to_day = date.fromisoformat(event.get('to', event['from']))
+    else:
+        from_day = to_day = date.today() - timedelta(days=1)
+
+    if to_day < from_day or (to_day - from_day).days >= MAX_EXPORT_DAYS:
+        raise ValueError(f"Export range must be 1 to {MAX_EXPORT_DAYS} days")
+    return [(from_day + timedelta(days=i)).isoformat() for i in range((to_day - from_day).days + 1)]
+
+def lambda_handler(event, context):
+    try:
+        if not EXPORT_BUCKET:
+            raise ValueError('EXPORT_BUCKET is not configured')
+        days = get_export_days(event or {})
+        table = runtime.table(RESULTS_TABLE_NAME)
+
+        exported = {}
+        for day in days:
+            exported[day] = export_day(table, day)
+            logger.info(f"Exported {exported[day]} results for {day}")
+
+        emit_metric('ExportedRows', sum(exported.values()), 'Count', 'ResultsExport')
+        return {
+            'statusCode': 200,
+            'body': {
+                'exported': exported,
+                'location': f"s3://{EXPORT_BUCKET}/{EXPORT_PREFIX}"
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error exporting results: {str(e)}", exc_info=True)
+        return {
+            'statusCode': 500,
+            'body': {'error': str(e)}
+        }
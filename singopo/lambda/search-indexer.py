@@ -0,0 +1,104 @@
+import logging
+import runtime
+from boto3.dynamodb.types import TypeDeserializer
+from text_storage import unpack_text
+from search_index import INDEX_TABLE_NAME, term_weights, rank_key, doc_key
+from instrumentation import stage_timer, emit_metric
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# TranscriptionText nằm ở bảng cuộc gọi, bảng kết quả chỉ có Analysis
+CALLS_TABLE_NAME = 'customer-call-analysis'
+
+deserializer = TypeDeserializer()
+
+# Table tạo khi dùng lần đầu qua runtime
+index_table = None
+calls_table = None
+
+def get_index_table():
+    global index_table
+    if index_table is None:
+        index_table = runtime.table(INDEX_TABLE_NAME)
+    return index_table
+
+def get_calls_table():
+    global calls_table
+    if calls_table is None:
+        calls_table = runtime.table(CALLS_TABLE_NAME)
+    return calls_table
+
+def deserialize_image(image):
+    """Chuyển DynamoDB Stream image về dict Python"""
+    return {key: deserializer.deserialize(value) for key, value in image.items()}
+
+def get_transcript(contact_id):
+    item = get_calls_table().get_item(
+        Key={'ContactId': contact_id},
+        ProjectionExpression='TranscriptionText'
+    ).get('Item') or {}
+    # TranscriptionText có thể đang được nén hoặc lưu trên S3
+    return unpack_text(item.get('TranscriptionText')) or ''
+
+def get_indexed_terms(contact_id):
+    """{term: Rank} đã ghi cho cuộc gọi ở lần index trước"""
+    item = get_index_table().get_item(Key=doc_key(contact_id)).get('Item') or {}
+    return item.get('Terms', {})
+
+def build_postings(item):
+    analysis = item.get('Analysis', {})
+    weights = term_weights({
+        'transcript': get_transcript(item['ContactId']),
+        'violations': [str(value) for value in analysis.get('violations', [])],
+        'recommendations': [str(value) for value in analysis.get('recommendations', [])]
+    })
+    return {term: rank_key(weight, item.get('CallDate')) for term, weight in weights.items()}
+
+def write_postings(contact_id, old_terms, new_terms):
+    """
+    Chỉ ghi các posting thay đổi; item doc được ghi sau cùng nên khi retry,
+    các posting còn sót từ lần trước vẫn được so sánh và dọn lại
+    """
+    removed = [term for term in old_terms if term not in new_terms]
+    changed = {term: rank for term, rank in new_terms.items() if old_terms.get(term) != rank}
+
+    with get_index_table().batch_writer(overwrite_by_pkeys=['Term', 'ContactId']) as batch:
+        for term in removed:
+            batch.delete_item(Key={'Term': term, 'ContactId': contact_id})
+        for term, rank in changed.items():
+            batch.put_item(Item={'Term': term, 'ContactId': contact_id, 'Rank': rank})
+
+    if new_terms:
+        get_index_table().put_item(Item={**doc_key(contact_id), 'Terms': new_terms})
+    else:
+        get_index_table().delete_item(Key=doc_key(contact_id))
+    return len(removed) + len(changed)
+
+def index_record(record):
+    dynamodb_record = record['dynamodb']
+    if record['eventName'] == 'REMOVE':
+        contact_id = deserialize_image(dynamodb_record['Keys'])['ContactId']
+        new_terms = {}
+    else:
+        item = deserialize_image(dynamodb_record['NewImage'])
+        contact_id = item['ContactId']
+        new_terms = build_postings(item)
+    return write_postings(contact_id, get_indexed_terms(contact_id), new_terms)
+
+def lambda_handler(event, context):
+    writes = 0
+    for record in event['Records']:
+        try:
+            with stage_timer('SearchIndex'):
+                writes += index_record(record)
+        except Exception as e:
+            # Stream retry từ record lỗi, các record trước đó đã được index
+            logger.error(f"Error indexing record: {str(e)}", exc_info=True)
+            return {
+                'batchItemFailures': [{'itemIdentifier': record['dynamodb']['SequenceNumber']}]
+            }
+
+    emit_metric('IndexWrites', writes, 'Count', 'SearchIndex')
+    logger.info(f"Indexed {len(event['Records'])} records with {writes} posting writes")
+    return {'batchItemFailures': []}
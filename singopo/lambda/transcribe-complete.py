@@ -0,0 +1,226 @@
+import json
+import datetime
+import urllib.parse
+import logging
+from decimal import Decimal
+import runtime
+from instrumentation import stage_timer, emit_metric, record_payload
+from text_storage import pack_text, pack_json
+from transcribe_queue import release_slot, admit_jobs
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Client tạo khi dùng lần đầu qua runtime, dùng chung với transcribe_queue và text_storage
+s3 = None
+table = None
+jobs_table = None
+
+def get_s3():
+    global s3
+    if s3 is None:
+        s3 = runtime.client('s3')
+    return s3
+
+def get_table():
+    global table
+    if table is None:
+        table = runtime.table('customer-call-analysis')
+    return table
+
+def get_jobs_table():
+    global jobs_table
+    if jobs_table is None:
+        jobs_table = runtime.table('transcription-jobs')
+    return jobs_table
+
+def get_job_mapping(job_name):
+    """Lấy ContactId, thời điểm submit và TimeOffset (nếu file đã được cắt phần đầu) của transcription job"""
+    response = get_jobs_table().get_item(Key={'JobName': job_name})
+    item = response.get('Item')
+    if not item:
+        raise Exception(f'No ContactId mapping found for job {job_name}')
+    return item
+
+def to_seconds(value):
+    """Thời gian của Transcribe (chuỗi giây) sang Decimal cho DynamoDB"""
+    return Decimal(str(round(float(value), 2)))
+
+def timed_words(results):
+    """
+    Các từ [speaker, start, end, content] theo thứ tự thời gian, dấu câu gắn vào từ đứng trước.
+    Job ChannelIdentification (file 2 kênh) có items riêng cho từng kênh, người nói là channel_label
+    """
+    channels = results.get('channel_labels', {}).get('channels')
+    if channels:
+        streams = [(channel.get('items', []), channel['channel_label']) for channel in channels]
+    else:
+        streams = [(results.get('items', []), None)]
+    
+    # Dựng lại từ items + speaker_labels (audio_segments không phải lúc nào cũng có)
+    speaker_by_start = {}
+    for segment in results.get('speaker_labels', {}).get('segments', []):
+        for item in segment.get('items', []):
+            speaker_by_start[item['start_time']] = item['speaker_label']
+    
+    words = []
+    for items, channel_label in streams:
+        stream_words = []
+        for item in items:
+            content = item['alternatives'][0]['content']
+            
+            # Dấu câu không có thời gian, gắn vào từ trước đó của cùng kênh
+            if item['type'] == 'punctuation':
+                if stream_words:
+                    stream_words[-1][3] += content
+                continue
+            
+            speaker = channel_label or item.get('speaker_label') or speaker_by_start.get(item['start_time'], 'spk_0')
+            stream_words.append([speaker, float(item['start_time']), float(item['end_time']), content])
+        words.extend(stream_words)
+    # sort ổn định: giữ thứ tự trong kênh khi hai kênh có từ cùng thời điểm
+    return sorted(words, key=lambda word: word[1])
+
+def parse_segments(results, time_offset=0.0):
+    """
+    Gom output thành các đoạn liên tục của cùng một người nói: [{'speaker', 'start', 'end', 'text'}].
+    time_offset là số giây lặng đầu cuộc gọi đã bị cắt trước khi gửi Transcribe,
+    cộng vào để mốc thời gian khớp với file ghi âm gốc
+    """
+    segments = []
+    for speaker, start, end, content in timed_words(results):
+        if segments and segments[-1]['speaker'] == speaker:
+            segments[-1]['text'] += ' ' + content
+            segments[-1]['end'] = to_seconds(end + time_offset)
+        else:
+            segments.append({
+                'speaker': speaker,
+                'start': to_seconds(start + time_offset),
+                'end': to_seconds(end + time_offset),
+                'text': content
+            })
+    return segments
+
+def seconds_since(iso_timestamp):
+    """Số giây từ thời điểm submit tới hiện tại (thời gian Lambda không còn phải chờ)"""
+    submitted_at = datetime.datetime.fromisoformat(iso_timestamp)
+    return (datetime.datetime.now() - submitted_at).total_seconds()
+
+def free_slot():
+    """Job đã kết thúc: trả slot và admit file tiếp theo trong hàng đợi"""
+    release_slot()
+    try:
+        admitted = admit_jobs()
+        logger.info(f"Admitted {admitted} queued transcription jobs")
+    except Exception as e:
+        # transcribe-scheduler sẽ admit ở lần chạy sau
+        logger.error(f"Error admitting queued jobs: {str(e)}", exc_info=True)
+
+def complete_transcription(bucket_name, output_key):
+    """Đọc kết quả transcription từ S3 và cập nhật customer-call-analysis"""
+    job_name = output_key.split('/')[-1][:-len('.json')]
+    mapping = get_job_mapping(job_name)
+    contact_id = mapping['ContactId']
+    
+    response = get_s3().get_object(Bucket=bucket_name, Key=output_key)
+    transcript_body = response['Body'].read()
+    record_payload('TranscriptOutput', transcript_body)
+    transcript_data = json.loads(transcript_body.decode('utf-8'))
+    transcript_text = transcript_data['results']['transcripts'][0]['transcript']
+    transcript_segments = parse_segments(transcript_data['results'], float(mapping.get('TimeOffset', 0)))
+    
+    # Cập nhật DynamoDB với kết quả transcription (bản text đầy đủ + các đoạn theo người nói),
+    # cuộc gọi dài được nén hoặc đưa lên S3 để item và stream record nhỏ lại
+    storage_key = f"customer-call-analysis/{contact_id}"
+    with stage_timer('DynamoDBWrite'):
+        get_table().update_item(
+            Key={'ContactId': contact_id},
+            UpdateExpression="set TranscriptionText = :t, TranscriptSegments = :g, TranscriptionStatus = :s, TranscriptionTimestamp = :ts",
+            ExpressionAttributeValues={
+                ':t': pack_text(transcript_text, f"{storage_key}/TranscriptionText"),
+                ':g': pack_json(transcript_segments, f"{storage_key}/TranscriptSegments"),
+                ':s': 'COMPLETED',
+                ':ts': datetime.datetime.now().isoformat()
+            }
+        )
+    get_jobs_table().delete_item(Key={'JobName': job_name})
+    free_slot()
+    
+    # Trước đây audio-text.py phải sleep suốt khoảng thời gian này
+    saved_seconds = seconds_since(mapping['SubmittedAt'])
+    emit_metric('TranscribeWait', round(saved_seconds, 3), 'Seconds', 'TranscribeWait')
+    logger.info(f"Transcription {job_name} completed for ContactId {contact_id}, "
+                f"Lambda-seconds saved: {saved_seconds:.1f}")
+    
+    return {
+        'contactId': contact_id,
+        'jobName': job_name,
+        'lambdaSecondsSaved': saved_seconds
+    }
+
+def fail_transcription(job_name, reason):
+    """Đánh dấu FAILED khi nhận sự kiện Transcribe Job State Change từ EventBridge"""
+    mapping = get_job_mapping(job_name)
+    contact_id = mapping['ContactId']
+    
+    get_table().update_item(
+        Key={'ContactId': contact_id},
+        UpdateExpression="set TranscriptionStatus = :s, TranscriptionError = :e, LastUpdatedAt = :t",
+        ExpressionAttributeValues={
+            ':s': 'FAILED',
+            ':e': reason,
+            ':t': datetime.datetime.now().isoformat()
+        }
+    )
+    get_jobs_table().delete_item(Key={'JobName': job_name})
+    free_slot()
+    logger.error(f"Transcription {job_name} failed for ContactId {contact_id}: {reason}")
+    
+    return {
+        'contactId': contact_id,
+        'jobName': job_name
+    }
+
+def lambda_handler(event, context):
+    # Job lỗi không ghi file ra S3, nên được báo qua EventBridge
+    if event.get('detail-type') == 'Transcribe Job State Change':
+        detail = event['detail']
+        if detail.get('TranscriptionJobStatus') != 'FAILED':
+            return {'statusCode': 200, 'body': 'Skipped event'}
+        result = fail_transcription(
+            detail['TranscriptionJobName'],
+            detail.get('FailureReason', f"Transcription job {detail['TranscriptionJobName']} failed")
+        )
+        return {'statusCode': 200, 'body': result}
+    
+    results = []
+    errors = []
+    
+    for record in event['Records']:
+        bucket_name = record['s3']['bucket']['name']
+        output_key = urllib.parse.unquote_plus(record['s3']['object']['key'])
+        
+        if not output_key.startswith('transcribed/') or not output_key.endswith('.json'):
+            continue
+        
+        try:
+            results.append(complete_transcription(bucket_name, output_key))
+        except Exception as e:
+            logger.error(f"Error completing transcription {output_key}: {str(e)}", exc_info=True)
+            errors.append({'key': output_key, 'error': str(e)})
+    
+    if errors:
+        return {
+            'statusCode': 500,
+            'body': {
+                'completed': results,
+                'errors': errors
+            }
+        }
+    
+    return {
+        'statusCode': 200,
+        'body': {
+            'completed': results
+        }
+    }
\ No newline at end of file
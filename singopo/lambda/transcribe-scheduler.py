@@ -0,0 +1,30 @@
+import json
+import logging
+from transcribe_queue import admit_jobs, reconcile_in_flight, get_queue_depth, scheduler_stats
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+def lambda_handler(event, context):
+    """
+    Chạy theo lịch EventBridge (mỗi phút): đồng bộ lại số job đang chạy rồi admit các file
+    ghi âm còn trong hàng đợi, phòng khi không có transcribe-complete nào trả slot
+    """
+    try:
+        in_flight = reconcile_in_flight()
+        admitted = admit_jobs()
+        depth = get_queue_depth()
+    except Exception as e:
+        logger.error(f"Error scheduling transcription jobs: {str(e)}", exc_info=True)
+        return {'statusCode': 500, 'body': {'error': str(e)}}
+    
+    logger.info(f"In flight before admit: {in_flight}, admitted: {admitted}, queue depth: {json.dumps(depth)}, "
+                f"stats: {json.dumps(scheduler_stats)}")
+    return {
+        'statusCode': 200,
+        'body': {
+            'inFlight': in_flight,
+            'admitted': admitted,
+            'queueDepth': depth
+        }
+    }
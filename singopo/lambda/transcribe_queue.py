@@ -0,0 +1,344 @@
+"""
+Hàng đợi transcription có ưu tiên, giới hạn số job Transcribe chạy đồng thời.
+audio-text.py đưa file ghi âm vào hàng đợi; job được submit khi còn slot (MAX_CONCURRENT_JOBS),
+cuộc gọi Sale trước Switchboard. Slot được trả lại ở transcribe-complete.py, transcribe-scheduler.py
+chạy định kỳ để admit phần còn lại và đồng bộ lại bộ đếm.
+"""
+import os
+import time
+import random
+import datetime
+import logging
+import runtime
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from instrumentation import emit_metric
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Priority (N, HASH) + EntryKey (S, RANGE: QueuedAt#JobName), query theo EntryKey tăng dần = FIFO
+QUEUE_TABLE_NAME = 'transcription-queue'
+JOBS_TABLE_NAME = 'transcription-jobs'
+# Item đếm số job đang chạy trong bảng transcription-jobs
+IN_FLIGHT_KEY = '#in-flight'
+MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', '100'))
+
+# Số nhỏ được admit trước, theo queue trong các flow Amazon Connect (singopo/amazon-connect)
+QUEUE_PRIORITIES = {'Sales Queue': 0, 'Switchboard Queue': 2}
+# Instance Amazon Connect để tra queue thật của cuộc gọi (DescribeContact / DescribeQueue)
+CONNECT_INSTANCE_ID = os.environ.get('CONNECT_INSTANCE_ID')
+DEFAULT_PRIORITY = 1
+PRIORITY_LEVELS = (0, 1, 2)
+ADMIT_BATCH_SIZE = 25
+
+# Retry khi Transcribe từ chối vì vượt quota / throttle
+SUBMIT_MAX_ATTEMPTS = 4
+SUBMIT_RETRY_BASE_SECONDS = 0.5
+THROTTLE_ERRORS = {'ThrottlingException', 'LimitExceededException', 'TooManyRequestsException'}
+
+scheduler_stats = {'queued': 0, 'admitted': 0, 'throttled': 0, 'requeued': 0, 'failed': 0}
+
+# QueueId -> tên queue, cache trong container
+queue_names = {}
+
+# Client tạo khi dùng lần đầu qua runtime, cùng bản với audio-text / transcribe-complete
+connect = None
+transcribe = None
+queue_table = None
+jobs_table = None
+table = None
+
+def get_transcribe():
+    global transcribe
+    if transcribe is None:
+        transcribe = runtime.client('transcribe')
+    return transcribe
+
+def get_connect():
+    global connect
+    if connect is None:
+        connect = runtime.client('connect')
+    return connect
+
+def get_queue_table():
+    global queue_table
+    if queue_table is None:
+        queue_table = runtime.table(QUEUE_TABLE_NAME)
+    return queue_table
+
+def get_jobs_table():
+    global jobs_table
+    if jobs_table is None:
+        jobs_table = runtime.table(JOBS_TABLE_NAME)
+    return jobs_table
+
+def get_table():
+    global table
+    if table is None:
+        table = runtime.table('customer-call-analysis')
+    return table
+
+def get_priority(queue_name):
+    return QUEUE_PRIORITIES.get(queue_name, DEFAULT_PRIORITY)
+
+def resolve_queue_name(contact_id):
+    """
+    Tên queue mà cuộc gọi được chuyển vào, tra từ Amazon Connect khi file ghi âm tới (cuộc gọi đã kết thúc).
+    QueueInfo lưu lúc đầu cuộc gọi thường trống: flow Switchboard gọi get-customer-profile trước
+    UpdateContactTargetQueue, flow Sale không gọi. None nếu không cấu hình instance hoặc không tra được
+    """
+    if not CONNECT_INSTANCE_ID:
+        return None
+    try:
+        contact = get_connect().describe_contact(InstanceId=CONNECT_INSTANCE_ID, ContactId=contact_id)['Contact']
+        queue_id = contact.get('QueueInfo', {}).get('Id')
+        if not queue_id:
+            return None
+        if queue_id not in queue_names:
+            queue = get_connect().describe_queue(InstanceId=CONNECT_INSTANCE_ID, QueueId=queue_id)['Queue']
+            queue_names[queue_id] = queue['Name']
+        return queue_names[queue_id]
+    except Exception as e:
+        logger.warning(f"Could not resolve queue of ContactId {contact_id}: {str(e)}")
+        return None
+
+def is_conditional_failure(error):
+    return error.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+def enqueue_job(job_name, contact_id, bucket_name, media_key, transcribe_key, media_info, priority):
+    """
+    Thêm một file ghi âm vào hàng đợi (transcribe_key là file gửi Transcribe, có thể đã thu gọn).
+    media_info: SampleRate, Channels, TimeOffset của file đã thu gọn, rỗng nếu gửi file gốc
+    """
+    queued_at = datetime.datetime.now().isoformat()
+    entry = {
+        'Priority': priority,
+        'EntryKey': f"{queued_at}#{job_name}",
+        'JobName': job_name,
+        'ContactId': contact_id,
+        'BucketName': bucket_name,
+        'MediaKey': media_key,
+        'TranscribeKey': transcribe_key,
+        'QueuedAt': queued_at,
+        'Attempts': 0
+    }
+    entry.update(media_info or {})
+    get_queue_table().put_item(Item=entry)
+    scheduler_stats['queued'] += 1
+    return entry
+
+def acquire_slot():
+    """Tăng bộ đếm job đang chạy nếu còn dưới MAX_CONCURRENT_JOBS"""
+    try:
+        get_jobs_table().update_item(
+            Key={'JobName': IN_FLIGHT_KEY},
+            UpdateExpression='ADD InFlight :one',
+            ConditionExpression='attribute_not_exists(InFlight) OR InFlight < :limit',
+            ExpressionAttributeValues={':one': 1, ':limit': MAX_CONCURRENT_JOBS}
+        )
+        return True
+    except ClientError as e:
+        if not is_conditional_failure(e):
+            raise
+        return False
+
+def release_slot():
+    try:
+        get_jobs_table().update_item(
+            Key={'JobName': IN_FLIGHT_KEY},
+            UpdateExpression='ADD InFlight :minus_one',
+            ConditionExpression='InFlight > :zero',
+            ExpressionAttributeValues={':minus_one': -1, ':zero': 0}
+        )
+    except ClientError as e:
+        if not is_conditional_failure(e):
+            raise
+
+def claim_entry(entry):
+    """Xóa entry khỏi hàng đợi, False nếu scheduler khác đã lấy"""
+    try:
+        get_queue_table().delete_item(
+            Key={'Priority': entry['Priority'], 'EntryKey': entry['EntryKey']},
+            ConditionExpression='attribute_exists(EntryKey)'
+        )
+        return True
+    except ClientError as e:
+        if not is_conditional_failure(e):
+            raise
+        return False
+
+def submit_job(entry):
+    """start_transcription_job có retry + backoff khi bị throttle, False nếu vẫn bị từ chối"""
+    job_args = {
+        'TranscriptionJobName': entry['JobName'],
+        'Media': {'MediaFileUri': f"s3://{entry['BucketName']}/{entry['TranscribeKey']}"},
+        'MediaFormat': 'wav',
+        'LanguageCode': 'vi-VN',
+        'OutputBucketName': entry['BucketName'],
+        'OutputKey': f"transcribed/{entry['JobName']}.json",
+        # Tách lời nhân viên và khách hàng (2 người nói)
+        'Settings': {'ShowSpeakerLabels': True, 'MaxSpeakerLabels': 2}
+    }
+    if int(entry.get('Channels', 0)) == 2:
+        # Connect ghi mỗi bên một kênh: tách theo kênh chính xác hơn đoán người nói
+        job_args['Settings'] = {'ChannelIdentification': True}
+    if entry.get('SampleRate'):
+        job_args['MediaSampleRateHertz'] = int(entry['SampleRate'])
+
+    for attempt in range(SUBMIT_MAX_ATTEMPTS):
+        try:
+            get_transcribe().start_transcription_job(**job_args)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLE_ERRORS:
+                raise
+            scheduler_stats['throttled'] += 1
+            if attempt < SUBMIT_MAX_ATTEMPTS - 1:
+                time.sleep(SUBMIT_RETRY_BASE_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
+    return False
+
+def requeue_entry(entry):
+    """Trả entry về đúng vị trí cũ trong hàng đợi sau khi bị throttle"""
+    get_queue_table().put_item(Item={**entry, 'Attempts': int(entry.get('Attempts', 0)) + 1})
+    scheduler_stats['requeued'] += 1
+
+def mark_failed(entry, error):
+    get_table().update_item(
+        Key={'ContactId': entry['ContactId']},
+        UpdateExpression="set TranscriptionStatus = :s, TranscriptionError = :e, LastUpdatedAt = :t",
+        ExpressionAttributeValues={
+            ':s': 'FAILED',
+            ':e': error,
+            ':t': datetime.datetime.now().isoformat()
+        }
+    )
+    scheduler_stats['failed'] += 1
+
+def start_entry(entry):
+    """Submit một entry đã claim và đã có slot, trả về 'submitted', 'throttled' hoặc 'failed'"""
+    # Lưu mapping trước khi submit để bước hoàn tất luôn tìm thấy ContactId
+    get_jobs_table().put_item(Item={
+        'JobName': entry['JobName'],
+        'ContactId': entry['ContactId'],
+        'BucketName': entry['BucketName'],
+        'MediaKey': entry['MediaKey'],
+        'TimeOffset': entry.get('TimeOffset', 0),
+        'SubmittedAt': datetime.datetime.now().isoformat()
+    })
+    try:
+        submitted = submit_job(entry)
+    except Exception as e:
+        logger.error(f"Error submitting {entry['JobName']}: {str(e)}")
+        get_jobs_table().delete_item(Key={'JobName': entry['JobName']})
+        mark_failed(entry, str(e))
+        return 'failed'
+
+    if not submitted:
+        get_jobs_table().delete_item(Key={'JobName': entry['JobName']})
+        return 'throttled'
+
+    get_table().update_item(
+        Key={'ContactId': entry['ContactId']},
+        UpdateExpression="set TranscriptionStatus = :s",
+        ExpressionAttributeValues={':s': 'PROCESSING'}
+    )
+    queued_at = datetime.datetime.fromisoformat(entry['QueuedAt'])
+    emit_metric('QueueWait', round((datetime.datetime.now() - queued_at).total_seconds(), 3), 'Seconds', 'TranscribeQueue')
+    scheduler_stats['admitted'] += 1
+    return 'submitted'
+
+def get_queue_depth():
+    """Số entry đang chờ theo từng mức ưu tiên"""
+    depth = {}
+    for priority in PRIORITY_LEVELS:
+        query_kwargs = {'KeyConditionExpression': Key('Priority').eq(priority), 'Select': 'COUNT'}
+        count = 0
+        while True:
+            response = get_queue_table().query(**query_kwargs)
+            count += response['Count']
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        depth[priority] = count
+    return depth
+
+def emit_queue_depth():
+    depth = get_queue_depth()
+    emit_metric('QueueDepth', sum(depth.values()), 'Count', 'TranscribeQueue')
+    return depth
+
+def admit_jobs():
+    """Submit các entry theo thứ tự ưu tiên cho tới khi hết slot hoặc hết hàng đợi, trả về số job đã submit"""
+    admitted = 0
+    for priority in PRIORITY_LEVELS:
+        while True:
+            entries = get_queue_table().query(
+                KeyConditionExpression=Key('Priority').eq(priority),
+                Limit=ADMIT_BATCH_SIZE
+            ).get('Items', [])
+            if not entries:
+                break
+
+            for entry in entries:
+                if not acquire_slot():
+                    emit_queue_depth()
+                    return admitted
+                if not claim_entry(entry):
+                    release_slot()
+                    continue
+
+                outcome = start_entry(entry)
+                if outcome == 'submitted':
+                    admitted += 1
+                    continue
+                release_slot()
+                if outcome == 'throttled':
+                    # Transcribe đang đầy dù bộ đếm còn slot: chờ lần admit sau
+                    requeue_entry(entry)
+                    emit_queue_depth()
+                    return admitted
+
+    emit_queue_depth()
+    return admitted
+
+def get_in_flight():
+    """Giá trị hiện tại của bộ đếm, None nếu chưa có"""
+    item = get_jobs_table().get_item(Key={'JobName': IN_FLIGHT_KEY}, ConsistentRead=True).get('Item')
+    return int(item['InFlight']) if item and 'InFlight' in item else None
+
+def reconcile_in_flight():
+    """
+    Đặt lại bộ đếm theo số mapping trong transcription-jobs (mỗi job đang chạy có đúng một mapping),
+    sửa lệch khi một lần invoke dừng giữa acquire_slot và release_slot. Chỉ ghi nếu bộ đếm không đổi
+    trong lúc scan; có acquire_slot / release_slot xen vào thì để lần chạy sau đồng bộ
+    """
+    counted = get_in_flight()
+    scan_kwargs = {'Select': 'COUNT', 'FilterExpression': 'JobName <> :key', 'ExpressionAttributeValues': {':key': IN_FLIGHT_KEY}}
+    in_flight = 0
+    while True:
+        response = get_jobs_table().scan(**scan_kwargs)
+        in_flight += response['Count']
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    if counted != in_flight:
+        if counted is None:
+            condition, values = 'attribute_not_exists(InFlight)', {':n': in_flight}
+        else:
+            condition, values = 'InFlight = :counted', {':n': in_flight, ':counted': counted}
+        try:
+            get_jobs_table().update_item(
+                Key={'JobName': IN_FLIGHT_KEY},
+                UpdateExpression='SET InFlight = :n',
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
+            )
+            logger.info(f"In-flight counter reconciled from {counted} to {in_flight}")
+        except ClientError as e:
+            if not is_conditional_failure(e):
+                raise
+            logger.info("In-flight counter changed during reconcile, keeping it")
+    emit_metric('InFlightJobs', in_flight, 'Count', 'TranscribeQueue')
+    return in_flight
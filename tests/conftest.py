@@ -0,0 +1,39 @@
+"""
+Test các handler với S3 / DynamoDB / SQS / Transcribe / Connect / Bedrock giả lập của tools/benchmark.py,
+không cần tài khoản AWS. Chạy: python -m pytest -q
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+import benchmark
+import transcribe_queue
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """
+    Các Lambda đã nối với stand-in trong bộ nhớ. contacts: cuộc gọi giả lập mà Transcribe / Connect biết,
+    Bedrock trả JSON hợp lệ không có độ trễ
+    """
+    def build(contacts=(), transcribe_limit=None, max_concurrent_jobs=transcribe_queue.MAX_CONCURRENT_JOBS):
+        monkeypatch.setattr(transcribe_queue, 'MAX_CONCURRENT_JOBS', max_concurrent_jobs)
+        dynamodb = benchmark.LocalDynamoDB()
+        s3 = benchmark.LocalS3()
+        transcribe = benchmark.LocalTranscribe(
+            s3, {contact['contactId']: contact['turns'] for contact in contacts}, transcribe_limit
+        )
+        connect = benchmark.LocalConnect({contact['contactId']: contact['queue'] for contact in contacts})
+        bedrock = benchmark.StubBedrock(0, 0, 0, seed=1)
+        collector = benchmark.MetricCollector()
+        modules = benchmark.load_pipeline(dynamodb, s3, None, transcribe, connect, bedrock, collector)
+        failures = {}
+        return SimpleNamespace(
+            dynamodb=dynamodb, s3=s3, transcribe=transcribe, connect=connect, bedrock=bedrock,
+            modules=modules, collector=collector, failures=failures,
+            invoke=lambda name, event: benchmark.invoke(collector, failures, modules, name, event)
+        )
+    return build
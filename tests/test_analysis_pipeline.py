@@ -0,0 +1,122 @@
+import hashlib
+import random
+
+import benchmark
+
+BUCKET = 'call-recordings-test'
+CUSTOMER_TABLE = 'customer-call-analysis'
+RESULTS_TABLE = 'analysis-results-it-got-talent'
+
+def transcribe_calls(run, contacts):
+    """contact flow -> file ghi âm -> Transcribe, bản ghi cuộc gọi có transcript như trên AWS"""
+    for contact in contacts:
+        run.invoke('get-customer-profile', benchmark.connect_event(contact))
+    for contact in contacts:
+        run.invoke('audio-text', benchmark.s3_event(BUCKET, f"recordings/{contact['contactId']}_recording.wav"))
+    benchmark.drain_transcriptions(run.collector, run.failures, run.modules, run.transcribe)
+
+def stream_events(run, table_name=CUSTOMER_TABLE):
+    return list(benchmark.stream_batches(run.dynamodb.Table(table_name), 10))
+
+def analyse(run, events):
+    """Giao các batch stream cho analysis-results, trả về itemIdentifier của các record lỗi"""
+    failed = []
+    for event in events:
+        result = run.modules['analysis-results'].lambda_handler(event, None)
+        failed.extend(failure['itemIdentifier'] for failure in result['batchItemFailures'])
+    return failed
+
+def results(run):
+    return {key[0]: item for key, item in run.dynamodb.Table(RESULTS_TABLE).items.items()}
+
+def test_transcript_is_analysed_and_saved(pipeline):
+    contacts = benchmark.build_contacts(3, 0, seed=5)
+    run = pipeline(contacts)
+    transcribe_calls(run, contacts)
+
+    events = stream_events(run)
+    # Bản ghi cuộc gọi được INSERT khi chưa có transcript, transcript tới bằng MODIFY
+    inserts = [record for event in events for record in event['Records'] if record['eventName'] == 'INSERT']
+    assert len(inserts) == 3
+    assert all('TranscriptionText' not in record['dynamodb']['NewImage'] for record in inserts)
+
+    assert analyse(run, events) == []
+
+    saved = results(run)
+    assert sorted(saved) == sorted(contact['contactId'] for contact in contacts)
+    customers = run.dynamodb.Table(CUSTOMER_TABLE).items
+    for contact in contacts:
+        item = saved[contact['contactId']]
+        customer = customers[(contact['contactId'],)]
+        assert item['QueueName'] == contact['queue']
+        assert item['PhoneNumber'] == customer['PhoneNumber']
+        assert item['CallDay'] == customer['CallDate'][:10]
+        assert 1 <= float(item['Analysis']['compliance_score']) <= 10
+        assert item['TranscriptHash'] == hashlib.sha256(
+            run.modules['analysis-results'].unpack_text(customer['TranscriptionText']).encode('utf-8')
+        ).hexdigest()
+    assert run.bedrock.calls == 3
+
+def test_replayed_batch_is_not_analysed_again(pipeline):
+    contacts = benchmark.build_contacts(2, 0, seed=6)
+    run = pipeline(contacts)
+    transcribe_calls(run, contacts)
+    events = stream_events(run)
+    assert analyse(run, events) == []
+    saved = {contact_id: dict(item) for contact_id, item in results(run).items()}
+
+    # Stream giao lại batch (Lambda retry / replay)
+    assert analyse(run, events) == []
+
+    assert run.bedrock.calls == 2
+    assert results(run) == saved
+
+def test_status_update_does_not_trigger_analysis(pipeline):
+    contacts = benchmark.build_contacts(1, 0, seed=7)
+    run = pipeline(contacts)
+    transcribe_calls(run, contacts)
+    analyse(run, stream_events(run))
+    calls = run.bedrock.calls
+
+    run.dynamodb.Table(CUSTOMER_TABLE).update_item(
+        Key={'ContactId': contacts[0]['contactId']},
+        UpdateExpression='SET ProcessingStatus = :s',
+        ExpressionAttributeValues={':s': 'REVIEWED'}
+    )
+    assert analyse(run, stream_events(run)) == []
+    assert run.bedrock.calls == calls
+
+def test_failed_analysis_is_retried(pipeline):
+    contacts = benchmark.build_contacts(1, 0, seed=8)
+    run = pipeline(contacts)
+    transcribe_calls(run, contacts)
+    events = stream_events(run)
+
+    def unavailable(**kwargs):
+        raise RuntimeError('Bedrock unavailable')
+    retrieve_and_generate = run.bedrock.retrieve_and_generate
+    run.bedrock.retrieve_and_generate = unavailable
+    failed = analyse(run, events)
+
+    # Chỉ record có transcript bị báo lỗi, claim được trả lại để lần giao sau phân tích được
+    transcript_records = [record['dynamodb']['SequenceNumber'] for event in events for record in event['Records']
+                          if 'TranscriptionText' in record['dynamodb'].get('NewImage', {})]
+    assert failed == transcript_records
+    assert results(run) == {}
+
+    run.bedrock.retrieve_and_generate = retrieve_and_generate
+    assert analyse(run, events) == []
+    assert list(results(run)) == [contacts[0]['contactId']]
+
+def test_cache_hits_are_counted(pipeline):
+    run = pipeline()
+    knowledge_base = run.modules['knowledge-base']
+    turns = benchmark.build_conversation(random.Random(9), False)
+    prompt = ' '.join(text for _, text in turns)
+
+    first = knowledge_base.generate_analysis(prompt)
+    assert knowledge_base.generate_analysis(prompt) == first
+
+    assert run.bedrock.calls == 1
+    assert run.collector.counters['CacheMiss:BedrockCall'] == 1
+    assert run.collector.counters['CacheHit:BedrockCall'] == 1
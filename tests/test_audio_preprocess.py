@@ -0,0 +1,62 @@
+import io
+import wave
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import audio_preprocess
+
+def tone(frequency, rate, seconds, amplitude=0.5):
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)[:, None]
+
+def resample(samples, rate, chunk=7777):
+    resampler = audio_preprocess.Resampler(rate, samples.shape[1])
+    parts = [resampler.process(samples[i:i + chunk]) for i in range(0, len(samples), chunk)]
+    return np.concatenate(parts + [resampler.flush()])
+
+def rms(samples):
+    # Bỏ phần đầu / cuối nơi bộ lọc gặp biên
+    return float(np.sqrt(np.mean(samples[100:-100] ** 2)))
+
+@pytest.mark.parametrize('rate', [48000, 44100, 16000])
+def test_tone_above_new_nyquist_is_attenuated(rate):
+    # 5 kHz lớn hơn Nyquist 4 kHz của 8 kHz: không được gập xuống thành 3 kHz
+    output = resample(tone(5000, rate, 1), rate)
+
+    assert len(output) == 8000
+    assert rms(output) < 0.5 / np.sqrt(2) * 0.01
+
+@pytest.mark.parametrize('rate', [48000, 44100, 16000])
+def test_speech_band_is_kept(rate):
+    output = resample(tone(1000, rate, 1), rate)
+
+    assert rms(output) == pytest.approx(0.5 / np.sqrt(2), rel=0.05)
+
+def test_chunked_output_matches_single_pass():
+    samples = np.random.default_rng(0).standard_normal((44100, 2)).astype(np.float32) * 0.1
+
+    assert np.allclose(resample(samples, 44100), resample(samples, 44100, chunk=len(samples)), atol=1e-6)
+
+def test_long_gap_is_spilled_and_kept_in_the_middle():
+    rate = audio_preprocess.TARGET_SAMPLE_RATE
+    # Âm lượng dao động như lời nói để không bị coi là nhạc chờ
+    speech = tone(300, rate, 1) * (1 + np.sin(np.linspace(0, 40, rate)))[:, None].astype(np.float32)
+    silence = np.zeros((rate, 1), dtype=np.float32)
+    trimmer = audio_preprocess.SpeechTrimmer(rate)
+
+    def process(blocks):
+        return b''.join(kept for block in blocks for kept in trimmer.process(block))
+
+    output = process([silence, speech] + [silence] * 5)
+    # Trong bộ nhớ chỉ có phần padding, phần còn lại của khoảng lặng nằm trong file tạm
+    assert len(trimmer.gap) == trimmer.padding_frames
+    assert trimmer.spilled_frames == 5 * int(1 / audio_preprocess.FRAME_SECONDS) - trimmer.padding_frames
+
+    output += process([speech, silence]) + trimmer.flush()
+
+    # Khoảng lặng 5 giây ở giữa được giữ đủ, sau lần nói cuối chỉ còn padding
+    padding = int(rate * audio_preprocess.PADDING_SECONDS)
+    assert len(output) == 2 * (padding + rate + 5 * rate + rate + padding)
+    assert trimmer.spill is None
@@ -0,0 +1,50 @@
+import threading
+
+import benchmark
+
+CUSTOMER_TABLE = 'customer-call-analysis'
+PHONE = '0901234567'
+
+def call(run, index):
+    contact = {'contactId': f"profile-{index:02d}", 'phone': PHONE}
+    return run.invoke('get-customer-profile', benchmark.connect_event(contact))
+
+def test_failed_save_is_not_added_to_cached_profile(pipeline, monkeypatch):
+    run = pipeline()
+    customers = run.dynamodb.Table(CUSTOMER_TABLE)
+    put_item = customers.put_item
+    def unavailable(**kwargs):
+        raise RuntimeError('DynamoDB unavailable')
+    monkeypatch.setattr(customers, 'put_item', unavailable)
+
+    assert call(run, 1)['previousCallCount'] == '0'
+    # Profile lấy từ cache: cuộc gọi chưa được lưu thì không được tính
+    assert call(run, 2)['previousCallCount'] == '0'
+    assert run.collector.counters['ContactWriteFailed'] == 2
+
+    monkeypatch.setattr(customers, 'put_item', put_item)
+    assert call(run, 3)['previousCallCount'] == '0'
+    assert call(run, 4)['previousCallCount'] == '1'
+    assert sorted(key[0] for key in customers.items) == ['profile-03', 'profile-04']
+
+def test_lingering_save_does_not_block_the_next_call(pipeline, monkeypatch):
+    run = pipeline()
+    profile_module = run.modules['get-customer-profile']
+    monkeypatch.setattr(profile_module, 'SAVE_BUDGET_SECONDS', 0.2)
+    customers = run.dynamodb.Table(CUSTOMER_TABLE)
+    put_item = customers.put_item
+    release = threading.Event()
+    def slow_first_write(Item, **kwargs):
+        if Item['ContactId'] == 'profile-01':
+            release.wait(5)
+        return put_item(Item=Item, **kwargs)
+    monkeypatch.setattr(customers, 'put_item', slow_first_write)
+
+    try:
+        call(run, 1)
+        # Lần lưu của invoke trước vẫn đang chạy khi container nhận invoke mới
+        call(run, 2)
+        assert run.collector.counters['ContactWriteFailed'] == 1
+        assert [key[0] for key in customers.items] == ['profile-02']
+    finally:
+        release.set()
@@ -0,0 +1,99 @@
+import json
+import random
+
+import pytest
+
+import benchmark
+
+OUTPUT = 's3://batch-output/jobs'
+
+class LocalLambda:
+    """Invoke bất đồng bộ được giữ lại để test tự giao lần lượt"""
+    def __init__(self):
+        self.events = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.events.append(json.loads(Payload))
+        return {'StatusCode': 202}
+
+@pytest.fixture
+def batch(pipeline, monkeypatch):
+    run = pipeline()
+    knowledge_base = run.modules['knowledge-base']
+    knowledge_base.lambda_client = LocalLambda()
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'knowledge-base')
+    monkeypatch.setattr(knowledge_base, 'BATCH_PART_SIZE', 2)
+    monkeypatch.setattr(knowledge_base, 'BATCH_CHUNK_SIZE', 4)
+
+    analysed = []
+    analyze_batch_item = knowledge_base.analyze_batch_item
+    def counting_analyze(item):
+        analysed.append(item['contactId'])
+        return analyze_batch_item(item)
+    monkeypatch.setattr(knowledge_base, 'analyze_batch_item', counting_analyze)
+    run.knowledge_base, run.analysed = knowledge_base, analysed
+    return run
+
+def start_job(run, count):
+    items = []
+    for i in range(count):
+        turns = benchmark.build_conversation(random.Random(i), False)
+        items.append({'contactId': f"batch-{i:03d}", 'transcript': ' '.join(text for _, text in turns)})
+    response = run.knowledge_base.lambda_handler({'body': json.dumps({'items': items, 'output': OUTPUT})}, None)
+    assert response['statusCode'] == 202
+    return json.loads(response['body'])
+
+def deliver(run):
+    """Giao các invoke bất đồng bộ cho tới khi batch xong, trả về kết quả của invoke cuối"""
+    result = None
+    while run.knowledge_base.lambda_client.events:
+        result = run.knowledge_base.lambda_handler(run.knowledge_base.lambda_client.events.pop(0), None)
+    return result
+
+def read_summary(run, job):
+    return json.loads(run.s3.objects[('batch-output', f"jobs/{job['jobId']}/summary.json")])
+
+def test_batch_runs_in_chunks(batch):
+    job = start_job(batch, 10)
+
+    deliver(batch)
+
+    summary = read_summary(batch, job)
+    assert summary['total'] == 10
+    assert summary['chunks'] == 3
+    assert len(summary['parts']) == 5
+    assert sorted(batch.analysed) == [f"batch-{i:03d}" for i in range(10)]
+    results = [json.loads(line) for part in summary['parts']
+               for line in batch.s3.objects[('batch-output', part[len('s3://batch-output/'):])].splitlines()]
+    assert [result['contactId'] for result in results] == [f"batch-{i:03d}" for i in range(10)]
+
+def test_retried_chunk_skips_written_parts(batch):
+    job = start_job(batch, 10)
+    first_chunk = batch.knowledge_base.lambda_client.events.pop(0)
+
+    # Invoke bị cắt (timeout) sau khi ghi part đầu của chunk
+    put_object = batch.s3.put_object
+    def failing_put(Bucket, Key, Body, **kwargs):
+        if Key.endswith('part-0000002.jsonl'):
+            raise TimeoutError('Task timed out')
+        return put_object(Bucket=Bucket, Key=Key, Body=Body, **kwargs)
+    batch.s3.put_object = failing_put
+    with pytest.raises(TimeoutError):
+        batch.knowledge_base.lambda_handler(first_chunk, None)
+    assert batch.knowledge_base.lambda_client.events == []
+    batch.s3.put_object = put_object
+
+    # Lambda retry cùng event: chỉ phân tích lại part chưa ghi
+    batch.analysed.clear()
+    batch.knowledge_base.lambda_handler(first_chunk, None)
+    assert batch.analysed == ['batch-002', 'batch-003']
+
+    # Giao trùng sau khi chunk đã xong thì không chạy lại, không invoke chunk kế tiếp lần nữa
+    batch.analysed.clear()
+    assert batch.knowledge_base.lambda_handler(first_chunk, None) is None
+    assert batch.analysed == []
+    assert len(batch.knowledge_base.lambda_client.events) == 1
+
+    deliver(batch)
+    assert read_summary(batch, job)['total'] == 10
+    assert sorted(batch.analysed) == [f"batch-{i:03d}" for i in range(4, 10)]
@@ -0,0 +1,31 @@
+from live_monitor import LiveMonitor
+
+def run_call(lines):
+    """lines: (role, text) theo thứ tự, mỗi đoạn cách nhau 5 giây; trả về các cảnh báo"""
+    monitor = LiveMonitor(on_alert=lambda alert: None)
+    alerts = []
+    for i, (role, text) in enumerate(lines):
+        event = {'contactId': 'live-1', 'text': text, 'start': i * 5.0, 'end': i * 5.0 + 4, 'role': role}
+        alerts.extend(monitor.process(event))
+    return alerts, monitor.end_call('live-1')
+
+def test_agent_warning_raises_no_alert():
+    alerts, summary = run_call([
+        ('AGENT', "Xin chào anh, em là nhân viên tổng đài."),
+        ('CUSTOMER', "Chào em, anh vừa nhận được tin nhắn có mã OTP."),
+        ('AGENT', "Anh lưu ý kẻ gian thường gọi điện đề nghị đọc mã OTP."),
+        ('AGENT', "Ngân hàng tuyệt đối không yêu cầu anh cung cấp mật khẩu."),
+        ('AGENT', "Mã OTP chỉ dùng để xác nhận giao dịch, anh giữ bí mật giúp em.")
+    ])
+
+    assert alerts == []
+    assert summary['score'] == 10
+
+def test_agent_request_raises_alert():
+    alerts, summary = run_call([
+        ('AGENT', "Xin chào anh, em là nhân viên tổng đài."),
+        ('AGENT', "Anh đọc giúp em mã OTP vừa nhận được nhé.")
+    ])
+
+    assert [alert['violation'] for alert in alerts] == ['sensitive_request']
+    assert summary['score'] == 5
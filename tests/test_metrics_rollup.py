@@ -0,0 +1,80 @@
+import pytest
+from decimal import Decimal
+
+import benchmark
+
+RESULTS_TABLE = 'analysis-results-it-got-talent'
+METRICS_TABLE = 'analysis-metrics'
+
+@pytest.fixture
+def rollup(pipeline):
+    run = pipeline()
+    results = run.dynamodb.Table(RESULTS_TABLE)
+    for i in range(12):
+        results.put_item(Item={
+            'ContactId': f"rollup-{i:02d}",
+            'CallDate': f"2026-10-{1 + i % 2:02d}T09:{i:02d}:00",
+            'QueueName': 'Sales Queue',
+            'Analysis': {'compliance_score': Decimal(i % 10 + 1), 'customer_emotion': 'Trung tính'}
+        })
+    # Chấm lại một cuộc gọi: MODIFY trừ điểm cũ, cộng điểm mới
+    results.update_item(
+        Key={'ContactId': 'rollup-00'},
+        UpdateExpression='SET Analysis = :a',
+        ExpressionAttributeValues={':a': {'compliance_score': Decimal(9), 'customer_emotion': 'Hài lòng'}}
+    )
+    run.records = next(benchmark.stream_batches(results, 100))['Records']
+    run.handler = run.modules['metrics-rollup'].lambda_handler
+    return run
+
+def rollups(run):
+    return {key[0]: item for key, item in run.dynamodb.Table(METRICS_TABLE).items.items()
+            if not key[0].startswith('APPLIED#')}
+
+def deliver(run, records):
+    return run.handler({'Records': records}, None)['batchItemFailures']
+
+def test_rollup_counts_each_call_once(rollup):
+    assert deliver(rollup, rollup.records) == []
+
+    metrics = rollups(rollup)
+    assert metrics['DAY#2026-10-01']['CallCount'] == 6
+    assert metrics['DAY#2026-10-02']['CallCount'] == 6
+    assert metrics['QUEUE#Sales Queue#2026-10-01']['ScoreSum'] == sum(i % 10 + 1 for i in range(2, 12, 2)) + 9
+    assert metrics['DAY#2026-10-01']['Emotion#hài lòng'] == 1
+
+def test_bisected_and_resized_retries_are_not_counted_twice(rollup):
+    assert deliver(rollup, rollup.records) == []
+    expected = {key: dict(item) for key, item in rollups(rollup).items()}
+
+    # BisectBatchOnFunctionError giao lại từng nửa, rồi batch khác kích thước chồng lên nhau
+    half = len(rollup.records) // 2
+    assert deliver(rollup, rollup.records[:half]) == []
+    assert deliver(rollup, rollup.records[half:]) == []
+    assert deliver(rollup, rollup.records[3:9]) == []
+
+    assert rollups(rollup) == expected
+
+def test_partially_applied_batch_is_completed_on_retry(rollup, monkeypatch):
+    metrics_rollup = rollup.modules['metrics-rollup']
+    assert deliver(rollup, rollup.records) == []
+    expected = {key: dict(item) for key, item in rollups(rollup).items()}
+    rollup.dynamodb.Table(METRICS_TABLE).items.clear()
+
+    # Transaction thứ hai lỗi: chỉ các record của transaction đầu đã được cộng
+    monkeypatch.setattr(metrics_rollup, 'MAX_TRANSACTION_ITEMS', 10)
+    transact_write_items = rollup.dynamodb.transact_write_items
+    calls = []
+    def failing_transaction(TransactItems, **kwargs):
+        calls.append(len(TransactItems))
+        if len(calls) == 2:
+            raise RuntimeError('Throttled')
+        return transact_write_items(TransactItems=TransactItems, **kwargs)
+    monkeypatch.setattr(rollup.dynamodb, 'transact_write_items', failing_transaction)
+    assert deliver(rollup, rollup.records) == [{'itemIdentifier': rollup.records[0]['dynamodb']['SequenceNumber']}]
+
+    # Lambda giao lại nửa sau của batch trước, rồi cả batch
+    assert deliver(rollup, rollup.records[len(rollup.records) // 2:]) == []
+    assert deliver(rollup, rollup.records) == []
+
+    assert rollups(rollup) == expected
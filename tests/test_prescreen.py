@@ -0,0 +1,55 @@
+import pytest
+
+import prescreen
+
+OPENING = "Xin chào anh, em là nhân viên tổng đài."
+CLOSING = "Anh cần hỗ trợ gì thêm không ạ? Cảm ơn anh, chúc anh một ngày tốt lành."
+
+@pytest.fixture(autouse=True)
+def skip_sensitive_request(monkeypatch):
+    monkeypatch.setattr(prescreen, 'SKIP_MODEL_CASES', {'sensitive_request'})
+
+def screen(agent_line, customer_line="Dạ vâng."):
+    agent_text = ' '.join([OPENING, agent_line, CLOSING])
+    return prescreen.prescreen(' '.join([OPENING, customer_line, agent_line, CLOSING]), agent_text)
+
+@pytest.mark.parametrize('agent_line', [
+    "Anh đọc giúp em mã OTP vừa nhận được nhé.",
+    "Chị vui lòng cung cấp mật khẩu đăng nhập để em kiểm tra.",
+    "Anh cho em xin mã PIN của thẻ ạ.",
+    "Chị cho em biết số CVV ở mặt sau thẻ."
+])
+def test_request_phrasing_skips_model(agent_line):
+    result = screen(agent_line)
+
+    assert result['findings']['sensitive_request']
+    assert prescreen.get_skip_case(result) == 'sensitive_request'
+
+@pytest.mark.parametrize('agent_line', [
+    # Dặn dò
+    "Mã OTP chỉ dùng để xác nhận giao dịch, anh giữ bí mật giúp em.",
+    "Anh nên đổi mật khẩu định kỳ để bảo vệ tài khoản.",
+    # Cảnh báo
+    "Anh lưu ý kẻ gian thường gọi điện đề nghị đọc mã OTP.",
+    "Nếu có ai yêu cầu anh cung cấp mã OTP thì anh báo ngay cho ngân hàng.",
+    "Ngân hàng tuyệt đối không yêu cầu anh cung cấp mật khẩu."
+])
+def test_advice_and_warnings_are_hints_only(agent_line):
+    result = screen(agent_line)
+
+    assert not result['findings']['sensitive_request']
+    assert prescreen.get_skip_case(result) is None
+    assert 'mentioned without a request' in prescreen.format_findings(result)
+
+def test_customer_mention_does_not_trigger():
+    result = screen("Dạ em kiểm tra giúp anh ngay.", "Em đọc mã OTP cho chị luôn nhé, mã là 123456.")
+
+    assert result['hits']['sensitive_request'] == []
+    assert prescreen.get_skip_case(result) is None
+
+def test_unknown_speaker_is_not_skipped():
+    text = ' '.join([OPENING, "Em đọc mã OTP cho chị luôn nhé.", CLOSING])
+    result = prescreen.prescreen(text)
+
+    assert result['findings']['sensitive_request']
+    assert prescreen.get_skip_case(result) is None
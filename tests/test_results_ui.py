@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+
+import benchmark
+
+RESULTS_TABLE = 'analysis-results-it-got-talent'
+FIRST_DAY = date(2026, 1, 1)
+
+@pytest.fixture
+def results_ui():
+    module = benchmark.load_module('get_results_ui', 'singopo/lambda/get-results-UI.py')
+    module.dynamodb = benchmark.LocalDynamoDB()
+    table = module.dynamodb.Table(RESULTS_TABLE)
+    # 30 ngày, ngày thứ ba nào cũng không có cuộc gọi, các ngày khác 0-4 cuộc gọi
+    for offset in range(30):
+        day = FIRST_DAY + timedelta(days=offset)
+        for i in range(0 if offset % 3 == 2 else offset % 5):
+            table.put_item(Item={
+                'ContactId': f"ui-{offset:02d}-{i}",
+                'CallDate': f"{day.isoformat()}T{9 + i:02d}:00:00",
+                'CallDay': day.isoformat(),
+                'PhoneNumber': module.format_phone_number('0901234567' if offset < 5 else '0907654321')
+            })
+    module.results_table = table
+    return module
+
+def get(module, **params):
+    response = module.lambda_handler({'queryStringParameters': params}, None)
+    assert response['statusCode'] == 200, response['body']
+    return json.loads(response['body'])
+
+def read_all(module, **params):
+    contact_ids = []
+    cursor = None
+    while True:
+        body = get(module, **params, **({'cursor': cursor} if cursor else {}))
+        assert body['count'] <= int(params['limit'])
+        contact_ids.extend(item['ContactId'] for item in body['data'])
+        cursor = body['nextCursor']
+        if not cursor:
+            return contact_ids
+
+@pytest.mark.parametrize('order', ['desc', 'asc'])
+def test_day_listing_pages_in_order(results_ui, order):
+    items = sorted(results_ui.results_table.items.values(), key=lambda item: item['CallDate'], reverse=order == 'desc')
+
+    contact_ids = read_all(results_ui, **{'from': '2026-01-01', 'to': '2026-01-30', 'limit': '7', 'order': order})
+
+    assert contact_ids == [item['ContactId'] for item in items]
+
+def test_day_queries_run_concurrently(results_ui, monkeypatch):
+    table = results_ui.results_table
+    query = table.query
+    in_flight = []
+    peak = [0]
+    lock = threading.Lock()
+    def slow_query(**kwargs):
+        with lock:
+            in_flight.append(1)
+            peak[0] = max(peak[0], len(in_flight))
+        time.sleep(0.01)
+        try:
+            return query(**kwargs)
+        finally:
+            with lock:
+                in_flight.pop()
+    monkeypatch.setattr(table, 'query', slow_query)
+
+    body = get(results_ui, **{'from': '2026-01-01', 'to': '2026-01-30', 'limit': '200'})
+
+    assert body['count'] == len(table.items)
+    assert 1 < peak[0] <= results_ui.DAY_QUERY_WORKERS
+
+def test_phone_filter_has_no_default_range(results_ui):
+    # Không truyền from/to: mọi cuộc gọi của số đó, kể cả cách đây hơn DEFAULT_RANGE_DAYS ngày
+    body = get(results_ui, phone='0901 234 567', limit='50')
+    assert sorted(item['ContactId'] for item in body['data']) == sorted(
+        contact_id for contact_id, in results_ui.results_table.items if contact_id < 'ui-05')
+
+    body = get(results_ui, phone='0901 234 567', limit='50', **{'from': '2026-01-04'})
+    assert sorted(item['ContactId'] for item in body['data']) == [
+        'ui-03-0', 'ui-03-1', 'ui-03-2', 'ui-04-0', 'ui-04-1', 'ui-04-2', 'ui-04-3']
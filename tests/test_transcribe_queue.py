@@ -0,0 +1,46 @@
+import benchmark
+import transcribe_queue
+
+BUCKET = 'call-recordings-test'
+
+def queue_recordings(run, contacts):
+    """File ghi âm của mọi cuộc gọi tới cùng lúc, rồi giao kết quả Transcribe tới khi hết hàng đợi"""
+    for contact in contacts:
+        run.invoke('audio-text', benchmark.s3_event(BUCKET, f"recordings/{contact['contactId']}_recording.wav"))
+    benchmark.drain_transcriptions(run.collector, run.failures, run.modules, run.transcribe)
+
+def test_scheduler_stays_under_its_limit(pipeline):
+    contacts = benchmark.build_contacts(30, 0, seed=2)
+    run = pipeline(contacts, transcribe_limit=10, max_concurrent_jobs=4)
+
+    queue_recordings(run, contacts)
+
+    assert run.transcribe.max_in_flight <= 4
+    assert run.transcribe.rejected == 0
+    assert sum(transcribe_queue.get_queue_depth().values()) == 0
+    assert sorted(run.transcribe.started) == sorted(contact['contactId'] for contact in contacts)
+    assert not any(run.failures.values())
+
+def test_jobs_rejected_by_service_are_requeued(pipeline):
+    # Ceiling của scheduler cao hơn quota thật: job bị LimitExceededException phải quay lại hàng đợi
+    contacts = benchmark.build_contacts(30, 0, seed=3)
+    run = pipeline(contacts, transcribe_limit=4, max_concurrent_jobs=8)
+
+    queue_recordings(run, contacts)
+
+    assert run.transcribe.max_in_flight <= 4
+    assert run.transcribe.rejected > 0
+    assert sum(transcribe_queue.get_queue_depth().values()) == 0
+    assert sorted(run.transcribe.started) == sorted(contact['contactId'] for contact in contacts)
+
+def test_queue_priority_from_connect(pipeline):
+    contacts = benchmark.build_contacts(30, 0, seed=4)
+    run = pipeline(contacts, transcribe_limit=10, max_concurrent_jobs=1)
+
+    queue_recordings(run, contacts)
+
+    # Một slot: job đầu được admit ngay, sau đó luôn lấy job có độ ưu tiên cao nhất còn trong hàng đợi
+    priorities = [transcribe_queue.get_priority(run.connect.queue_by_contact[contact_id])
+                  for contact_id in run.transcribe.started[1:]]
+    assert priorities == sorted(priorities)
+    assert run.connect.calls['DescribeQueue'] == len(set(contact['queue'] for contact in contacts))
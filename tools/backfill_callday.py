@@ -0,0 +1,89 @@
+"""
+Điền CallDay (YYYY-MM-DD, partition key của GSI CallDay-CallDate-index) cho các kết quả phân tích
+được lưu trước khi save_analysis_result ghi thuộc tính này. Item thiếu CallDay không nằm trong GSI
+nên không hiện trong danh sách theo ngày của get-results-UI.
+
+Chạy lại an toàn: chỉ cập nhật item chưa có CallDay (update có điều kiện), có thể dừng giữa chừng.
+
+Ví dụ:
+    python tools/backfill_callday.py --dry-run
+    python tools/backfill_callday.py --segments 4
+"""
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'shared'))
+
+import runtime
+
+TABLE_NAME = 'analysis-results-it-got-talent'
+
+def scan_missing(table, segment, total_segments):
+    """(ContactId, CallDate) của các item có CallDate nhưng chưa có CallDay trong một segment của Scan"""
+    scan_kwargs = {
+        'ProjectionExpression': 'ContactId, CallDate',
+        'FilterExpression': 'attribute_not_exists(CallDay) AND attribute_exists(CallDate)',
+        'Segment': segment,
+        'TotalSegments': total_segments
+    }
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            yield item['ContactId'], item['CallDate']
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def set_call_day(table, contact_id, call_date):
+    """False nếu item đã có CallDay (được ghi lại trong lúc backfill) hoặc đã bị xóa"""
+    try:
+        table.update_item(
+            Key={'ContactId': contact_id},
+            UpdateExpression='SET CallDay = :day',
+            ConditionExpression='attribute_exists(ContactId) AND attribute_not_exists(CallDay)',
+            ExpressionAttributeValues={':day': call_date[:10]}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+def backfill_segment(table, segment, total_segments, dry_run):
+    """Trả về (số item thiếu CallDay, số item đã cập nhật, số item có CallDate không hợp lệ)"""
+    found = updated = invalid = 0
+    for contact_id, call_date in scan_missing(table, segment, total_segments):
+        found += 1
+        if len(call_date) < 10:
+            invalid += 1
+            print(f"{contact_id}: invalid CallDate {call_date!r}", file=sys.stderr)
+            continue
+        if not dry_run and set_call_day(table, contact_id, call_date):
+            updated += 1
+    return found, updated, invalid
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill CallDay on stored analysis results')
+    parser.add_argument('--table', default=TABLE_NAME)
+    parser.add_argument('--region', help='AWS region of the table')
+    parser.add_argument('--segments', type=int, default=1, help='parallel Scan segments')
+    parser.add_argument('--dry-run', action='store_true', help='only count items without CallDay')
+    args = parser.parse_args()
+
+    table = runtime.table(args.table, region_name=args.region)
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        results = list(executor.map(
+            lambda segment: backfill_segment(table, segment, args.segments, args.dry_run),
+            range(args.segments)
+        ))
+
+    found, updated, invalid = (sum(counts) for counts in zip(*results))
+    print(f"{found} items without CallDay, {updated} updated, {invalid} with invalid CallDate"
+          + (' (dry run)' if args.dry_run else ''))
+
+if __name__ == '__main__':
+    main()
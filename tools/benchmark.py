@@ -0,0 +1,1306 @@
+"""
+Benchmark toàn bộ pipeline trên local, không cần tài khoản AWS:
+get-customer-profile (-> contact-writer) -> audio-text -> transcribe-complete -> analysis-results
+(+ knowledge-base) -> metrics-rollup. S3, DynamoDB, SQS, Transcribe được thay bằng bản giả lập trong bộ nhớ,
+Bedrock được giả lập với độ trễ và tỷ lệ JSON lỗi cấu hình được. Event của contact flow không có queue
+(audio-text tra queue qua Amazon Connect giả lập), event DynamoDB Stream được tạo từ chính các lần ghi
+của các handler như stream NEW_AND_OLD_IMAGES.
+
+Báo cáo throughput, p50/p95/p99 của từng handler và từng stage (stage_timer), bộ nhớ,
+thời gian lookup profile khi cache trống / đã có (--dynamodb-latency-ms để giả lập độ trễ),
+windowing / chia chunk transcript theo từng độ dài (có và không có dấu câu).
+--contact-writer direct chạy get-customer-profile ghi thẳng DynamoDB như trước khi có hàng đợi,
+để so sánh độ trễ trong contact flow với mặc định queue.
+Có --baseline thì so sánh với báo cáo cũ và trả exit code 1 nếu chậm hơn ngưỡng cho phép.
+
+Ví dụ:
+    python tools/benchmark.py --contacts 200 --output bench.json
+    python tools/benchmark.py --contacts 200 --baseline bench.json --max-regression 0.2
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import socket
+import resource
+import threading
+import tracemalloc
+import importlib.util
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'shared'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'us', 'knowledge-base'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'singopo', 'lambda'))
+# boto3 cần region khi các Lambda tạo client lúc import
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+os.environ.setdefault('PAYLOAD_SAMPLE_RATE', '0')
+
+import instrumentation
+import text_storage
+import tolerant_json
+import transcribe_queue
+import transcript_window
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+AGENT_LINES = [
+    'Xin chào anh chị, em là Lan nhân viên tư vấn của công ty',
+    'Em có thể hỗ trợ gì cho anh chị hôm nay ạ',
+    'Dạ em xin phép kiểm tra thông tin đơn hàng của anh chị',
+    'Gói dịch vụ này có ưu đãi giảm giá trong tháng này ạ',
+    'Anh chị vui lòng chờ em một chút ạ',
+    'Cảm ơn anh chị đã liên hệ, chúc anh chị một ngày tốt lành'
+]
+CUSTOMER_LINES = [
+    'Chào em, chị muốn hỏi về đơn hàng tuần trước',
+    'Sao giao hàng chậm vậy em',
+    'Giá gói này bao nhiêu vậy em',
+    'Ừ được rồi cảm ơn em',
+    'Chị chưa nhận được tin nhắn xác nhận'
+]
+QUEUES = ['Sales Queue', 'Switchboard Queue', 'Support Queue']
+# Độ dài transcript (token ước lượng) để đo windowing / chia chunk
+WINDOW_BUCKETS = [500, 2000, 6000, 20000]
+WINDOW_REPEATS = 5
+# Output hỏng của model (JSON Lines: name, note, text, expected), so sánh tolerant_json với cách sửa cũ
+MALFORMED_CORPUS = os.path.join(ROOT_DIR, 'tools', 'malformed_outputs.jsonl')
+JSON_REPAIR_REPEATS = 200
+# Khoảng cách giữa các điểm cắt khi cắt một output hợp lệ ở mọi vị trí
+JSON_CUT_STEP = 3
+# Retry HTTP của analysis-results trước khi giới hạn: POST được gửi lại cả khi 5xx và timeout khi đọc
+LEGACY_HTTP_RETRY = {
+    'total': 3,
+    'backoff_factor': 0.5,
+    'status_forcelist': [429, 500, 502, 503, 504],
+    'allowed_methods': ['POST']
+}
+# Backoff thu nhỏ để đo nhanh; số POST tới API không phụ thuộc backoff
+HTTP_BACKOFF_FACTOR = 0.01
+HTTP_TIMEOUT = (0.5, 0.2)
+# Kịch bản -> (các status lần lượt trả về, lặp lại status cuối; 'slow' là trả lời sau read timeout)
+HTTP_SCENARIOS = {
+    'ok': [200],
+    'throttled': [429, 429, 200],
+    'server-error': [502],
+    'server-error-once': [502, 200],
+    'read-timeout': ['slow']
+}
+# Số lần gọi trong warm loop: POST tới API giả lập + lấy resource DynamoDB như một invocation warm
+HTTP_WARM_CALLS = 200
+
+def load_module(name, relative_path):
+    """Import file Lambda có dấu '-' trong tên"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT_DIR, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def percentile(values, p):
+    """Percentile theo nearest-rank"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 3)
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': round(max(values), 3) if values else None
+    }
+
+class MetricCollector:
+    """Thay emit_metric, gom Latency theo Stage thay vì in EMF"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.counters = {}
+
+    def emit_metric(self, name, value, unit='Count', stage=None):
+        with self.lock:
+            if name == 'Latency':
+                self.latencies.setdefault(stage, []).append(value)
+            else:
+                key = f"{name}:{stage}" if stage else name
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def time_handler(self, name, started_at):
+        self.emit_metric('Latency', (time.perf_counter() - started_at) * 1000, stage=f"Handler:{name}")
+
+# ---------------------------------------------------------------------------
+# Bản giả lập trong bộ nhớ của các dịch vụ AWS, chỉ đủ cho các lời gọi của pipeline
+# ---------------------------------------------------------------------------
+
+COMPARISONS = {
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b, '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b, '<>': lambda a, b: a != b, '=': lambda a, b: a == b
+}
+
+def resolve_name(name, names):
+    return (names or {}).get(name, name)
+
+def check_term(existing, term, names, values):
+    match = re.fullmatch(r'attribute_(not_)?exists\((\S+)\)', term)
+    if match:
+        return (resolve_name(match.group(2), names) in existing) != bool(match.group(1))
+    match = re.fullmatch(r'(\S+)\s*(<=|>=|<>|<|>|=)\s*(:\w+)', term)
+    if match:
+        attribute = resolve_name(match.group(1), names)
+        return attribute in existing and COMPARISONS[match.group(2)](existing[attribute], values[match.group(3)])
+    return False
+
+def check_condition(existing, expression, names, values):
+    """
+    Hỗ trợ các điều kiện dạng 'attribute_not_exists(A) OR (B = :b AND A <= :v)' (attribute_exists, <, <=, >, >=,
+    <>, =; OR của các nhóm AND, không lồng ngoặc); vế không nhận ra coi là không thỏa
+    """
+    if not expression:
+        return True
+    existing = existing or {}
+    for clause in expression.split(' OR '):
+        clause = clause.strip()
+        if clause.startswith('(') and clause.endswith(')'):
+            clause = clause[1:-1]
+        if all(check_term(existing, term.strip(), names, values) for term in clause.split(' AND ')):
+            return True
+    return False
+
+def conditional_check_failed(existing, operation, return_old):
+    response = {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}
+    if return_old and existing:
+        serializer = TypeSerializer()
+        response['Item'] = {key: serializer.serialize(value) for key, value in existing.items()}
+    return ClientError(response, operation)
+
+def split_key_condition(condition):
+    """(giá trị partition key, hàm kiểm tra sort key) của Key(partition).eq(v) [& Key(sort).<điều kiện>]"""
+    expression = condition.get_expression()
+    if expression['operator'] != 'AND':
+        return expression['values'][1], lambda value: True
+    partition, sort = expression['values']
+    sort_expression = sort.get_expression()
+    operator, operands = sort_expression['operator'], sort_expression['values'][1:]
+    if operator == 'BETWEEN':
+        matches = lambda value: operands[0] <= value <= operands[1]
+    elif operator == 'begins_with':
+        matches = lambda value: value.startswith(operands[0])
+    else:
+        matches = lambda value: COMPARISONS[operator](value, operands[0])
+    return partition.get_expression()['values'][1], lambda value: value is not None and matches(value)
+
+class LocalTable:
+    # GSI: tên index -> (partition key, sort key)
+    INDEXES = {
+        'PhoneNumber-CallDate-index': ('PhoneNumber', 'CallDate'),
+        'CallDay-CallDate-index': ('CallDay', 'CallDate')
+    }
+
+    def __init__(self, name, key_names, latency_ms=0):
+        self.name = name
+        # (partition key,) hoặc (partition key, sort key)
+        self.key_names = key_names
+        self.latency = latency_ms / 1000
+        self.items = {}
+        # Thay đổi chưa giao cho consumer của stream, xem record_change / stream_batches
+        self.stream = []
+        self.sequence_number = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Độ trễ mạng giả lập của mỗi request"""
+        if self.latency:
+            time.sleep(self.latency)
+
+    def key_of(self, item):
+        return tuple(item[name] for name in self.key_names)
+
+    def record_change(self, old, new):
+        """
+        Stream NEW_AND_OLD_IMAGES: một record cho mỗi lần ghi làm item thay đổi (ghi không đổi gì thì không có
+        record, như DynamoDB Streams). Gọi khi đang giữ lock
+        """
+        if old == new:
+            return
+        self.sequence_number += 1
+        self.stream.append({
+            'eventName': 'INSERT' if old is None else 'REMOVE' if new is None else 'MODIFY',
+            'sequenceNumber': self.sequence_number,
+            'time': time.time(),
+            'old': old,
+            'new': None if new is None else dict(new)
+        })
+
+    def query(self, KeyConditionExpression, IndexName=None, ScanIndexForward=True, Limit=None, Select=None,
+              ExclusiveStartKey=None, **kwargs):
+        """
+        Key(partition).eq(value), có thể AND với điều kiện trên sort key, trên bảng hoặc GSI trong INDEXES.
+        Limit cắt trang và trả LastEvaluatedKey khi còn item
+        """
+        self.wait()
+        partition_key, sort_key = self.INDEXES[IndexName] if IndexName else self.key_names
+        value, sort_matches = split_key_condition(KeyConditionExpression)
+        with self.lock:
+            items = [dict(item) for item in self.items.values()
+                     if item.get(partition_key) == value and sort_matches(item.get(sort_key))]
+        if Select == 'COUNT':
+            return {'Count': len(items)}
+
+        def position(item):
+            return item.get(sort_key, ''), self.key_of(item)
+        items.sort(key=position, reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            start = position(ExclusiveStartKey)
+            items = [item for item in items if (position(item) > start if ScanIndexForward else position(item) < start)]
+        response = {'Items': items, 'Count': len(items)}
+        if Limit and len(items) > Limit:
+            response['Items'] = items = items[:Limit]
+            response['Count'] = Limit
+            last_key = {name: items[-1][name] for name in self.key_names + (partition_key, sort_key) if name}
+            response['LastEvaluatedKey'] = last_key
+        return response
+
+    def scan(self, FilterExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, Select=None,
+             **kwargs):
+        self.wait()
+        with self.lock:
+            items = [dict(item) for item in self.items.values()
+                     if check_condition(item, FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)]
+        if Select == 'COUNT':
+            return {'Count': len(items)}
+        return {'Items': items, 'Count': len(items)}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValuesOnConditionCheckFailure=None):
+        self.wait()
+        key = self.key_of(Item)
+        with self.lock:
+            existing = self.items.get(key)
+            if not check_condition(existing, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise conditional_check_failed(existing, 'PutItem', ReturnValuesOnConditionCheckFailure == 'ALL_OLD')
+            self.items[key] = dict(Item)
+            self.record_change(existing, Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        self.wait()
+        with self.lock:
+            item = self.items.get(self.key_of(Key))
+        return {'Item': dict(item)} if item else {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        self.wait()
+        with self.lock:
+            existing = self.items.get(self.key_of(Key))
+            if not check_condition(existing, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise conditional_check_failed(existing, 'DeleteItem', False)
+            self.items.pop(self.key_of(Key), None)
+            if existing is not None:
+                self.record_change(existing, None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ConditionExpression=None, **kwargs):
+        """Hỗ trợ SET a = :v, SET a = if_not_exists(a, :v), ... và ADD a :v, ... (số)"""
+        self.wait()
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self.lock:
+            existing = self.items.get(self.key_of(Key))
+            if not check_condition(existing, ConditionExpression, names, values):
+                raise conditional_check_failed(existing, 'UpdateItem', False)
+            old = None if existing is None else dict(existing)
+            item = self.items.setdefault(self.key_of(Key), dict(Key))
+            for action, body in re.findall(r'(SET|ADD)\s+(.*?)(?=\s+(?:SET|ADD)\s|$)', UpdateExpression, re.I):
+                # Dấu phẩy trong if_not_exists(...) không tách vế
+                for part in re.split(r',(?![^(]*\))', body):
+                    if action.upper() == 'SET':
+                        name, value = [token.strip() for token in part.split('=', 1)]
+                        match = re.fullmatch(r'if_not_exists\((\S+),\s*(:\w+)\)', value)
+                        if match:
+                            item.setdefault(resolve_name(match.group(1), names), values[match.group(2)])
+                        else:
+                            item[resolve_name(name, names)] = values[value]
+                    else:
+                        name, value = part.split()
+                        attribute = resolve_name(name, names)
+                        item[attribute] = item.get(attribute, 0) + values[value]
+            self.record_change(old, item)
+        return {}
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return LocalBatchWriter(self)
+
+class LocalBatchWriter:
+    """batch_writer: gom put / delete, một request (độ trễ) cho mỗi 25 item như BatchWriteItem"""
+    BATCH_SIZE = 25
+
+    def __init__(self, table):
+        self.table = table
+        self.pending = {}
+
+    def put_item(self, Item):
+        self.pending[self.table.key_of(Item)] = dict(Item)
+
+    def delete_item(self, Key):
+        self.pending[self.table.key_of(Key)] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pending = list(self.pending.items())
+        for i in range(0, len(pending), self.BATCH_SIZE):
+            self.table.wait()
+            with self.table.lock:
+                for key, item in pending[i:i + self.BATCH_SIZE]:
+                    if item is None:
+                        existing = self.table.items.pop(key, None)
+                    else:
+                        existing = self.table.items.get(key)
+                        self.table.items[key] = item
+                    if existing is not None or item is not None:
+                        self.table.record_change(existing, item)
+        return False
+
+class LocalDynamoDB:
+    """Thay boto3.resource('dynamodb'), kể cả meta.client.transact_write_items"""
+    KEYS = {
+        'customer-call-analysis': ('ContactId',),
+        'transcription-jobs': ('JobName',),
+        'transcription-queue': ('Priority', 'EntryKey'),
+        'analysis-results-it-got-talent': ('ContactId',),
+        'analysis-idempotency': ('IdempotencyKey',),
+        'analysis-metrics': ('MetricKey',),
+        'analysis-cache': ('CacheKey',)
+    }
+
+    def __init__(self, latency_ms=0):
+        self.tables = {name: LocalTable(name, key, latency_ms) for name, key in self.KEYS.items()}
+        self.request_tokens = set()
+        self.lock = threading.Lock()
+        self.meta = self
+        self.client = self
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        """Một request cho mọi key, trả toàn bộ item (bỏ qua ProjectionExpression)"""
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.tables[name]
+            table.wait()
+            with table.lock:
+                items = [table.items.get(table.key_of(key)) for key in request['Keys']]
+            responses[name] = [dict(item) for item in items if item]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def transact_write_items(self, TransactItems, ClientRequestToken=None):
+        """
+        Put / Update có ConditionExpression, tất cả hoặc không: điều kiện sai thì hủy cả transaction với
+        CancellationReasons theo thứ tự item. Token đã dùng thì bỏ qua như DynamoDB (trong cửa sổ 10 phút)
+        """
+        with self.lock:
+            if ClientRequestToken in self.request_tokens:
+                return {}
+            reasons = []
+            for action in TransactItems:
+                (kind, request), = action.items()
+                table = self.tables[request['TableName']]
+                key = request['Key'] if kind == 'Update' else request['Item']
+                with table.lock:
+                    existing = table.items.get(table.key_of(key))
+                passed = check_condition(existing, request.get('ConditionExpression'),
+                                         request.get('ExpressionAttributeNames'), request.get('ExpressionAttributeValues'))
+                reasons.append({'Code': 'None'} if passed else
+                               {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise ClientError({
+                    'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+                    'CancellationReasons': reasons
+                }, 'TransactWriteItems')
+            if ClientRequestToken:
+                self.request_tokens.add(ClientRequestToken)
+            for action in TransactItems:
+                (kind, request), = action.items()
+                table = self.tables[request['TableName']]
+                if kind == 'Put':
+                    table.put_item(Item=request['Item'])
+                else:
+                    table.update_item(
+                        Key=request['Key'],
+                        UpdateExpression=request['UpdateExpression'],
+                        ExpressionAttributeNames=request.get('ExpressionAttributeNames'),
+                        ExpressionAttributeValues=request.get('ExpressionAttributeValues')
+                    )
+        return {}
+
+class LocalSQS:
+    """Hàng đợi SQS standard: send_message có độ trễ giả lập, nhận theo batch như event source của Lambda"""
+    QUEUE_URL = 'https://sqs.local/000000000000/contact-records'
+
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.messages = []
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.sent += 1
+            message_id = f"msg-{self.sent:06d}"
+            self.messages.append({
+                'messageId': message_id,
+                'body': MessageBody,
+                'attributes': {'SentTimestamp': str(int(time.time() * 1000))},
+                'eventSource': 'aws:sqs'
+            })
+        return {'MessageId': message_id}
+
+    def receive_batch(self, size):
+        with self.lock:
+            batch, self.messages = self.messages[:size], self.messages[size:]
+        return batch
+
+class LocalBody(io.BytesIO):
+    """StreamingBody của get_object"""
+    def iter_lines(self):
+        return iter(self.read().splitlines())
+
+class LocalS3:
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        with self.lock:
+            self.objects[(Bucket, Key)] = Body
+        return {}
+
+    def get_object(self, Bucket, Key):
+        with self.lock:
+            body = self.objects[(Bucket, Key)]
+        return {'Body': LocalBody(body), 'ContentLength': len(body)}
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        """Một trang chứa mọi key, theo thứ tự như S3"""
+        with self.lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        return {'Contents': [{'Key': key} for key in keys], 'KeyCount': len(keys), 'IsTruncated': False}
+
+class LocalTranscribe:
+    """
+    Ghi ngay file kết quả có speaker label vào LocalS3 như Transcribe khi job hoàn tất.
+    Job được tính là đang chạy tới khi finish(); vượt limit thì trả LimitExceededException như quota thật
+    """
+    def __init__(self, s3, conversations, limit=None):
+        self.s3 = s3
+        self.conversations = conversations
+        self.limit = limit
+        self.completed = []
+        self.in_flight = set()
+        self.max_in_flight = 0
+        self.rejected = 0
+        # ContactId theo thứ tự job được nhận
+        self.started = []
+        self.lock = threading.Lock()
+
+    def start_transcription_job(self, TranscriptionJobName, Media, OutputBucketName, OutputKey, **kwargs):
+        contact_id = Media['MediaFileUri'].split('/')[-1].split('_')[0]
+        with self.lock:
+            if self.limit and len(self.in_flight) >= self.limit:
+                self.rejected += 1
+                raise ClientError({'Error': {'Code': 'LimitExceededException', 'Message': 'Concurrent job limit'}},
+                                  'StartTranscriptionJob')
+            self.in_flight.add(TranscriptionJobName)
+            self.max_in_flight = max(self.max_in_flight, len(self.in_flight))
+            self.started.append(contact_id)
+        channels = kwargs.get('Settings', {}).get('ChannelIdentification', False)
+        output = build_transcribe_output(TranscriptionJobName, self.conversations[contact_id], channels)
+        self.s3.put_object(Bucket=OutputBucketName, Key=OutputKey, Body=json.dumps(output, ensure_ascii=False))
+        with self.lock:
+            self.completed.append((OutputBucketName, OutputKey))
+        return {'TranscriptionJob': {'TranscriptionJobName': TranscriptionJobName, 'TranscriptionJobStatus': 'IN_PROGRESS'}}
+
+    def finish(self, output_key):
+        with self.lock:
+            self.in_flight.discard(output_key.split('/')[-1][:-len('.json')])
+
+class LocalConnect:
+    """
+    describe_contact / describe_queue của Amazon Connect: queue mà cuộc gọi được chuyển vào, audio-text tra
+    khi file ghi âm tới (event của contact flow không có queue)
+    """
+    INSTANCE_ID = 'benchmark-instance'
+
+    def __init__(self, queue_by_contact):
+        self.queue_by_contact = queue_by_contact
+        self.queue_ids = {name: f"queue-{i:04d}" for i, name in enumerate(sorted(set(queue_by_contact.values())))}
+        self.queue_names = {queue_id: name for name, queue_id in self.queue_ids.items()}
+        self.calls = {'DescribeContact': 0, 'DescribeQueue': 0}
+        self.lock = threading.Lock()
+
+    def describe_contact(self, InstanceId, ContactId):
+        with self.lock:
+            self.calls['DescribeContact'] += 1
+        queue_id = self.queue_ids[self.queue_by_contact[ContactId]]
+        return {'Contact': {'Id': ContactId, 'Channel': 'VOICE', 'QueueInfo': {'Id': queue_id}}}
+
+    def describe_queue(self, InstanceId, QueueId):
+        with self.lock:
+            self.calls['DescribeQueue'] += 1
+        return {'Queue': {'QueueId': QueueId, 'Name': self.queue_names[QueueId]}}
+
+class StubBedrock:
+    """retrieve_and_generate với độ trễ giả lập, một phần response bị cắt giữa JSON"""
+    def __init__(self, latency_ms, jitter_ms, malformed_rate, seed):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.malformed = 0
+
+    def retrieve_and_generate(self, input, retrieveAndGenerateConfiguration):
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+            malformed = self.random.random() < self.malformed_rate
+            score = self.random.randint(1, 10)
+            cut_ratio = self.random.uniform(0.3, 0.95)
+            if malformed:
+                self.malformed += 1
+        time.sleep(delay)
+
+        analysis = {
+            'compliance_score': score,
+            'violations': [] if score >= 7 else ['Không giới thiệu tên nhân viên'],
+            'recommendations': [] if score >= 7 else ['Giới thiệu tên ở đầu cuộc gọi'],
+            'detailed_analysis': 'Nhân viên chào hỏi và hỗ trợ khách hàng',
+            'customer_emotion': 'Trung tính',
+            'emotion_details': 'Khách hàng hỏi thông tin'
+        }
+        text = 'Tóm tắt cuộc gọi. ' + json.dumps(analysis, ensure_ascii=False)
+        if malformed:
+            text = text[:int(len(text) * cut_ratio)]
+        return {'output': {'text': text}}
+
+class LocalResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+class LocalSession:
+    """Thay requests.Session của analysis-results, gọi thẳng handler knowledge-base"""
+    def __init__(self, knowledge_base, collector):
+        self.knowledge_base = knowledge_base
+        self.collector = collector
+
+    def post(self, url, json=None, timeout=None):
+        started_at = time.perf_counter()
+        response = self.knowledge_base.lambda_handler({'body': globals()['json'].dumps(json)}, None)
+        self.collector.time_handler('knowledge-base', started_at)
+        return LocalResponse(response['statusCode'], response['body'])
+
+# ---------------------------------------------------------------------------
+# Dữ liệu giả lập
+# ---------------------------------------------------------------------------
+
+def build_conversation(rng, long_call):
+    """Danh sách (speaker, text), cuộc gọi dài để kích hoạt map-reduce"""
+    turns = []
+    for i in range(rng.randint(600, 800) if long_call else rng.randint(6, 16)):
+        if i % 2 == 0:
+            turns.append(('spk_0', rng.choice(AGENT_LINES)))
+        else:
+            turns.append(('spk_1', rng.choice(CUSTOMER_LINES)))
+    return turns
+
+def build_transcribe_output(job_name, turns, channels=False):
+    """Output JSON của Transcribe với items và speaker_labels (hoặc channel_labels nếu ChannelIdentification)"""
+    items = []
+    label_segments = []
+    clock = 0.0
+    for speaker, text in turns:
+        segment_items = []
+        segment_start = clock
+        for word in text.split():
+            start, end = clock, clock + 0.3
+            items.append({
+                'type': 'pronunciation',
+                'start_time': f"{start:.2f}",
+                'end_time': f"{end:.2f}",
+                'alternatives': [{'content': word, 'confidence': '0.95'}]
+            })
+            segment_items.append({'start_time': f"{start:.2f}", 'end_time': f"{end:.2f}", 'speaker_label': speaker})
+            clock = end + 0.05
+        items.append({'type': 'punctuation', 'alternatives': [{'content': '.', 'confidence': '0.0'}]})
+        label_segments.append({
+            'start_time': f"{segment_start:.2f}",
+            'end_time': f"{clock:.2f}",
+            'speaker_label': speaker,
+            'items': segment_items
+        })
+        clock += 0.5
+    results = {
+        'transcripts': [{'transcript': ' '.join(text + '.' for _, text in turns)}],
+        'items': items
+    }
+    if channels:
+        # Mỗi người nói ở một kênh: spk_0 -> ch_0, spk_1 -> ch_1
+        channel_items = {}
+        for segment, (speaker, text) in zip(label_segments, turns):
+            words = text.split()
+            entries = channel_items.setdefault(speaker.replace('spk', 'ch'), [])
+            for word, label in zip(words, segment['items']):
+                entries.append({
+                    'type': 'pronunciation',
+                    'start_time': label['start_time'],
+                    'end_time': label['end_time'],
+                    'alternatives': [{'content': word, 'confidence': '0.95'}]
+                })
+            entries.append({'type': 'punctuation', 'alternatives': [{'content': '.', 'confidence': '0.0'}]})
+        results['channel_labels'] = {
+            'number_of_channels': 2,
+            'channels': [{'channel_label': label, 'items': entries} for label, entries in sorted(channel_items.items())]
+        }
+    else:
+        results['speaker_labels'] = {'speakers': 2, 'segments': label_segments}
+    return {'jobName': job_name, 'results': results}
+
+def build_contacts(count, long_call_rate, seed):
+    rng = random.Random(seed)
+    contacts = []
+    for i in range(count):
+        contacts.append({
+            'contactId': f"bench-{seed}-{i:06d}",
+            'phone': '09' + ''.join(rng.choice('0123456789') for _ in range(8)),
+            'queue': rng.choice(QUEUES),
+            'turns': build_conversation(rng, rng.random() < long_call_rate)
+        })
+    return contacts
+
+def connect_event(contact):
+    """Event của contact flow; get-customer-profile được gọi trước khi flow đặt queue nên Queue là null"""
+    return {
+        'Details': {
+            'ContactData': {
+                'ContactId': contact['contactId'],
+                'Channel': 'VOICE',
+                'InitiationMethod': 'INBOUND',
+                'CustomerEndpoint': {'Address': contact['phone'], 'Type': 'TELEPHONE_NUMBER'},
+                'Queue': None
+            },
+            'Parameters': {}
+        },
+        'Name': 'ContactFlowEvent'
+    }
+
+def s3_event(bucket, key):
+    return {'Records': [{'s3': {'bucket': {'name': bucket}, 'object': {'key': key}}}]}
+
+def stream_batches(table, batch_size):
+    """
+    Giao các thay đổi đã ghi vào table (record_change) theo batch như DynamoDB Stream NEW_AND_OLD_IMAGES:
+    bản ghi cuộc gọi được INSERT khi chưa có transcript, transcript tới bằng MODIFY có OldImage
+    """
+    serializer = TypeSerializer()
+    with table.lock:
+        changes, table.stream = table.stream, []
+    for i in range(0, len(changes), batch_size):
+        records = []
+        for change in changes[i:i + batch_size]:
+            stream_data = {
+                'SequenceNumber': str(change['sequenceNumber']),
+                'ApproximateCreationDateTime': int(change['time'])
+            }
+            for name, image in (('OldImage', change['old']), ('NewImage', change['new'])):
+                if image is not None:
+                    stream_data[name] = {key: serializer.serialize(value) for key, value in image.items()}
+            records.append({'eventName': change['eventName'], 'eventSource': 'aws:dynamodb', 'dynamodb': stream_data})
+        yield {'Records': records}
+
+# ---------------------------------------------------------------------------
+
+def load_pipeline(dynamodb, s3, sqs, transcribe, connect, bedrock, collector):
+    """Import các Lambda và thay client AWS bằng bản giả lập"""
+    modules = {
+        'get-customer-profile': load_module('get_customer_profile', 'singopo/lambda/get-customer-profile.py'),
+        'contact-writer': load_module('contact_writer', 'singopo/lambda/contact-writer.py'),
+        'audio-text': load_module('audio_text', 'singopo/lambda/audio-text.py'),
+        'transcribe-complete': load_module('transcribe_complete', 'singopo/lambda/transcribe-complete.py'),
+        'transcribe-scheduler': load_module('transcribe_scheduler', 'singopo/lambda/transcribe-scheduler.py'),
+        'analysis-results': load_module('analysis_results', 'singopo/lambda/analysis-results.py'),
+        'knowledge-base': load_module('knowledge_base', 'us/knowledge-base/knowledge-base.py'),
+        'metrics-rollup': load_module('metrics_rollup', 'singopo/lambda/metrics-rollup.py')
+    }
+    instrumentation.emit_metric = collector.emit_metric
+    for module in list(modules.values()) + [transcribe_queue]:
+        if hasattr(module, 'emit_metric'):
+            module.emit_metric = collector.emit_metric
+
+    customer_table = dynamodb.Table('customer-call-analysis')
+    jobs_table = dynamodb.Table('transcription-jobs')
+    profile_module = modules['get-customer-profile']
+    profile_module.table = profile_module.direct_table = customer_table
+    # sqs = None: ghi thẳng DynamoDB trong contact flow
+    profile_module.sqs, profile_module.CONTACT_QUEUE_URL = sqs, sqs and sqs.QUEUE_URL
+    modules['contact-writer'].table = customer_table
+
+    audio_text = modules['audio-text']
+    audio_text.s3, audio_text.table = s3, customer_table
+
+    transcribe_queue.transcribe = transcribe
+    transcribe_queue.connect, transcribe_queue.CONNECT_INSTANCE_ID = connect, connect.INSTANCE_ID
+    transcribe_queue.queue_names.clear()
+    transcribe_queue.table, transcribe_queue.jobs_table = customer_table, jobs_table
+    transcribe_queue.queue_table = dynamodb.Table('transcription-queue')
+    # Backoff ngắn để benchmark không phải chờ như trên Lambda
+    transcribe_queue.SUBMIT_RETRY_BASE_SECONDS = 0.001
+
+    transcribe_complete = modules['transcribe-complete']
+    transcribe_complete.s3 = s3
+    transcribe_complete.table, transcribe_complete.jobs_table = customer_table, jobs_table
+
+    knowledge_base = modules['knowledge-base']
+    knowledge_base.client_bedrock_knowledgebase = bedrock
+    knowledge_base.cache_table = dynamodb.Table('analysis-cache')
+    knowledge_base.s3_client = s3
+
+    modules['analysis-results'].dynamodb = dynamodb
+    modules['analysis-results'].http_session = LocalSession(knowledge_base, collector)
+    modules['metrics-rollup'].dynamodb = dynamodb
+    text_storage.s3_client = s3
+    return modules
+
+def benchmark_profile_lookups(module, phone_numbers):
+    """Thời gian get_profile khi cache trống (query GSI) và khi cache đã có, và một request batch"""
+    results = {}
+    for mode in ('cold', 'warm'):
+        if mode == 'cold':
+            module.profile_cache.clear()
+        latencies = []
+        for phone_number in phone_numbers:
+            started_at = time.perf_counter()
+            module.get_profile(phone_number)
+            latencies.append((time.perf_counter() - started_at) * 1000)
+        results[mode] = summarize(latencies)
+
+    module.profile_cache.clear()
+    batch = phone_numbers[:module.MAX_BATCH_PHONES]
+    started_at = time.perf_counter()
+    module.get_profiles(batch)
+    results['batch'] = {'phones': len(batch), 'ms': round((time.perf_counter() - started_at) * 1000, 3)}
+    return results
+
+def build_transcript(rng, tokens, punctuated):
+    """Transcript giả lập khoảng tokens token; không dấu câu như output Transcribe thiếu punctuation"""
+    lines = []
+    total = 0
+    while total < tokens:
+        line = rng.choice(AGENT_LINES + CUSTOMER_LINES)
+        lines.append(line)
+        total += transcript_window.estimate_tokens(line) + 1
+    return '. '.join(lines) + '.' if punctuated else ' '.join(lines).lower()
+
+def benchmark_windowing(seed):
+    """
+    Theo từng độ dài transcript, có và không có dấu câu: thời gian rút gọn (window_conversation) hoặc
+    chia chunk (split_chunks, trên MAP_REDUCE_TOKENS), số prompt và số token gửi cho model
+    """
+    rng = random.Random(seed)
+    results = {}
+    for tokens in WINDOW_BUCKETS:
+        for punctuated in (True, False):
+            text = build_transcript(rng, tokens, punctuated)
+            map_reduce = transcript_window.estimate_tokens(text) > transcript_window.MAP_REDUCE_TOKENS
+            latencies = []
+            for _ in range(WINDOW_REPEATS):
+                started_at = time.perf_counter()
+                if map_reduce:
+                    parts = transcript_window.split_chunks(text)
+                else:
+                    parts = [transcript_window.window_conversation(text)]
+                latencies.append((time.perf_counter() - started_at) * 1000)
+            results[f"{tokens}{'' if punctuated else '-unpunctuated'}"] = {
+                'inputTokens': transcript_window.estimate_tokens(text),
+                'prompts': len(parts),
+                'outputTokens': sum(transcript_window.estimate_tokens(part) for part in parts),
+                'emptyPrompts': sum(1 for part in parts if not part.strip()),
+                'p50Ms': percentile(latencies, 50)
+            }
+    return results
+
+def legacy_fix_response(text):
+    """fix_json_response cũ của knowledge-base: thêm } theo số dấu ngoặc (đếm cả trong string)"""
+    text = text.strip()
+    missing = text.count('{') - text.count('}')
+    return text + '}' * missing if missing > 0 else text
+
+def legacy_is_valid(text):
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+def legacy_fix_inner(json_str):
+    """fix_inner_json cũ của analysis-results"""
+    if legacy_is_valid(json_str):
+        return json_str
+    open_braces, close_braces = json_str.count('{'), json_str.count('}')
+    if open_braces > close_braces:
+        if json_str.rstrip().endswith('"'):
+            json_str = json_str.rstrip() + '."\n}'
+        else:
+            json_str = json_str + '}' * (open_braces - close_braces)
+    if not legacy_is_valid(json_str):
+        if json_str.rstrip().endswith('"'):
+            json_str = json_str.rstrip() + '}'
+        elif json_str.rstrip().endswith('}'):
+            json_str = json_str.rstrip()[:-1] + '"}'
+    return json_str
+
+def legacy_parse(text):
+    """Chuỗi sửa JSON trước tolerant_json: knowledge-base rồi analysis-results, raise nếu không parse được"""
+    text = legacy_fix_response(text)
+    start = text.find('{')
+    if start == -1:
+        raise ValueError('Could not find valid JSON data in response')
+    return json.loads(legacy_fix_inner(text[start:]))
+
+def tolerant_parse(text):
+    """Chuỗi hiện tại: repair_json trong knowledge-base, extract_json trong analysis-results"""
+    return tolerant_json.extract_json(tolerant_json.repair_json(text))[1]
+
+def try_parse(parse, text):
+    try:
+        data = parse(text)
+    except (ValueError, TypeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+def valid_output(seed):
+    """Output hợp lệ của model: tóm tắt rồi object JSON, trả về (compliance_score, văn bản)"""
+    analysis = {
+        'compliance_score': random.Random(seed).randint(1, 10),
+        'violations': ['Không giới thiệu tên nhân viên', 'Đọc mã {OTP} cho khách hàng'],
+        'recommendations': ['Giới thiệu tên ở đầu cuộc gọi', 'Không đọc "mã OTP" qua điện thoại'],
+        'detailed_analysis': 'Nhân viên chào hỏi lịch sự\nnhưng bỏ qua bước xác minh',
+        'customer_emotion': 'Trung tính',
+        'emotion_details': 'Khách hàng hỏi thông tin'
+    }
+    return analysis['compliance_score'], 'Tóm tắt cuộc gọi. ' + json.dumps(analysis, ensure_ascii=False, indent=2)
+
+def cut_outputs(seed):
+    """Một output hợp lệ của model bị cắt ở mọi vị trí (mỗi JSON_CUT_STEP ký tự) sau dấu {"""
+    score, text = valid_output(seed)
+    start = text.index('{') + 1
+    return score, [text[:end] for end in range(start, len(text) + 1, JSON_CUT_STEP)]
+
+def benchmark_json_repair(seed):
+    """
+    tolerant_json so với chuỗi sửa cũ: trên corpus output hỏng (khôi phục đúng expected, hoặc từ chối khi
+    expected là null) và trên một output bị cắt ở mọi vị trí (parse được, giữ được compliance_score);
+    p50/p99 µs trên corpus và trên output hợp lệ (trường hợp thường gặp)
+    """
+    with open(MALFORMED_CORPUS, encoding='utf-8') as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    score, cuts = cut_outputs(seed)
+    _, valid_text = valid_output(seed)
+
+    results = {}
+    for name, parse in (('legacy', legacy_parse), ('tolerant', tolerant_parse)):
+        recovered = [case['name'] for case in corpus if try_parse(parse, case['text']) == case['expected']]
+        parsed_cuts = [try_parse(parse, text) for text in cuts]
+        latencies = []
+        for _ in range(JSON_REPAIR_REPEATS // 10):
+            for case in corpus:
+                started_at = time.perf_counter()
+                try_parse(parse, case['text'])
+                latencies.append((time.perf_counter() - started_at) * 1e6)
+        valid_latencies = []
+        for _ in range(JSON_REPAIR_REPEATS):
+            started_at = time.perf_counter()
+            try_parse(parse, valid_text)
+            valid_latencies.append((time.perf_counter() - started_at) * 1e6)
+        results[name] = {
+            'corpusRecovered': len(recovered),
+            'corpusCases': len(corpus),
+            'corpusFailed': [case['name'] for case in corpus if case['name'] not in recovered],
+            'cutsParsed': sum(1 for data in parsed_cuts if data is not None),
+            'cutsWithScore': sum(1 for data in parsed_cuts if data and data.get('compliance_score') == score),
+            'cuts': len(cuts),
+            'p50Us': percentile(latencies, 50),
+            'p99Us': percentile(latencies, 99),
+            'validP50Us': percentile(valid_latencies, 50),
+            'validP99Us': percentile(valid_latencies, 99)
+        }
+    return results
+
+class AnalysisApiHandler(BaseHTTPRequestHandler):
+    """API phân tích giả lập: trả lời theo HTTP_SCENARIOS của path, đếm số POST (số lần gọi model)"""
+    # Keep-alive như API thật, để đo được lợi ích của connection pool
+    protocol_version = 'HTTP/1.1'
+    posts = {}
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        # Header và body được ghi riêng: tắt Nagle để keep-alive không chờ delayed ACK (~40ms)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        scenario = self.path.strip('/')
+        with self.lock:
+            count = self.posts.get(scenario, 0)
+            self.posts[scenario] = count + 1
+        steps = HTTP_SCENARIOS[scenario]
+        status = steps[min(count, len(steps) - 1)]
+        if status == 'slow':
+            time.sleep(HTTP_TIMEOUT[1] * 2)
+            status = 200
+        try:
+            self.send_response(status)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+        except OSError:
+            # Client đã đóng kết nối sau read timeout
+            pass
+
+    def log_message(self, *args):
+        pass
+
+def unused_port():
+    """Port không có server, kết nối bị từ chối ngay"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def warm_loop(retry_module, base_url):
+    """
+    Độ trễ mỗi invocation warm (ms): before là requests.post không session và boto3.resource mới mỗi lần gọi,
+    after là session của get_http_session và runtime.resource dùng chung cho container
+    """
+    import boto3
+    import requests
+    import runtime
+
+    url = f"{base_url}/ok"
+    # get_http_session của module thật, http_session trong pipeline là LocalSession
+    local_session = retry_module.http_session
+    retry_module.http_session = None
+    session = retry_module.get_http_session()
+    retry_module.http_session = local_session
+
+    def before():
+        boto3.resource('dynamodb')
+        requests.post(url, json={'prompt': 'benchmark'}, timeout=HTTP_TIMEOUT)
+
+    def after():
+        runtime.resource('dynamodb')
+        session.post(url, json={'prompt': 'benchmark'}, timeout=HTTP_TIMEOUT)
+
+    results = {}
+    for name, call in (('before', before), ('after', after)):
+        # Lần đầu là cold start (import, tạo client, mở kết nối), không tính
+        call()
+        latencies = []
+        for _ in range(HTTP_WARM_CALLS):
+            started_at = time.perf_counter()
+            call()
+            latencies.append((time.perf_counter() - started_at) * 1000)
+        results[name] = summarize(latencies)
+    session.close()
+    return results
+
+def benchmark_http_retry(retry_module):
+    """
+    Retry cũ so với HTTP_RETRY của analysis-results trên API giả lập: số POST tới API (mỗi POST là một lần
+    gọi model), kết quả và thời gian theo từng kịch bản lỗi, cộng thêm kết nối bị từ chối.
+    Trả về (kết quả theo retry, warm loop)
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), AnalysisApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    refused_url = f"http://127.0.0.1:{unused_port()}"
+
+    results = {}
+    try:
+        for name, config in (('legacy', LEGACY_HTTP_RETRY), ('current', retry_module.HTTP_RETRY)):
+            AnalysisApiHandler.posts = {}
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(max_retries=Retry(**{**config, 'backoff_factor': HTTP_BACKOFF_FACTOR})))
+            results[name] = {}
+            urls = [(scenario, f"{base_url}/{scenario}") for scenario in HTTP_SCENARIOS]
+            for scenario, url in urls + [('connect-refused', refused_url)]:
+                started_at = time.perf_counter()
+                try:
+                    outcome = str(session.post(url, json={'prompt': 'benchmark'}, timeout=HTTP_TIMEOUT).status_code)
+                except requests.RequestException as e:
+                    outcome = type(e).__name__
+                results[name][scenario] = {
+                    'posts': AnalysisApiHandler.posts.get(scenario, 0),
+                    'outcome': outcome,
+                    'ms': round((time.perf_counter() - started_at) * 1000, 1)
+                }
+            session.close()
+        warm = warm_loop(retry_module, base_url)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results, warm
+
+def drain_transcriptions(collector, failures, modules, transcribe):
+    """
+    Giao kết quả Transcribe cho transcribe-complete (trả slot, admit tiếp), chạy transcribe-scheduler
+    khi còn file trong hàng đợi mà không còn job nào đang chạy
+    """
+    delivered = 0
+    while True:
+        while delivered < len(transcribe.completed):
+            output_bucket, output_key = transcribe.completed[delivered]
+            delivered += 1
+            transcribe.finish(output_key)
+            invoke(collector, failures, modules, 'transcribe-complete', s3_event(output_bucket, output_key))
+        if not sum(transcribe_queue.get_queue_depth().values()):
+            return
+        invoke(collector, failures, modules, 'transcribe-scheduler', {})
+        if delivered == len(transcribe.completed):
+            # Scheduler không admit được gì nữa
+            return
+
+def drain_contact_queue(collector, failures, modules, sqs, batch_size):
+    """Giao message cho contact-writer theo batch; message lỗi không được giao lại"""
+    while sqs and sqs.messages:
+        invoke(collector, failures, modules, 'contact-writer', {'Records': sqs.receive_batch(batch_size)})
+
+def admission_order(contacts, transcribe):
+    """Thứ tự trung bình (0 = đầu tiên) mà Transcribe nhận job của từng queue"""
+    queue_by_contact = {contact['contactId']: contact['queue'] for contact in contacts}
+    positions = {}
+    for position, contact_id in enumerate(transcribe.started):
+        positions.setdefault(queue_by_contact[contact_id], []).append(position)
+    return {queue: round(sum(values) / len(values), 1) for queue, values in positions.items()}
+
+def invoke(collector, failures, modules, name, event):
+    started_at = time.perf_counter()
+    try:
+        result = modules[name].lambda_handler(event, None)
+    except Exception as e:
+        failures[name] = failures.get(name, 0) + 1
+        print(f"{name}: {e}", file=sys.stderr)
+        return None
+    collector.time_handler(name, started_at)
+    if isinstance(result, dict):
+        if result.get('error') or result.get('statusCode', 200) >= 500:
+            failures[name] = failures.get(name, 0) + 1
+        failures[name] = failures.get(name, 0) + len(result.get('batchItemFailures', []))
+    return result
+
+def run_benchmark(args):
+    collector = MetricCollector()
+    dynamodb = LocalDynamoDB(args.dynamodb_latency_ms)
+    s3 = LocalS3()
+    sqs = LocalSQS(args.sqs_latency_ms) if args.contact_writer == 'queue' else None
+    contacts = build_contacts(args.contacts, args.long_call_rate, args.seed)
+    transcribe = LocalTranscribe(s3, {contact['contactId']: contact['turns'] for contact in contacts},
+                                 args.transcribe_limit)
+    transcribe_queue.MAX_CONCURRENT_JOBS = args.max_concurrent_jobs
+    connect = LocalConnect({contact['contactId']: contact['queue'] for contact in contacts})
+    bedrock = StubBedrock(args.bedrock_latency_ms, args.bedrock_jitter_ms, args.malformed_rate, args.seed)
+    modules = load_pipeline(dynamodb, s3, sqs, transcribe, connect, bedrock, collector)
+    failures = {}
+    bucket = 'call-recordings-benchmark'
+
+    if args.trace_memory:
+        tracemalloc.start()
+    started_at = time.perf_counter()
+
+    # Log của các Lambda (print) không cần trong báo cáo
+    with redirect_stdout(io.StringIO()) as lambda_output:
+        # File ghi âm tới sau khi cuộc gọi kết thúc, lúc đó contact-writer đã ghi xong bản ghi cuộc gọi
+        for contact in contacts:
+            invoke(collector, failures, modules, 'get-customer-profile', connect_event(contact))
+            if sqs and len(sqs.messages) >= args.batch_size:
+                drain_contact_queue(collector, failures, modules, sqs, args.batch_size)
+        drain_contact_queue(collector, failures, modules, sqs, args.batch_size)
+        customer_items = dynamodb.Table('customer-call-analysis').items
+        missing_contacts = sum(1 for contact in contacts
+                               if 'PhoneNumber' not in customer_items.get((contact['contactId'],), {}))
+        for contact in contacts:
+            invoke(collector, failures, modules, 'audio-text',
+                   s3_event(bucket, f"recordings/{contact['contactId']}_recording.wav"))
+        drain_transcriptions(collector, failures, modules, transcribe)
+
+        # Mọi thay đổi của bản ghi cuộc gọi (INSERT, trạng thái, transcript), analysis-results tự lọc
+        stream_records = {}
+        for name, consumer in (('customer-call-analysis', 'analysis-results'),
+                               ('analysis-results-it-got-talent', 'metrics-rollup')):
+            stream_records[name] = len(dynamodb.Table(name).stream)
+            for event in stream_batches(dynamodb.Table(name), args.batch_size):
+                invoke(collector, failures, modules, consumer, event)
+        results = list(dynamodb.Table('analysis-results-it-got-talent').items.values())
+
+    elapsed = time.perf_counter() - started_at
+    memory = {'maxRssMb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if args.trace_memory:
+        memory['tracedPeakMb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+
+    profile_module = modules['get-customer-profile']
+    phone_numbers = list(dict.fromkeys(profile_module.format_phone_number(contact['phone']) for contact in contacts))
+    profile_lookups = benchmark_profile_lookups(profile_module, phone_numbers)
+    windowing = benchmark_windowing(args.seed)
+    json_repair = benchmark_json_repair(args.seed)
+    http_retry, http_warm_loop = benchmark_http_retry(modules['analysis-results'])
+
+    handlers = {stage[len('Handler:'):]: summarize(values)
+                for stage, values in collector.latencies.items() if stage.startswith('Handler:')}
+    stages = {stage: summarize(values)
+              for stage, values in collector.latencies.items() if not stage.startswith('Handler:')}
+    return {
+        'config': {
+            'contacts': args.contacts,
+            'batchSize': args.batch_size,
+            'longCallRate': args.long_call_rate,
+            'bedrockLatencyMs': args.bedrock_latency_ms,
+            'bedrockJitterMs': args.bedrock_jitter_ms,
+            'malformedRate': args.malformed_rate,
+            'dynamodbLatencyMs': args.dynamodb_latency_ms,
+            'contactWriter': args.contact_writer,
+            'sqsLatencyMs': args.sqs_latency_ms,
+            'seed': args.seed
+        },
+        'elapsedSeconds': round(elapsed, 3),
+        'contactsPerSecond': round(len(contacts) / elapsed, 3) if elapsed else None,
+        'analysedCalls': len(results),
+        'bedrock': {'calls': bedrock.calls, 'malformed': bedrock.malformed},
+        'failures': {name: count for name, count in failures.items() if count},
+        'handlers': handlers,
+        'stages': stages,
+        'counters': {name: round(value, 3) for name, value in collector.counters.items()},
+        'transcribeQueue': {
+            'maxConcurrentJobs': args.max_concurrent_jobs,
+            'serviceLimit': args.transcribe_limit,
+            'maxInFlight': transcribe.max_in_flight,
+            'rejectedByService': transcribe.rejected,
+            'remainingQueued': sum(transcribe_queue.get_queue_depth().values()),
+            'averageAdmissionPosition': admission_order(contacts, transcribe),
+            'stats': dict(transcribe_queue.scheduler_stats)
+        },
+        'profileLookups': profile_lookups,
+        'windowing': windowing,
+        'jsonRepair': json_repair,
+        'httpRetry': http_retry,
+        'httpWarmLoop': http_warm_loop,
+        'contactRecords': {'queued': sqs.sent if sqs else 0, 'missing': missing_contacts},
+        'streamRecords': stream_records,
+        'connectCalls': dict(connect.calls),
+        'memory': memory,
+        'lambdaOutputBytes': len(lambda_output.getvalue())
+    }
+
+def compare_with_baseline(report, baseline, max_regression):
+    """Danh sách các chỉ số chậm hơn baseline quá max_regression (tỷ lệ)"""
+    regressions = []
+    if baseline.get('contactsPerSecond') and report['contactsPerSecond'] < baseline['contactsPerSecond'] * (1 - max_regression):
+        regressions.append(f"throughput {report['contactsPerSecond']} < baseline {baseline['contactsPerSecond']}")
+    for group in ('handlers', 'stages'):
+        for name, current in report[group].items():
+            previous = baseline.get(group, {}).get(name)
+            if not previous or not previous.get('p99'):
+                continue
+            if current['p99'] > previous['p99'] * (1 + max_regression):
+                regressions.append(f"{group[:-1]} {name} p99 {current['p99']}ms > baseline {previous['p99']}ms")
+    return regressions
+
+def print_report(report):
+    print(f"{report['config']['contacts']} contacts in {report['elapsedSeconds']}s, "
+          f"{report['contactsPerSecond']} contacts/s, {report['analysedCalls']} analysed, "
+          f"Bedrock calls {report['bedrock']['calls']} ({report['bedrock']['malformed']} malformed)")
+    print(f"{'':32}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for group in ('handlers', 'stages'):
+        for name, stats in sorted(report[group].items()):
+            print(f"{group[:-1] + ' ' + name:32}{stats['count']:>8}{stats['p50']:>10}{stats['p95']:>10}"
+                  f"{stats['p99']:>10}{stats['max']:>10}")
+    print(f"Memory: {json.dumps(report['memory'])}")
+    print(f"Transcribe queue: {json.dumps(report['transcribeQueue'])}")
+    print(f"Contact records ({report['config']['contactWriter']}): {json.dumps(report['contactRecords'])}")
+    print(f"Stream records: {json.dumps(report['streamRecords'])}, Connect calls: {json.dumps(report['connectCalls'])}")
+    for mode, stats in report['profileLookups'].items():
+        print(f"Profile lookup {mode}: {json.dumps(stats)}")
+    for bucket, stats in report['windowing'].items():
+        print(f"Windowing {bucket}: {json.dumps(stats)}")
+    for name, scenarios in report['httpRetry'].items():
+        print(f"HTTP retry {name}: {json.dumps(scenarios)}")
+    for name, stats in report['httpWarmLoop'].items():
+        print(f"HTTP warm loop {name}: {json.dumps(stats)}")
+    for name, stats in report['jsonRepair'].items():
+        print(f"JSON repair {name}: {json.dumps(stats, ensure_ascii=False)}")
+    if report['failures']:
+        print(f"Failures: {json.dumps(report['failures'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Local load and latency benchmark of the call analysis pipeline')
+    parser.add_argument('--contacts', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=10, help='DynamoDB Stream and SQS batch size')
+    parser.add_argument('--long-call-rate', type=float, default=0.1, help='share of calls long enough for map-reduce')
+    parser.add_argument('--bedrock-latency-ms', type=float, default=50)
+    parser.add_argument('--bedrock-jitter-ms', type=float, default=10)
+    parser.add_argument('--max-concurrent-jobs', type=int, default=20, help='scheduler ceiling for Transcribe jobs')
+    parser.add_argument('--transcribe-limit', type=int, default=25,
+                        help='concurrent job limit enforced by the local Transcribe stand-in')
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=0, help='simulated latency per DynamoDB request')
+    parser.add_argument('--contact-writer', choices=['queue', 'direct'], default='queue',
+                        help='get-customer-profile sends contact records to SQS or writes DynamoDB in the flow')
+    parser.add_argument('--sqs-latency-ms', type=float, default=0, help='simulated latency per SQS SendMessage')
+    parser.add_argument('--malformed-rate', type=float, default=0.1, help='share of truncated Bedrock responses')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trace-memory', action='store_true', help='report tracemalloc peak (slower)')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--baseline', help='JSON report of a previous run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='allowed slowdown vs baseline')
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_with_baseline(report, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""
+Đo cold start của từng Lambda: mỗi lần chạy là một process Python mới (như một container mới),
+ghi lại thời gian import handler (init), lần invoke đầu tiên (gồm client được tạo lười qua runtime)
+và lần invoke thứ hai (warm). Client AWS thật được tạo và gửi request tới một endpoint giả lập
+trên localhost (AWS_ENDPOINT_URL), nên thời gian import boto3 / tạo client được tính đúng mà không
+cần tài khoản AWS.
+
+Ví dụ:
+    python tools/coldstart.py --runs 5 --output coldstart.json
+    python tools/coldstart.py --handlers get-customer-profile audio-text --baseline coldstart.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_PATHS = [
+    os.path.join(ROOT_DIR, 'shared'),
+    os.path.join(ROOT_DIR, 'us', 'knowledge-base'),
+    os.path.join(ROOT_DIR, 'singopo', 'lambda')
+]
+
+HANDLERS = {
+    'get-customer-profile': 'singopo/lambda/get-customer-profile.py',
+    'contact-writer': 'singopo/lambda/contact-writer.py',
+    'audio-text': 'singopo/lambda/audio-text.py',
+    'transcribe-complete': 'singopo/lambda/transcribe-complete.py',
+    'transcribe-scheduler': 'singopo/lambda/transcribe-scheduler.py',
+    'analysis-results': 'singopo/lambda/analysis-results.py',
+    'knowledge-base': 'us/knowledge-base/knowledge-base.py',
+    'metrics-rollup': 'singopo/lambda/metrics-rollup.py',
+    'search-indexer': 'singopo/lambda/search-indexer.py',
+    'get-results-UI': 'singopo/lambda/get-results-UI.py',
+    'results-export': 'singopo/lambda/results-export.py'
+}
+# Module nặng được ghi nhận nếu đã được import sau khi load handler
+HEAVY_MODULES = ['boto3', 'botocore', 'requests', 'numpy', 'pyarrow']
+
+BUCKET = 'coldstart-bucket'
+ANALYSIS = {
+    'compliance_score': 8,
+    'violations': ['Không xác nhận lại thông tin khách hàng'],
+    'recommendations': ['Xác nhận lại số tài khoản trước khi kết thúc cuộc gọi'],
+    'detailed_analysis': 'Nhân viên hỗ trợ đúng quy trình.',
+    'customer_emotion': 'Trung tính',
+    'emotion_details': 'Khách hàng bình tĩnh.'
+}
+CONVERSATION = (
+    'spk_0: Xin chào, em có thể giúp gì cho anh ạ?\n'
+    'spk_1: Tôi muốn hỏi về thẻ tín dụng bị khóa.\n'
+    'spk_0: Dạ anh vui lòng cho em xin số thẻ để kiểm tra ạ.'
+)
+JOB_NAME = 'transcribe_coldstart'
+# Mapping job -> ContactId mà transcribe-complete đọc từ transcription-jobs
+JOB_MAPPING = {
+    'JobName': {'S': JOB_NAME},
+    'ContactId': {'S': 'coldstart-0001'},
+    'BucketName': {'S': BUCKET},
+    'MediaKey': {'S': 'recordings/coldstart-0001.wav'},
+    'SubmittedAt': {'S': '2024-06-01T09:30:00'}
+}
+# Phản hồi của các API DynamoDB / SQS mà handler đọc trường trong response
+DYNAMODB_RESPONSES = {
+    'DynamoDB_20120810.Query': {'Items': [], 'Count': 0, 'ScannedCount': 0},
+    'DynamoDB_20120810.Scan': {'Items': [], 'Count': 0, 'ScannedCount': 0},
+    'DynamoDB_20120810.BatchGetItem': {'Responses': {}, 'UnprocessedKeys': {}},
+    'DynamoDB_20120810.BatchWriteItem': {'UnprocessedItems': {}},
+    'AmazonSQS.SendMessage': {'MessageId': 'coldstart'}
+}
+
+class LocalEndpoint(BaseHTTPRequestHandler):
+    """Trả lời mọi request AWS / API phân tích bằng response hợp lệ tối thiểu"""
+    transcribe_output = None
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = self.rfile.read(length) if length else b''
+
+        target = self.headers.get('X-Amz-Target')
+        if target == 'DynamoDB_20120810.GetItem' and json.loads(request).get('TableName') == 'transcription-jobs':
+            body, content_type = json.dumps({'Item': JOB_MAPPING}), 'application/x-amz-json-1.0'
+        elif target:
+            body, content_type = json.dumps(DYNAMODB_RESPONSES.get(target, {})), 'application/x-amz-json-1.0'
+        elif self.path.endswith('/retrieveAndGenerate'):
+            body = json.dumps({'sessionId': 'coldstart', 'output': {'text': json.dumps(ANALYSIS, ensure_ascii=False)}})
+            content_type = 'application/json'
+        elif self.path.startswith('/analyze'):
+            # Cùng dạng body với knowledge-base qua API Gateway
+            body = json.dumps({'result': json.dumps(ANALYSIS, ensure_ascii=False)}, ensure_ascii=False)
+            content_type = 'application/json'
+        elif self.command == 'GET' and f"/transcribed/{JOB_NAME}.json" in self.path:
+            body, content_type = json.dumps(self.transcribe_output, ensure_ascii=False), 'application/json'
+        else:
+            # S3 (rest-xml): body rỗng
+            body, content_type = '', 'application/xml'
+
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = respond
+
+    def log_message(self, format, *args):
+        pass
+
+def stream_event(event_name, item):
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    image = {key: serializer.serialize(value) for key, value in item.items()}
+    return {'Records': [{
+        'eventName': event_name,
+        'dynamodb': {
+            'SequenceNumber': '1',
+            'ApproximateCreationDateTime': int(time.time()),
+            'Keys': {'ContactId': image['ContactId']},
+            'NewImage': image
+        }
+    }]}
+
+def build_events():
+    """Một event đại diện cho đường xử lý chính của mỗi handler"""
+    call_date = '2024-06-01T09:30:00'
+    call = {
+        'ContactId': 'coldstart-0001',
+        'PhoneNumber': '+84901234567',
+        'CallDate': call_date,
+        'QueueInfo': {'Name': 'Sales Queue'},
+        'TranscriptionText': CONVERSATION
+    }
+    result = {
+        'ContactId': 'coldstart-0001',
+        'CallDate': call_date,
+        'CallDay': call_date[:10],
+        'PhoneNumber': '+84901234567',
+        'QueueName': 'Sales Queue',
+        'Analysis': {**ANALYSIS, 'compliance_score': str(ANALYSIS['compliance_score'])},
+        'AnalysisTimestamp': call_date
+    }
+    return {
+        'get-customer-profile': {'Details': {'ContactData': {
+            'ContactId': 'coldstart-0001',
+            'CustomerEndpoint': {'Address': '0901234567', 'Type': 'TELEPHONE_NUMBER'},
+            'Queue': {'Name': 'Sales Queue'}
+        }}},
+        'contact-writer': {'Records': [{
+            'messageId': 'coldstart-message',
+            'body': json.dumps({
+                'ContactId': call['ContactId'],
+                'PhoneNumber': call['PhoneNumber'],
+                'CallDate': call_date,
+                'QueueInfo': call['QueueInfo'],
+                'TranscriptionStatus': 'PENDING'
+            }),
+            'attributes': {'SentTimestamp': str(int(time.time() * 1000))},
+            'eventSource': 'aws:sqs'
+        }]},
+        'audio-text': {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': 'recordings/coldstart-0001.wav'}}}]},
+        'transcribe-complete': {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': f"transcribed/{JOB_NAME}.json"}}}]},
+        'transcribe-scheduler': {},
+        'analysis-results': stream_event('INSERT', call),
+        'knowledge-base': {'body': json.dumps({'prompt': CONVERSATION}, ensure_ascii=False)},
+        'metrics-rollup': stream_event('INSERT', result),
+        'search-indexer': stream_event('INSERT', result),
+        'get-results-UI': {'queryStringParameters': {'limit': '50'}},
+        'results-export': {'from': call_date[:10]}
+    }
+
+def describe_result(result):
+    """Tóm tắt kết quả invoke để thấy handler có chạy hết đường chính không"""
+    if isinstance(result, dict):
+        if 'statusCode' in result:
+            return f"status {result['statusCode']}"
+        if 'batchItemFailures' in result:
+            return f"{len(result['batchItemFailures'])} failed records"
+        if 'error' in result:
+            return f"error: {result['error']}"
+    return 'ok'
+
+def run_child(name):
+    """Chạy trong process mới: import handler, invoke 2 lần, in kết quả JSON"""
+    import io
+    import logging
+    import importlib.util
+    from contextlib import redirect_stdout
+
+    event = json.loads(sys.stdin.read())
+    sys.path[:0] = LAMBDA_PATHS
+    logging.disable(logging.CRITICAL)
+    report = {'handler': name}
+
+    started_at = time.perf_counter()
+    try:
+        with redirect_stdout(io.StringIO()):
+            spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(ROOT_DIR, HANDLERS[name]))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+    except Exception as e:
+        report['error'] = f"{type(e).__name__}: {str(e)}"
+        print(json.dumps(report))
+        return
+    report['initMs'] = round((time.perf_counter() - started_at) * 1000, 3)
+    report['loadedAtInit'] = [module_name for module_name in HEAVY_MODULES if module_name in sys.modules]
+
+    import runtime
+    report['clientsAtInit'] = sorted(runtime.init_timings)
+    for phase in ('firstInvokeMs', 'warmInvokeMs'):
+        started_at = time.perf_counter()
+        try:
+            with redirect_stdout(io.StringIO()):
+                result = module.lambda_handler(json.loads(json.dumps(event)), None)
+            report.setdefault('result', describe_result(result))
+        except Exception as e:
+            report.setdefault('result', f"raised {type(e).__name__}: {str(e)}")
+        report[phase] = round((time.perf_counter() - started_at) * 1000, 3)
+    report['lazyInit'] = runtime.init_timings
+    print(json.dumps(report, ensure_ascii=False))
+
+def child_env(endpoint, config_path):
+    env = dict(os.environ)
+    env.update({
+        'AWS_ENDPOINT_URL': endpoint,
+        'AWS_ACCESS_KEY_ID': 'coldstart',
+        'AWS_SECRET_ACCESS_KEY': 'coldstart',
+        'AWS_DEFAULT_REGION': 'us-west-2',
+        'AWS_EC2_METADATA_DISABLED': 'true',
+        'AWS_CONFIG_FILE': config_path,
+        'AWS_MAX_ATTEMPTS': '1',
+        'ANALYSIS_API_ENDPOINT': f"{endpoint}/analyze",
+        'CONTACT_QUEUE_URL': f"{endpoint}/000000000000/contact-records",
+        'EXPORT_BUCKET': BUCKET,
+        'LARGE_TEXT_BUCKET': BUCKET,
+        'METRICS_ENABLED': '0',
+        'PAYLOAD_SAMPLE_RATE': '0'
+    })
+    return env
+
+def measure(name, event, env):
+    started_at = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', name],
+        input=json.dumps(event, ensure_ascii=False), capture_output=True, text=True, env=env, timeout=120
+    )
+    process_ms = round((time.perf_counter() - started_at) * 1000, 3)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode or not lines:
+        return {'handler': name, 'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'no output'}
+    report = json.loads(lines[-1])
+    report['processMs'] = process_ms
+    return report
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else round((ordered[middle - 1] + ordered[middle]) / 2, 3)
+
+def summarize(runs):
+    """Trung vị qua các lần chạy, coldStartMs = init + lần invoke đầu tiên"""
+    if any('error' in run for run in runs):
+        return {'error': next(run['error'] for run in runs if 'error' in run)}
+    summary = {field: median([run[field] for run in runs]) for field in ('initMs', 'firstInvokeMs', 'warmInvokeMs', 'processMs')}
+    summary['coldStartMs'] = round(summary['initMs'] + summary['firstInvokeMs'], 3)
+    summary['loadedAtInit'] = runs[0]['loadedAtInit']
+    summary['clientsAtInit'] = runs[0]['clientsAtInit']
+    summary['lazyInit'] = {key: median([run['lazyInit'].get(key, 0) for run in runs]) for key in runs[0]['lazyInit']}
+    summary['result'] = runs[0]['result']
+    return summary
+
+def compare_with_baseline(report, baseline, max_regression):
+    """Các handler có coldStartMs chậm hơn baseline quá max_regression"""
+    regressions = []
+    for name, summary in report['handlers'].items():
+        previous = baseline.get('handlers', {}).get(name, {})
+        if 'coldStartMs' in summary and previous.get('coldStartMs'):
+            if summary['coldStartMs'] > previous['coldStartMs'] * (1 + max_regression):
+                regressions.append(f"{name}: coldStartMs {previous['coldStartMs']} -> {summary['coldStartMs']}")
+    return regressions
+
+def print_report(report):
+    print(f"{'':24}{'init':>10}{'1st invoke':>12}{'cold':>10}{'warm':>10}  (ms, median of {report['runs']} runs)")
+    for name, summary in report['handlers'].items():
+        if 'error' in summary:
+            print(f"{name:24}skipped: {summary['error']}")
+            continue
+        print(f"{name:24}{summary['initMs']:>10}{summary['firstInvokeMs']:>12}{summary['coldStartMs']:>10}{summary['warmInvokeMs']:>10}"
+              f"  init loads {','.join(summary['loadedAtInit']) or '-'}; {summary['result']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start (import, init, first invocation) per Lambda handler')
+    parser.add_argument('--handlers', nargs='+', choices=sorted(HANDLERS), default=list(HANDLERS))
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per handler')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--baseline', help='previous JSON report to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from benchmark import build_transcribe_output
+    turns = [tuple(line.split(': ', 1)) for line in CONVERSATION.splitlines()]
+    LocalEndpoint.transcribe_output = build_transcribe_output(JOB_NAME, turns)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LocalEndpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as config_file:
+        # Endpoint localhost không có subdomain theo bucket
+        config_file.write('[default]\ns3 =\n    addressing_style = path\n')
+    env = child_env(endpoint, config_file.name)
+    events = build_events()
+
+    report = {'runs': args.runs, 'python': sys.version.split()[0], 'handlers': {}}
+    try:
+        for name in args.handlers:
+            runs = [measure(name, events[name], env) for _ in range(args.runs)]
+            report['handlers'][name] = summarize(runs)
+    finally:
+        server.shutdown()
+        os.unlink(config_file.name)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_with_baseline(report, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""
+Chạy lại pipeline phân tích ngoài Lambda trên file export của customer-call-analysis:
+clean_conversation -> create_analysis_prompt -> model -> process_response -> save_analysis_result
+
+Ví dụ:
+    python tools/rescore.py export.jsonl --backend stub --workers 4 --output results.jsonl
+    python tools/rescore.py export.csv --backend bedrock --write-dynamodb --checkpoint rescore.ckpt
+    python tools/rescore.py export.jsonl --backend bedrock --write-dynamodb --stale-rules
+
+Với --write-dynamodb, các ngày có kết quả được ghi lại được export lại bằng Lambda results-export
+(--export-function, --no-export để bỏ qua) để file Parquet không giữ điểm cũ.
+"""
+import os
+import sys
+import csv
+import json
+import base64
+import time
+import hashlib
+import argparse
+import importlib.util
+from decimal import Decimal
+from multiprocessing import Pool
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'shared'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'us', 'knowledge-base'))
+# Không in metric EMF của các Lambda khi chạy offline
+os.environ.setdefault('METRICS_ENABLED', '0')
+
+import runtime
+from text_storage import unpack_text, unpack_json
+from compliance_rules import get_rule_set
+
+EXPORT_FUNCTION_NAME = 'results-export'
+# Số ngày mỗi lần gọi results-export, giữ mỗi lần chạy trong timeout của Lambda
+EXPORT_DAYS_PER_INVOKE = 31
+# Gọi đồng bộ: chờ tới timeout tối đa của Lambda, không gọi lại khi hết thời gian chờ
+EXPORT_INVOKE_CONFIG = {'read_timeout': 900, 'retries': {'max_attempts': 1}}
+
+# Các module của worker process, khởi tạo trong init_worker
+knowledge_base = None
+analysis_results = None
+worker_options = None
+
+def load_module(name, relative_path):
+    """Import file Lambda có dấu '-' trong tên"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT_DIR, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def from_dynamodb_json(value):
+    """Chuyển giá trị dạng {"S": "..."} (DynamoDB export) về giá trị thường"""
+    if isinstance(value, dict) and len(value) == 1:
+        type_name, inner = next(iter(value.items()))
+        if type_name in ('S', 'N', 'BOOL'):
+            return inner
+        if type_name == 'B':
+            return base64.b64decode(inner)
+        if type_name == 'M':
+            return {key: from_dynamodb_json(item) for key, item in inner.items()}
+        if type_name == 'L':
+            return [from_dynamodb_json(item) for item in inner]
+        if type_name == 'NULL':
+            return None
+    return value
+
+def read_export(path):
+    """Đọc các record từ file JSON Lines (thường hoặc DynamoDB export) hoặc CSV"""
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+        return
+    
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record = record.get('Item', record)
+            yield {key: from_dynamodb_json(value) for key, value in record.items()}
+
+def load_checkpoint(path):
+    """ContactId đã xử lý xong ở các lần chạy trước"""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+def stub_model(analysis_prompt):
+    """Model giả lập có kết quả cố định theo nội dung prompt, dùng để test và benchmark"""
+    digest = hashlib.sha256(analysis_prompt.encode('utf-8')).digest()
+    score = digest[0] % 10 + 1
+    emotion = ['Tích cực', 'Trung tính', 'Tiêu cực'][digest[1] % 3]
+    analysis = {
+        'compliance_score': score,
+        'violations': [] if score >= 7 else ['Chưa tuân thủ đầy đủ quy trình'],
+        'recommendations': [] if score >= 7 else ['Tuân thủ đầy đủ quy trình giao tiếp'],
+        'detailed_analysis': 'Kết quả giả lập',
+        'customer_emotion': emotion,
+        'emotion_details': 'Kết quả giả lập'
+    }
+    return f"Tóm tắt giả lập. {json.dumps(analysis, ensure_ascii=False)}"
+
+def call_model(transcript, segments=None):
+    """Gọi model theo backend, trả về body giống response của API knowledge-base"""
+    backend = worker_options['backend']
+    if backend in ('stub', 'bedrock'):
+        rule_set = get_rule_set()
+        generate = stub_model if backend == 'stub' else knowledge_base.generate_analysis
+        result = knowledge_base.analyze_conversation(transcript, generate=generate, segments=segments, rule_set=rule_set)
+        return json.dumps({'result': result, 'ruleVersion': rule_set['version']})
+    # backend 'api': gọi API Gateway giống analysis-results.py
+    payload = {'prompt': transcript}
+    if segments:
+        payload['segments'] = segments
+    response = analysis_results.get_http_session().post(
+        analysis_results.API_ENDPOINT,
+        json=payload,
+        timeout=analysis_results.API_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.text
+
+def find_stale_contacts(rule_version):
+    """
+    ContactId có kết quả được chấm bằng version quy định khác rule_version (hoặc chưa có version).
+    Scan vẫn đọc và tính read unit trên toàn bộ item của bảng (kể cả RawResponse), ProjectionExpression
+    và FilterExpression chỉ giảm dữ liệu trả về; chi phí này nhỏ so với gọi model cho cả bảng,
+    nhưng không rẻ hơn một lần Scan đầy đủ
+    """
+    results = load_module('analysis_results', 'singopo/lambda/analysis-results.py')
+    table = results.get_dynamodb().Table(results.RESULTS_TABLE_NAME)
+    scan_kwargs = {
+        'ProjectionExpression': 'ContactId',
+        'FilterExpression': 'attribute_not_exists(RuleVersion) OR RuleVersion <> :v',
+        'ExpressionAttributeValues': {':v': rule_version}
+    }
+    stale = set()
+    while True:
+        response = table.scan(**scan_kwargs)
+        stale.update(item['ContactId'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return stale
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def get_queue_name(queue_info):
+    """
+    Tên queue từ QueueInfo của file export, giống analysis_results.get_queue_name nhưng với giá trị
+    đã bỏ kiểu DynamoDB: object Queue của Amazon Connect, chuỗi 'No Queue' hoặc chuỗi JSON (cột CSV)
+    """
+    if isinstance(queue_info, str) and queue_info.startswith('{'):
+        queue_info = json.loads(queue_info)
+    if isinstance(queue_info, dict):
+        return queue_info.get('Name') or 'No Queue'
+    return queue_info or 'No Queue'
+
+def get_stored_version(contact_id):
+    """SourceTimestamp / TranscriptHash của kết quả đang lưu, {} nếu cuộc gọi chưa có kết quả"""
+    table = analysis_results.get_dynamodb().Table(analysis_results.RESULTS_TABLE_NAME)
+    response = table.get_item(
+        Key={'ContactId': contact_id},
+        ProjectionExpression='SourceTimestamp, TranscriptHash',
+        ConsistentRead=True
+    )
+    return response.get('Item') or {}
+
+def reexport_days(function_name, days):
+    """Export lại partition của các ngày có kết quả vừa được ghi lại"""
+    lambda_client = runtime.client('lambda', config=EXPORT_INVOKE_CONFIG)
+    days = sorted(days)
+    for i in range(0, len(days), EXPORT_DAYS_PER_INVOKE):
+        chunk = days[i:i + EXPORT_DAYS_PER_INVOKE]
+        response = lambda_client.invoke(
+            FunctionName=function_name,
+            Payload=json.dumps({'days': chunk}).encode('utf-8')
+        )
+        result = json.loads(response['Payload'].read() or b'null')
+        if response.get('FunctionError') or not isinstance(result, dict) or result.get('statusCode') != 200:
+            raise RuntimeError(f"{function_name} failed for {chunk[0]}..{chunk[-1]}: {result}")
+        print(f"Re-exported {sum(result['body']['exported'].values())} results for {chunk[0]}..{chunk[-1]}")
+
+def init_worker(options):
+    global knowledge_base, analysis_results, worker_options
+    worker_options = options
+    knowledge_base = load_module('knowledge_base', 'us/knowledge-base/knowledge-base.py')
+    analysis_results = load_module('analysis_results', 'singopo/lambda/analysis-results.py')
+
+def rescore_record(record):
+    """Chạy toàn bộ pipeline cho một record, trả về (ContactId, item hoặc None, lỗi)"""
+    contact_id = record.get('ContactId')
+    try:
+        # Text của cuộc gọi dài được lưu nén hoặc trên S3 (text_storage)
+        transcript = unpack_text(record.get('TranscriptionText'))
+        if not transcript:
+            raise ValueError('Empty transcription text')
+        
+        if worker_options['write_dynamodb']:
+            # Ghi lại cùng version với kết quả đang lưu; kết quả đó thuộc transcript khác (mới hơn file export)
+            # thì không ghi đè
+            transcript_hash = hashlib.sha256(transcript.encode('utf-8')).hexdigest()
+            stored = get_stored_version(contact_id)
+            if stored.get('TranscriptHash', transcript_hash) != transcript_hash:
+                raise ValueError('Stored result is for a different transcript, export is out of date')
+        
+        raw_segments = record.get('TranscriptSegments') or []
+        # Cột CSV chứa segments dạng chuỗi JSON
+        if isinstance(raw_segments, str):
+            raw_segments = json.loads(raw_segments)
+        else:
+            raw_segments = unpack_json(raw_segments)
+        segments = [
+            {**segment, 'start': float(segment['start']), 'end': float(segment['end'])}
+            for segment in raw_segments
+        ]
+        raw_response = call_model(transcript, segments or None)
+        analysis = analysis_results.process_response(raw_response)
+        
+        if worker_options['write_dynamodb']:
+            saved = analysis_results.save_analysis_result(
+                contactId=contact_id,
+                call_date=record.get('CallDate', ''),
+                phone_number=record.get('PhoneNumber', ''),
+                analysis=analysis,
+                raw_response=raw_response,
+                queue_name=get_queue_name(record.get('QueueInfo')),
+                source_timestamp=stored.get('SourceTimestamp', Decimal(0)),
+                transcript_hash=transcript_hash
+            )
+            if saved is None:
+                raise ValueError('A newer transcript was analysed while re-scoring')
+        return contact_id, {'ContactId': contact_id, 'Analysis': analysis}, None
+    except Exception as e:
+        return contact_id, None, str(e)
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-score exported call transcripts offline')
+    parser.add_argument('export', help='JSON Lines or CSV export of customer-call-analysis')
+    parser.add_argument('--backend', choices=['stub', 'bedrock', 'api'], default='stub')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='rescore-results.jsonl', help='JSON Lines file for results')
+    parser.add_argument('--checkpoint', help='file of finished ContactIds, used to resume')
+    parser.add_argument('--write-dynamodb', action='store_true', help='save results with save_analysis_result')
+    parser.add_argument('--limit', type=int, help='stop after this many records')
+    parser.add_argument('--stale-rules', action='store_true',
+                        help='only re-score calls whose stored RuleVersion is not the current compliance rule version')
+    parser.add_argument('--export-function', default=EXPORT_FUNCTION_NAME,
+                        help='results-export Lambda invoked for the call days written with --write-dynamodb')
+    parser.add_argument('--no-export', action='store_true', help='do not re-export the written call days')
+    args = parser.parse_args()
+    
+    done = load_checkpoint(args.checkpoint)
+    records = [record for record in read_export(args.export)
+               if record.get('ContactId') and record['ContactId'] not in done]
+    if args.stale_rules:
+        rule_version = get_rule_set()['version']
+        stale = find_stale_contacts(rule_version)
+        print(f"{len(stale)} calls analysed under rule versions other than {rule_version}")
+        records = [record for record in records if record['ContactId'] in stale]
+    if args.limit:
+        records = records[:args.limit]
+    print(f"{len(records)} records to process, {len(done)} skipped from checkpoint")
+    
+    options = {'backend': args.backend, 'write_dynamodb': args.write_dynamodb}
+    call_dates = {record['ContactId']: str(record.get('CallDate') or '') for record in records}
+    written_days = set()
+    started_at = time.time()
+    succeeded = failed = 0
+    
+    checkpoint = open(args.checkpoint, 'a', encoding='utf-8') if args.checkpoint else None
+    try:
+        with open(args.output, 'a', encoding='utf-8') as output, \
+                Pool(args.workers, initializer=init_worker, initargs=(options,)) as pool:
+            for contact_id, item, error in pool.imap_unordered(rescore_record, records, chunksize=4):
+                if error:
+                    failed += 1
+                    print(f"{contact_id}: {error}", file=sys.stderr)
+                    continue
+                
+                succeeded += 1
+                if args.write_dynamodb and len(call_dates[contact_id]) >= 10:
+                    written_days.add(call_dates[contact_id][:10])
+                output.write(json.dumps(item, ensure_ascii=False) + '\n')
+                # Chỉ ghi checkpoint sau khi kết quả đã được ghi ra file
+                if checkpoint:
+                    output.flush()
+                    checkpoint.write(contact_id + '\n')
+                    checkpoint.flush()
+    finally:
+        if checkpoint:
+            checkpoint.close()
+    
+    elapsed = time.time() - started_at
+    rate = (succeeded + failed) / elapsed if elapsed else 0
+    print(f"Processed {succeeded + failed} records ({failed} failed) in {elapsed:.2f}s, {rate:.2f} records/s")
+    
+    if written_days and not args.no_export:
+        reexport_days(args.export_function, written_days)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Báo cáo compliance trên các file Parquet do results-export.py tạo
+(analysis-results/call_day=YYYY-MM-DD/*.parquet): xu hướng điểm theo tháng, percentile,
+tần suất vi phạm, phân bố cảm xúc và điểm theo queue. Chỉ đọc các cột cần dùng,
+tính bằng NumPy trên toàn bộ cột thay vì từng item.
+
+Ví dụ:
+    python tools/results_report.py s3://export-bucket/analysis-results/ --from 2024-01-01 --to 2024-06-30
+    python tools/results_report.py ./analysis-results --top-violations 20 --output report.json
+"""
+import sys
+import json
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+COLUMNS = ['call_day', 'queue_name', 'compliance_score', 'customer_emotion', 'violation_count', 'violations']
+PERCENTILES = [10, 25, 50, 75, 90, 95, 99]
+# Điểm dưới mức này được tính là cuộc gọi không đạt
+PASSING_SCORE = 7
+
+def load_results(location, from_day=None, to_day=None):
+    """Đọc dataset partition theo call_day, bộ lọc ngày chỉ mở các partition cần thiết"""
+    partitioning = ds.partitioning(pa.schema([('call_day', pa.string())]), flavor='hive')
+    dataset = ds.dataset(location, format='parquet', partitioning=partitioning)
+
+    day = ds.field('call_day')
+    condition = None
+    if from_day:
+        condition = day >= from_day
+    if to_day:
+        condition = day <= to_day if condition is None else condition & (day <= to_day)
+    return dataset.to_table(columns=COLUMNS, filter=condition)
+
+def group_mean(keys, values):
+    """Trung bình và số lượng theo nhóm, bỏ qua NaN"""
+    labels, inverse = np.unique(keys, return_inverse=True)
+    valid = ~np.isnan(values)
+    counts = np.bincount(inverse, minlength=len(labels))
+    scored = np.bincount(inverse[valid], minlength=len(labels))
+    sums = np.bincount(inverse[valid], weights=values[valid], minlength=len(labels))
+    means = np.divide(sums, scored, out=np.full(len(labels), np.nan), where=scored > 0)
+    return labels, counts, means
+
+def round_or_none(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+def monthly_trend(days, scores, violation_counts):
+    months = days.astype('U7')
+    labels, counts, means = group_mean(months, scores)
+    _, inverse = np.unique(months, return_inverse=True)
+    failing = np.bincount(inverse, weights=scores < PASSING_SCORE, minlength=len(labels))
+    violations = np.bincount(inverse, weights=violation_counts, minlength=len(labels))
+    return [
+        {
+            'month': str(month),
+            'calls': int(count),
+            'avgScore': round_or_none(mean),
+            'failingRate': round(float(fail) / int(count), 3),
+            'violationsPerCall': round(float(total) / int(count), 2)
+        }
+        for month, count, mean, fail, total in zip(labels, counts, means, failing, violations)
+    ]
+
+def score_percentiles(scores):
+    valid = scores[~np.isnan(scores)]
+    if not len(valid):
+        return {}
+    return {f"p{p}": round(float(value), 2) for p, value in zip(PERCENTILES, np.percentile(valid, PERCENTILES))}
+
+def top_violations(table, limit):
+    """Đếm vi phạm trên cột list đã làm phẳng, không duyệt từng cuộc gọi"""
+    flat = pc.list_flatten(table['violations'])
+    if not len(flat):
+        return []
+    counts = pc.value_counts(flat)
+    values = counts.field('values').to_numpy(zero_copy_only=False)
+    frequency = counts.field('counts').to_numpy()
+    order = np.argsort(frequency)[::-1][:limit]
+    return [{'violation': str(values[i]), 'calls': int(frequency[i])} for i in order]
+
+def distribution(values):
+    labels, counts = np.unique(values, return_counts=True)
+    total = counts.sum()
+    return {str(label): {'calls': int(count), 'share': round(int(count) / int(total), 3)} for label, count in zip(labels, counts)}
+
+def build_report(table, limit):
+    days = table['call_day'].to_numpy(zero_copy_only=False).astype('U10')
+    scores = table['compliance_score'].fill_null(np.nan).to_numpy().astype(np.float64)
+    violation_counts = table['violation_count'].fill_null(0).to_numpy()
+    emotions = table['customer_emotion'].fill_null('unknown').to_numpy(zero_copy_only=False).astype(str)
+    emotions = np.char.lower(emotions)
+    queues = table['queue_name'].fill_null('No Queue').to_numpy(zero_copy_only=False).astype(str)
+
+    queue_labels, queue_counts, queue_means = group_mean(queues, scores)
+    return {
+        'calls': len(days),
+        'fromDay': str(days.min()),
+        'toDay': str(days.max()),
+        'avgScore': round_or_none(np.nanmean(scores)) if (~np.isnan(scores)).any() else None,
+        'unscoredCalls': int(np.isnan(scores).sum()),
+        'scorePercentiles': score_percentiles(scores),
+        'monthly': monthly_trend(days, scores, violation_counts),
+        'topViolations': top_violations(table, limit),
+        'emotions': distribution(emotions),
+        'queues': {
+            str(queue): {'calls': int(count), 'avgScore': round_or_none(mean)}
+            for queue, count, mean in zip(queue_labels, queue_counts, queue_means)
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compliance report over the Parquet export of analysis results')
+    parser.add_argument('location', help='Local directory or s3://bucket/prefix written by results-export')
+    parser.add_argument('--from', dest='from_day', help='First call day (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='to_day', help='Last call day (YYYY-MM-DD)')
+    parser.add_argument('--top-violations', type=int, default=10)
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    table = load_results(args.location, args.from_day, args.to_day)
+    if not table.num_rows:
+        print('No results in range')
+        sys.exit(1)
+
+    report = build_report(table, args.top_violations)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
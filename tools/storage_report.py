@@ -0,0 +1,119 @@
+"""
+Ước lượng kích thước item và RCU trước / sau khi lưu text lớn bằng text_storage
+(TranscriptionText, TranscriptSegments, RawResponse) trên một file export mẫu.
+
+Ví dụ:
+    python tools/storage_report.py export.jsonl
+"""
+import sys
+import json
+import math
+import argparse
+from decimal import Decimal
+
+from rescore import read_export
+import text_storage
+from text_storage import pack_text, pack_json, unpack_text, unpack_json
+
+TEXT_FIELDS = ('TranscriptionText', 'RawResponse')
+JSON_FIELDS = ('TranscriptSegments',)
+MAX_ITEM_BYTES = 400 * 1024
+# Kích thước ước lượng của con trỏ S3 khi text được đưa ra ngoài
+POINTER_BYTES = 160
+
+def value_size(value):
+    """Kích thước một giá trị theo cách DynamoDB tính (xấp xỉ)"""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, text_storage.Binary):
+        return len(value.value)
+    if isinstance(value, (int, float, Decimal)):
+        return len(str(value).replace('-', '').replace('.', '')) // 2 + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(key.encode('utf-8')) + value_size(item) + 1 for key, item in value.items())
+    if isinstance(value, list):
+        return 3 + sum(value_size(item) + 1 for item in value)
+    return len(str(value).encode('utf-8'))
+
+def item_size(item):
+    return sum(len(name.encode('utf-8')) + value_size(value) for name, value in item.items())
+
+def read_units(size):
+    """RCU của một lần đọc eventually consistent"""
+    return math.ceil(size / 4096) * 0.5
+
+def unpacked(record):
+    """Item ở dạng gốc (không nén) để so sánh"""
+    item = dict(record)
+    for field in TEXT_FIELDS:
+        if field in item:
+            item[field] = unpack_text(item[field])
+    for field in JSON_FIELDS:
+        if isinstance(item.get(field), str):
+            item[field] = json.loads(item[field])
+        elif field in item:
+            item[field] = unpack_json(item[field])
+    return item
+
+def packed(item):
+    """Item sau khi nén, trường nén xong vẫn vượt OFFLOAD_MIN_BYTES được tính như con trỏ S3"""
+    result = dict(item)
+    offloaded = 0
+    key = item.get('ContactId', 'sample')
+    for field in TEXT_FIELDS + JSON_FIELDS:
+        if result.get(field) is None:
+            continue
+        if field in TEXT_FIELDS:
+            value = pack_text(result[field], f"{key}/{field}")
+        else:
+            value = pack_json(result[field], f"{key}/{field}")
+        if value_size(value) >= text_storage.OFFLOAD_MIN_BYTES:
+            value = 'x' * POINTER_BYTES
+            offloaded += 1
+        result[field] = value
+    return result, offloaded
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Item size and read cost before/after text_storage')
+    parser.add_argument('export', help='JSON Lines or CSV export of customer-call-analysis or analysis results')
+    args = parser.parse_args()
+
+    # Chỉ đo, không ghi lên S3
+    text_storage.LARGE_TEXT_BUCKET = None
+    before, after = [], []
+    offloaded = 0
+    for record in read_export(args.export):
+        item = unpacked(record)
+        packed_item, offloaded_fields = packed(item)
+        before.append(item_size(item))
+        after.append(item_size(packed_item))
+        offloaded += offloaded_fields
+
+    if not before:
+        print('No records in export')
+        sys.exit(1)
+
+    report = {
+        'items': len(before),
+        'avgBytes': {'before': round(sum(before) / len(before)), 'after': round(sum(after) / len(after))},
+        'p99Bytes': {'before': percentile(before, 99), 'after': percentile(after, 99)},
+        'maxBytes': {'before': max(before), 'after': max(after)},
+        'overItemLimit': {'before': sum(size > MAX_ITEM_BYTES for size in before),
+                          'after': sum(size > MAX_ITEM_BYTES for size in after)},
+        'readUnits': {'before': sum(map(read_units, before)), 'after': sum(map(read_units, after))},
+        'fieldsOffloadedToS3': offloaded
+    }
+    report['sizeReduction'] = round(1 - sum(after) / sum(before), 3)
+    report['readUnitReduction'] = round(1 - report['readUnits']['after'] / report['readUnits']['before'], 3)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Bộ quy định compliance có version. Rule set được đọc một lần cho mỗi container (file
+compliance_rules.json đi kèm, hoặc COMPLIANCE_RULES_URI trên S3 để đổi quy định không cần deploy)
+và biên dịch sẵn thành prompt template; mỗi lần phân tích chỉ còn điền hội thoại.
+Version được lưu cùng kết quả để chỉ chấm lại các cuộc gọi của version cũ.
+"""
+import os
+import json
+import time
+import threading
+from string import Template
+from urllib.parse import urlparse
+import runtime
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compliance_rules.json')
+# s3://bucket/key.json hoặc đường dẫn file, mặc định DEFAULT_RULES_PATH
+RULES_URI = os.environ.get('COMPLIANCE_RULES_URI')
+# Rule set trên S3 được đọc lại sau khoảng thời gian này
+RULES_REFRESH_SECONDS = int(os.environ.get('COMPLIANCE_RULES_REFRESH_SECONDS', '300'))
+
+PROMPT_TEMPLATE = """
+    Analyze the following conversation based on these banking customer service guidelines:
+    $rules
+    $part_note
+    $findings
+
+    $conversation_section
+
+    Provide analysis in the following JSON format ONLY:
+    {
+        "compliance_score": <score from 1-10>,
+        "violations": [<list of specific violations>],
+        "recommendations": [<list of specific improvements>],
+        "detailed_analysis": "<brief analysis>",
+        "customer_emotion": "<Tích cực/Trung tính/Tiêu cực>",
+        "emotion_details": "<brief emotion analysis>"
+    }
+
+    Requirements:
+    - compliance_score must be a number between 1 and 10
+    - All fields must be present
+    - Response must be valid JSON, chú ý'{', '}'
+    - Keep analysis concise and specific
+    - Focus on compliance with banking regulations
+    """
+
+current_rule_set = None
+loaded_at = 0
+rules_lock = threading.Lock()
+
+def read_rule_set():
+    """Đọc JSON {version, title, rules: [{number, name, items}]}"""
+    uri = RULES_URI or DEFAULT_RULES_PATH
+    if uri.startswith('s3://'):
+        parsed = urlparse(uri)
+        body = runtime.client('s3').get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip('/'))['Body'].read()
+        data = json.loads(body)
+    else:
+        with open(uri, encoding='utf-8') as f:
+            data = json.load(f)
+
+    if not data.get('version') or not data.get('rules'):
+        raise ValueError(f"Rule set {uri} needs version and rules")
+    return data
+
+def format_rules(data):
+    lines = [f"{data.get('title', 'Quy định giao tiếp với khách hàng')}:"]
+    for rule in data['rules']:
+        lines.append(f"{rule['number']}. {rule['name']}")
+        lines.extend(f"   - {item}" for item in rule.get('items', []))
+    return '\n    '.join(lines)
+
+def compile_rule_set(data):
+    """Điền sẵn phần quy định vào template, chỉ còn các chỗ trống theo từng cuộc gọi"""
+    rules_text = format_rules(data).replace('$', '$$')
+    return {
+        'version': str(data['version']),
+        'template': Template(Template(PROMPT_TEMPLATE).safe_substitute(rules=rules_text))
+    }
+
+def get_rule_set():
+    """Rule set đã biên dịch của container, đọc lại từ S3 sau RULES_REFRESH_SECONDS"""
+    global current_rule_set, loaded_at
+    with rules_lock:
+        expired = RULES_URI and time.time() - loaded_at > RULES_REFRESH_SECONDS
+        if current_rule_set is None or expired:
+            try:
+                rule_set = compile_rule_set(read_rule_set())
+            except Exception as e:
+                # Lỗi khi đọc lại thì dùng tiếp rule set cũ
+                if current_rule_set is None:
+                    raise
+                print(f"Error reloading compliance rules: {str(e)}")
+                rule_set = current_rule_set
+            if current_rule_set is None or rule_set['version'] != current_rule_set['version']:
+                print(f"Compliance rules version: {rule_set['version']}")
+            current_rule_set = rule_set
+            loaded_at = time.time()
+        return current_rule_set
+
+def render_prompt(rule_set, part_note, findings, conversation_section):
+    return rule_set['template'].substitute(
+        part_note=part_note,
+        findings=findings,
+        conversation_section=conversation_section
+    )
@@ -1,103 +1,488 @@
+import os
 import json
-import boto3
-import re
-
-def truncate_text(text, max_length=4000):
-    """Cắt ngắn văn bản nếu quá dài"""
-    if len(text) > max_length:
-        return text[:max_length] + "..."
-    return text
-
-def clean_conversation(text):
-    """Làm sạch và rút gọn cuộc hội thoại"""
-    # Loại bỏ các ký tự đặc biệt và khoảng trắng thừa
-    text = re.sub(r'\s+', ' ', text)
-    # Chỉ giữ lại các đoạn hội thoại chính
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    return text
-
-def get_compliance_rules():
-    """Trả về quy định giao tiếp với khách hàng"""
-    return """
-    Quy định giao tiếp với khách hàng ngân hàng:
-    1. Chào hỏi và xưng danh
-       - Chào đúng thời điểm + xưng tên/vị trí
-       - Thái độ lịch sự, tôn trọng
-    2. Thái độ phục vụ
-       - Giọng nói thân thiện, kiên nhẫn
-       - Lắng nghe, không cáu gắt
-    3. Quy trình xử lý
-       - Xác thực khách hàng
-       - Tuân thủ quy trình bảo mật
-       - Không yêu cầu thông tin nhạy cảm
-    4. Giải quyết vấn đề  
-       - Nắm bắt nhu cầu chính xác
-       - Đưa giải pháp phù hợp
-       - Cam kết thời gian xử lý   
-    5. Kết thúc cuộc gọi
-       - Tóm tắt nội dung chính
-       - Hỏi nhu cầu hỗ trợ thêm
-       - Cảm ơn và chào tạm biệt
-    6. Bảo mật thông tin
-       - Không tiết lộ thông tin nội bộ
-       - Bảo vệ thông tin khách hàng
-    """
+import time
+import hashlib
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import runtime
+from tolerant_json import repair_json, extract_json
+from instrumentation import stage_timer, emit_metric, record_payload, log_sampled
+from transcript_window import (
+    MAP_REDUCE_TOKENS, EMOTION_TOKENS, clean_conversation, estimate_tokens, window_conversation,
+    split_chunks, format_turns, merge_chunk_results
+)
+from compliance_rules import get_rule_set, render_prompt
+from prescreen import (
+    prescreen, prescreen_stats, get_skip_case, format_findings, build_skip_result, detect_agent_speaker
+)
 
-def create_analysis_prompt(conversation):
-    """Tạo prompt cho việc phân tích cuộc hội thoại"""
-    rules = get_compliance_rules()
-    return f"""
-    Analyze the following conversation based on these banking customer service guidelines:
+KNOWLEDGE_BASE_ID = 'XB9EB0ZA2G'
+MODEL_ARN = 'arn:aws:bedrock:us-west-2::foundation-model/anthropic.claude-3-sonnet-20240229-v1:0'
 
-    Conversation:
-    {conversation}
+# Cache kết quả phân tích: LRU trong container + bảng DynamoDB có TTL
+CACHE_TABLE_NAME = 'analysis-cache'
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+MEMORY_CACHE_SIZE = 256
+# Trường mà prompt yêu cầu model trả về; thiếu trường nào thì kết quả không được cache
+ANALYSIS_FIELDS = ('compliance_score', 'violations', 'recommendations', 'detailed_analysis',
+                   'customer_emotion', 'emotion_details')
+memory_cache = OrderedDict()
+cache_stats = {'memory_hits': 0, 'table_hits': 0, 'misses': 0}
+cache_lock = threading.Lock()
+
+# Batch mode: số request Bedrock song song và số kết quả mỗi file JSON Lines
+BATCH_MAX_WORKERS = 8
+BATCH_PART_SIZE = 100
+# Số item mỗi lần invoke của batch (bội số của BATCH_PART_SIZE): vài giây mỗi item với BATCH_MAX_WORKERS
+# luồng, mỗi invoke phải xong trong timeout 15 phút của Lambda. Invoke sau tiếp tục từ offset kế tiếp
+BATCH_CHUNK_SIZE = 400
+# Số chunk của một hội thoại dài được phân tích song song
+MAX_CHUNK_WORKERS = 4
+# Batch chạy pool chunk lồng trong pool item (tối đa 8 x 4 luồng): giới hạn số request Bedrock
+# đồng thời bằng đúng số connection của client để các luồng không phải chờ connection pool
+BEDROCK_MAX_CONCURRENCY = BATCH_MAX_WORKERS
+bedrock_slots = threading.BoundedSemaphore(BEDROCK_MAX_CONCURRENCY)
+
+# Client dùng chung giữa các lần invoke trên cùng container (warm start)
+client_bedrock_knowledgebase = None
+cache_table = None
+s3_client = None
+lambda_client = None
+
+def get_bedrock_client():
+    """Khởi tạo bedrock-agent-runtime client một lần cho mỗi container"""
+    global client_bedrock_knowledgebase
+    if client_bedrock_knowledgebase is None:
+        client_bedrock_knowledgebase = runtime.client(
+            'bedrock-agent-runtime',
+            region_name='us-west-2',
+            # Adaptive retry tự giảm tốc độ gửi khi Bedrock trả ThrottlingException
+            config={
+                'retries': {'max_attempts': 8, 'mode': 'adaptive'},
+                'max_pool_connections': BEDROCK_MAX_CONCURRENCY
+            }
+        )
+    return client_bedrock_knowledgebase
+
+def get_s3_client():
+    """Khởi tạo S3 client một lần cho mỗi container"""
+    global s3_client
+    if s3_client is None:
+        s3_client = runtime.client('s3')
+    return s3_client
+
+def get_lambda_client():
+    """Khởi tạo Lambda client (invoke batch bất đồng bộ) một lần cho mỗi container"""
+    global lambda_client
+    if lambda_client is None:
+        lambda_client = runtime.client('lambda')
+    return lambda_client
+
+def get_cache_table():
+    """Khởi tạo bảng cache một lần cho mỗi container"""
+    global cache_table
+    if cache_table is None:
+        cache_table = runtime.table(CACHE_TABLE_NAME, region_name='us-west-2')
+    return cache_table
+
+def get_cache_key(analysis_prompt):
+    """Hash của prompt phân tích cùng model và knowledge base"""
+    content = f"{MODEL_ARN}\n{KNOWLEDGE_BASE_ID}\n{analysis_prompt}"
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def remember_result(cache_key, response_text):
+    """Lưu kết quả vào LRU trong container"""
+    with cache_lock:
+        memory_cache[cache_key] = response_text
+        memory_cache.move_to_end(cache_key)
+        while len(memory_cache) > MEMORY_CACHE_SIZE:
+            memory_cache.popitem(last=False)
+
+def count_cache(stat):
+    with cache_lock:
+        cache_stats[stat] += 1
+
+def is_valid_analysis(response_text):
+    """Output parse được thành JSON đúng schema của prompt (đủ trường, điểm là số 0-10)"""
+    try:
+        _, data = extract_json(response_text)
+        score = float(data['compliance_score'])
+    except (ValueError, TypeError, KeyError):
+        return False
+    return (all(field in data for field in ANALYSIS_FIELDS) and 0 <= score <= 10
+            and isinstance(data['violations'], list) and isinstance(data['recommendations'], list))
+
+def get_cached_result(cache_key):
+    """Tìm kết quả đã phân tích, trả về None nếu chưa có"""
+    with cache_lock:
+        if cache_key in memory_cache:
+            memory_cache.move_to_end(cache_key)
+            cache_stats['memory_hits'] += 1
+            return memory_cache[cache_key]
     
-    Provide analysis in the following JSON format ONLY:
-    {{
-        "compliance_score": <score from 1-10>,
-        "violations": [<list of specific violations>],
-        "recommendations": [<list of specific improvements>],
-        "detailed_analysis": "<brief analysis>",
-        "customer_emotion": "<Tích cực/Trung tính/Tiêu cực>",
-        "emotion_details": "<brief emotion analysis>"
-    }}
+    try:
+        item = get_cache_table().get_item(Key={'CacheKey': cache_key}).get('Item')
+    except Exception as e:
+        # Cache lỗi thì vẫn gọi model bình thường
+        print(f"Cache read error: {str(e)}")
+        item = None
+    
+    # DynamoDB xóa item hết hạn không tức thời nên kiểm tra lại ExpiresAt;
+    # kết quả lỗi được cache trước khi có kiểm tra schema thì coi như chưa có
+    if item and int(item['ExpiresAt']) > time.time() and is_valid_analysis(item['Result']):
+        count_cache('table_hits')
+        remember_result(cache_key, item['Result'])
+        return item['Result']
     
-    Requirements:
-    - compliance_score must be a number between 1 and 10
-    - All fields must be present
-    - Response must be valid JSON, chú ý'{{', '}}'
-    - Keep analysis concise and specific
-    - Focus on compliance with banking regulations
+    count_cache('misses')
+    return None
+
+def put_cached_result(cache_key, response_text):
+    """Lưu kết quả vào cả hai tầng cache"""
+    remember_result(cache_key, response_text)
+    try:
+        get_cache_table().put_item(Item={
+            'CacheKey': cache_key,
+            'Result': response_text,
+            'ExpiresAt': int(time.time()) + CACHE_TTL_SECONDS
+        })
+    except Exception as e:
+        print(f"Cache write error: {str(e)}")
+
+def create_analysis_prompt(conversation, part=None, screen=None, customer_turns=None, rule_set=None):
+    """
+    Tạo prompt cho việc phân tích cuộc hội thoại từ template đã biên dịch của rule set
+    (part = (thứ tự, tổng số) khi phân tích theo chunk, screen = kết quả pre-screen,
+    customer_turns = lời khách hàng khi conversation chỉ gồm lời nhân viên)
     """
+    rule_set = rule_set or get_rule_set()
+    part_note = ""
+    if part:
+        part_note = (f"This is part {part[0]} of {part[1]} of a long conversation. "
+                     "Only judge the guidelines that apply to this part.")
+    findings = format_findings(screen) if screen else ""
+    if customer_turns is None:
+        conversation_section = f"""Conversation:
+    {conversation}"""
+    else:
+        conversation_section = f"""Agent turns (judge compliance only on these; each turn starts with its [mm:ss] timestamp):
+    {conversation}
+
+    Customer turns (judge customer emotion only on these):
+    {customer_turns}
 
-def fix_json_response(response_text):
+    Start each violation with the [mm:ss] timestamp of the agent turn where it happens."""
+    return render_prompt(rule_set, part_note, findings, conversation_section)
+
+def build_analysis_prompts(cleaned_prompt, screen=None, segments=None, rule_set=None):
     """
-    Kiểm tra và thêm dấu } nếu thiếu ở cuối JSON response
+    Tạo prompt phân tích cho hội thoại đã làm sạch. Hội thoại vừa ngân sách token được
+    rút gọn thành một prompt, hội thoại rất dài được chia thành nhiều prompt theo chunk.
+    Có segments (speaker label) thì chỉ gửi lời nhân viên để chấm compliance và
+    lời khách hàng (rút gọn hơn) để đánh giá cảm xúc
     """
-    # Loại bỏ khoảng trắng ở đầu và cuối
-    response_text = response_text.strip()
+    conversation = cleaned_prompt
+    customer_turns = None
+    if segments:
+        agent_speaker = detect_agent_speaker(segments)
+        conversation = clean_conversation(format_turns(
+            [segment for segment in segments if segment['speaker'] == agent_speaker]
+        ))
+        customer_turns = window_conversation(clean_conversation(format_turns(
+            [segment for segment in segments if segment['speaker'] != agent_speaker]
+        )), EMOTION_TOKENS)
+    
+    if estimate_tokens(conversation) <= MAP_REDUCE_TOKENS:
+        return [create_analysis_prompt(window_conversation(conversation), screen=screen, customer_turns=customer_turns,
+                                       rule_set=rule_set)]
+    
+    # Cảm xúc được lấy theo chunk cuối nên chỉ chunk cuối cần lời khách hàng
+    chunks = split_chunks(conversation)
+    return [
+        create_analysis_prompt(
+            chunk,
+            part=(i + 1, len(chunks)),
+            screen=screen,
+            customer_turns=customer_turns if i == len(chunks) - 1 else None,
+            rule_set=rule_set
+        )
+        for i, chunk in enumerate(chunks)
+    ]
+
+def generate_analysis(analysis_prompt):
+    """Gọi Bedrock cho một prompt (có cache), trả về text kết quả"""
+    # Log prompt đã xử lý theo tỷ lệ mẫu, luôn đo số token ước lượng
+    log_sampled('analysis_prompt', analysis_prompt)
+    emit_metric('PromptTokens', estimate_tokens(analysis_prompt), 'Count', 'BedrockCall')
+
+    # Cuộc hội thoại đã được phân tích thì trả kết quả cũ, không gọi lại model
+    cache_key = get_cache_key(analysis_prompt)
+    response_text = get_cached_result(cache_key)
+    emit_metric('CacheMiss' if response_text is None else 'CacheHit', 1, 'Count', 'BedrockCall')
     
-    # Đếm số dấu { và }
-    open_braces = response_text.count('{')
-    close_braces = response_text.count('}')
+    if response_text is None:
+        # Gọi Bedrock API
+        with bedrock_slots, stage_timer('BedrockCall'):
+            response = get_bedrock_client().retrieve_and_generate(
+                input={
+                    'text': analysis_prompt
+                },
+                retrieveAndGenerateConfiguration={
+                    'type': 'KNOWLEDGE_BASE',
+                    'knowledgeBaseConfiguration': {
+                        'knowledgeBaseId': KNOWLEDGE_BASE_ID,
+                        'modelArn': MODEL_ARN
+                    }
+                }
+            )
+        
+        # Lấy response, đo token ước lượng của output
+        response_text = response['output']['text']
+        emit_metric('OutputTokens', estimate_tokens(response_text), 'Count', 'BedrockCall')
+        # Đóng JSON response nếu bị cắt giữa chừng
+        with stage_timer('JsonRepair'):
+            response_text = repair_json(response_text)
+        log_sampled('model_response', response_text)
+        # Output hỏng không được cache để lần retry gọi lại model
+        if is_valid_analysis(response_text):
+            put_cached_result(cache_key, response_text)
+        else:
+            emit_metric('InvalidModelOutput', 1, 'Count', 'BedrockCall')
     
-    # Nếu thiếu dấu }, thêm vào
-    if open_braces > close_braces:
-        missing_braces = open_braces - close_braces
-        response_text += '}' * missing_braces
+    return response_text
+
+def analyze_conversation(user_prompt, generate=generate_analysis, segments=None, rule_set=None):
+    """
+    Phân tích một cuộc hội thoại: pre-screen theo từ khóa, bỏ qua model với các trường hợp
+    rõ ràng, gộp kết quả các chunk nếu hội thoại rất dài. generate nhận prompt, trả về text;
+    segments là các đoạn theo người nói [{'speaker', 'start', 'end', 'text'}] nếu có;
+    rule_set cố định version quy định cho cả cuộc gọi (mặc định version hiện tại)
+    """
+    rule_set = rule_set or get_rule_set()
+    cleaned_prompt = clean_conversation(user_prompt)
+    agent_text = None
+    if segments:
+        agent_speaker = detect_agent_speaker(segments)
+        agent_text = clean_conversation(' '.join(
+            segment['text'] for segment in segments if segment['speaker'] == agent_speaker
+        ))
+    screen = prescreen(cleaned_prompt, agent_text)
+    skip_case = get_skip_case(screen)
+    if skip_case:
+        response_text = build_skip_result(screen, skip_case)
+    else:
+        analysis_prompts = build_analysis_prompts(cleaned_prompt, screen, segments, rule_set)
+        if len(analysis_prompts) == 1:
+            response_text = generate(analysis_prompts[0])
+        else:
+            print(f"Long conversation split into {len(analysis_prompts)} chunks")
+            with ThreadPoolExecutor(max_workers=min(MAX_CHUNK_WORKERS, len(analysis_prompts))) as executor:
+                response_text = merge_chunk_results(list(executor.map(generate, analysis_prompts)))
     
+    calls = prescreen_stats['calls']
+    print(f"Pre-screen: {screen['elapsed_ms']}ms, skip case: {skip_case}, "
+          f"avg {prescreen_stats['total_ms'] / calls:.3f}ms, "
+          f"model avoided {prescreen_stats['model_skipped']}/{calls}")
     return response_text
 
+def parse_s3_uri(uri):
+    """Tách s3://bucket/key thành (bucket, key)"""
+    parsed = urlparse(uri)
+    if parsed.scheme != 's3' or not parsed.netloc:
+        raise ValueError(f"Invalid S3 URI: {uri}")
+    return parsed.netloc, parsed.path.lstrip('/')
+
+def validate_batch_items(items):
+    for item in items:
+        if not item.get('contactId') or not item.get('transcript'):
+            raise ValueError('Each batch item needs contactId and transcript')
+    return items
+
+def load_batch_items(body):
+    """Danh sách {contactId, transcript} từ body hoặc từ manifest JSON Lines trên S3"""
+    if body.get('manifest'):
+        bucket, key = parse_s3_uri(body['manifest'])
+        manifest = get_s3_client().get_object(Bucket=bucket, Key=key)['Body']
+        return validate_batch_items([json.loads(line) for line in manifest.iter_lines() if line.strip()])
+    return validate_batch_items(body['items'])
+
+def get_job_location(body):
+    """(bucket, prefix, jobId) nơi ghi kết quả của batch"""
+    if not body.get('output'):
+        raise ValueError('No output S3 URI provided for batch')
+    output_bucket, output_prefix = parse_s3_uri(body['output'])
+    job_id = body.get('jobId') or str(uuid.uuid4())
+    return output_bucket, f"{output_prefix.rstrip('/')}/{job_id}".lstrip('/'), job_id
+
+def invoke_batch_chunk(job, offset):
+    """Chạy chunk bắt đầu từ offset trong một invoke bất đồng bộ của chính Lambda này"""
+    get_lambda_client().invoke(
+        FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'],
+        InvocationType='Event',
+        Payload=json.dumps({'batchJob': job, 'offset': offset}).encode('utf-8')
+    )
+
+def start_batch(body):
+    """
+    Batch gửi qua API Gateway (timeout 29 giây) không chạy trong request: danh sách item gửi trực tiếp
+    được lưu thành manifest trên S3, Lambda tự invoke chính nó bất đồng bộ (InvocationType='Event')
+    cho chunk đầu và trả jobId ngay. Kết quả và summary.json được ghi dưới output/jobId
+    """
+    output_bucket, job_prefix, job_id = get_job_location(body)
+    job = {'jobId': job_id, 'output': body['output'], 'startedAt': time.time()}
+    if body.get('manifest'):
+        parse_s3_uri(body['manifest'])
+        job['manifest'] = body['manifest']
+    else:
+        # Payload của invoke bất đồng bộ có giới hạn kích thước, manifest thì không
+        items = validate_batch_items(body['items'])
+        manifest_key = f"{job_prefix}/input.jsonl"
+        get_s3_client().put_object(
+            Bucket=output_bucket,
+            Key=manifest_key,
+            Body=('\n'.join(json.dumps(item, ensure_ascii=False) for item in items) + '\n').encode('utf-8'),
+            ContentType='application/x-ndjson'
+        )
+        job['manifest'] = f"s3://{output_bucket}/{manifest_key}"
+    
+    invoke_batch_chunk(job, 0)
+    print(f"Batch {job_id} started from {job['manifest']}")
+    return {
+        'jobId': job_id,
+        'status': 'STARTED',
+        'summary': f"s3://{output_bucket}/{job_prefix}/summary.json"
+    }
+
+def analyze_batch_item(item):
+    """Phân tích một item của batch, lỗi được ghi vào kết quả thay vì raise"""
+    try:
+        rule_set = get_rule_set()
+        result = analyze_conversation(item['transcript'], segments=item.get('segments'), rule_set=rule_set)
+        return {'contactId': item['contactId'], 'result': result, 'ruleVersion': rule_set['version']}
+    except Exception as e:
+        print(f"Error analyzing {item['contactId']}: {str(e)}")
+        return {'contactId': item['contactId'], 'error': str(e)}
+
+def list_job_objects(output_bucket, prefix):
+    """Key của các object dưới prefix"""
+    kwargs = {'Bucket': output_bucket, 'Prefix': prefix}
+    keys = []
+    while True:
+        response = get_s3_client().list_objects_v2(**kwargs)
+        keys.extend(item['Key'] for item in response.get('Contents', []))
+        if not response.get('IsTruncated'):
+            return keys
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+def read_json_lines(output_bucket, key):
+    body = get_s3_client().get_object(Bucket=output_bucket, Key=key)['Body'].read().decode('utf-8')
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+def put_json(output_bucket, key, lines, content_type='application/x-ndjson'):
+    get_s3_client().put_object(
+        Bucket=output_bucket,
+        Key=key,
+        Body=('\n'.join(lines) + '\n').encode('utf-8'),
+        ContentType=content_type
+    )
+
+def run_batch(job, offset=0):
+    """
+    Phân tích chunk [offset, offset + BATCH_CHUNK_SIZE) của batch song song (tối đa BATCH_MAX_WORKERS
+    request Bedrock), ghi kết quả ra S3 dạng JSON Lines theo từng part BATCH_PART_SIZE item (part-<offset>)
+    và chunk-<offset>.json, rồi invoke chunk kế tiếp. Chunk cuối ghi summary.json của cả batch.
+    Invoke bị Lambda retry (timeout, lỗi) bỏ qua các part đã ghi; chunk đã có chunk-<offset>.json thì không chạy lại
+    """
+    output_bucket, job_prefix, job_id = get_job_location(job)
+    if not isinstance(offset, int) or offset < 0 or offset % BATCH_CHUNK_SIZE:
+        raise ValueError(f"Invalid batch offset: {offset}")
+    items = load_batch_items(job)
+    chunk_end = min(offset + BATCH_CHUNK_SIZE, len(items))
+    chunk_key = f"{job_prefix}/chunk-{offset:07d}.json"
+    existing = set(list_job_objects(output_bucket, f"{job_prefix}/"))
+    if chunk_key in existing:
+        print(f"Batch {job_id} chunk {offset} already finished")
+        return None
+    
+    started_at = time.time()
+    cache_before = dict(cache_stats)
+    chunk = {'offset': offset, 'items': chunk_end - offset, 'analysed': 0, 'failed': 0, 'parts': []}
+    # executor.map giữ thứ tự item, mỗi part được ghi ra S3 ngay khi xong
+    with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+        for part_start in range(offset, chunk_end, BATCH_PART_SIZE):
+            part_key = f"{job_prefix}/part-{part_start:07d}.jsonl"
+            if part_key in existing:
+                results = read_json_lines(output_bucket, part_key)
+            else:
+                results = list(executor.map(analyze_batch_item, items[part_start:part_start + BATCH_PART_SIZE]))
+                put_json(output_bucket, part_key, [json.dumps(result, ensure_ascii=False) for result in results])
+                chunk['analysed'] += len(results)
+            chunk['failed'] += sum(1 for result in results if 'error' in result)
+            chunk['parts'].append(part_key)
+    chunk['elapsedSeconds'] = round(time.time() - started_at, 3)
+    # Bộ đếm cache là của container (dùng lại giữa các invoke), chỉ lấy phần của chunk này
+    chunk['cacheStats'] = {stat: value - cache_before[stat] for stat, value in cache_stats.items()}
+    
+    # Invoke chunk kế tiếp trước khi ghi chunk-<offset>.json: retry sau khi đã ghi thì không invoke lại
+    if chunk_end < len(items):
+        invoke_batch_chunk(job, chunk_end)
+    put_json(output_bucket, chunk_key, [json.dumps(chunk)], 'application/json')
+    print(f"Batch {job_id} chunk: {json.dumps(chunk)}")
+    if chunk_end < len(items):
+        return chunk
+    return write_batch_summary(job, output_bucket, job_prefix, len(items))
+
+def write_batch_summary(job, output_bucket, job_prefix, total):
+    """summary.json của cả batch từ các chunk-<offset>.json (để client biết batch đã xong)"""
+    chunks = [
+        json.loads(get_s3_client().get_object(Bucket=output_bucket, Key=key)['Body'].read())
+        for key in sorted(list_job_objects(output_bucket, f"{job_prefix}/chunk-"))
+    ]
+    elapsed = time.time() - job.get('startedAt', time.time())
+    processing = sum(chunk['elapsedSeconds'] for chunk in chunks)
+    cache_totals = {}
+    for chunk in chunks:
+        for stat, value in chunk['cacheStats'].items():
+            cache_totals[stat] = cache_totals.get(stat, 0) + value
+    summary = {
+        'jobId': job['jobId'],
+        'total': total,
+        'failed': sum(chunk['failed'] for chunk in chunks),
+        'chunks': len(chunks),
+        'parts': [f"s3://{output_bucket}/{key}" for chunk in chunks for key in chunk['parts']],
+        'elapsedSeconds': round(elapsed, 3),
+        'processingSeconds': round(processing, 3),
+        'itemsPerSecond': round(total / processing, 3) if processing else None,
+        'cacheStats': cache_totals
+    }
+    put_json(output_bucket, f"{job_prefix}/summary.json", [json.dumps(summary)], 'application/json')
+    print(f"Batch summary: {json.dumps(summary)}")
+    return summary
+
 def lambda_handler(event, context):
     """AWS Lambda handler function"""
-    client_bedrock_knowledgebase = boto3.client(
-        'bedrock-agent-runtime',
-        region_name='us-west-2'
-    )
+    # Batch đã được start_batch nhận, chạy trong invoke bất đồng bộ (không qua API Gateway)
+    if event.get('batchJob'):
+        return run_batch(event['batchJob'], event.get('offset', 0))
     
     try:
         # Xử lý input
         body = json.loads(event['body']) if isinstance(event.get('body'), str) else event.get('body', {})
+        
+        # Batch mode: danh sách item hoặc manifest trên S3, trả jobId ngay
+        if body.get('items') or body.get('manifest'):
+            return {
+                'statusCode': 202,
+                'body': json.dumps(start_batch(body)),
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                }
+            }
+        
         user_prompt = body.get('prompt')
         
         if not user_prompt:
@@ -110,43 +495,18 @@ def lambda_handler(event, context):
                 }
             }
 
-        # Log input để debug
-        print(f"Original prompt: {user_prompt}")
+        # Kích thước input, nội dung chỉ log theo tỷ lệ mẫu
+        record_payload('Request', user_prompt)
 
-        # Làm sạch và rút gọn input
-        cleaned_prompt = clean_conversation(user_prompt)
-        truncated_prompt = truncate_text(cleaned_prompt)
-        
-        # Tạo prompt phân tích
-        analysis_prompt = create_analysis_prompt(truncated_prompt)
-        
-        # Log prompt đã xử lý để debug
-        print(f"Processed prompt: {analysis_prompt}")
-
-        # Gọi Bedrock API
-        response = client_bedrock_knowledgebase.retrieve_and_generate(
-            input={
-                'text': analysis_prompt
-            },
-            retrieveAndGenerateConfiguration={
-                'type': 'KNOWLEDGE_BASE',
-                'knowledgeBaseConfiguration': {
-                    'knowledgeBaseId': 'XB9EB0ZA2G',
-                    'modelArn': 'arn:aws:bedrock:us-west-2::foundation-model/anthropic.claude-3-sonnet-20240229-v1:0'
-                }
-            }
-        )
-        
-        # Lấy và log response để debug
-        response_text = response['output']['text']
-        # Fix JSON response nếu thiếu dấu }
-        response_text = fix_json_response(response_text)
-        print(f"Fixed API response: {response_text}")
+        rule_set = get_rule_set()
+        response_text = analyze_conversation(user_prompt, segments=body.get('segments'), rule_set=rule_set)
 
         return {
             'statusCode': 200,
             'body': json.dumps({
-                'result': response_text
+                'result': response_text,
+                # Version quy định dùng để chấm, được lưu cùng kết quả
+                'ruleVersion': rule_set['version']
             }),
             'headers': {
                 'Content-Type': 'application/json',
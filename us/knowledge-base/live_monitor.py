@@ -0,0 +1,166 @@
+"""
+Theo dõi compliance trong lúc gọi: nhận từng đoạn transcript (partial/final) của
+luồng media, chạy pre-screen trên cửa sổ trượt và phát cảnh báo theo ContactId.
+
+Chạy thử với luồng giả lập từ file JSON Lines, mỗi dòng một sự kiện:
+    {"contactId": "...", "text": "...", "start": 1.2, "end": 3.4, "isPartial": false, "role": "AGENT"}
+
+role là ParticipantRole của Contact Lens (AGENT / CUSTOMER); yêu cầu OTP / mật khẩu chỉ được
+tính trong lời nhân viên và phải là lời yêu cầu (như pre-screen: "đọc", "cung cấp", "cho em xin"...),
+nhân viên dặn dò / cảnh báo về OTP hay đoạn không có role không gây cảnh báo sensitive_request.
+
+    python live_monitor.py events.jsonl --realtime
+"""
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from transcript_window import clean_conversation
+from prescreen import RULE_NUMBERS, find_hits, find_sensitive_requests
+
+# Chỉ quét lời nói trong khoảng thời gian gần nhất (giây)
+WINDOW_SECONDS = 60
+# Sau mốc này mà chưa chào hỏi / xưng danh thì cảnh báo
+OPENING_SECONDS = 30
+AGENT_ROLE = 'AGENT'
+# Điểm trừ cho từng loại vi phạm, điểm tạm thời = 10 - tổng điểm trừ
+LIVE_PENALTIES = {
+    'sensitive_request': 5,
+    'missing_greeting': 2,
+    'missing_self_introduction': 1
+}
+ALERT_MESSAGES = {
+    'sensitive_request': 'Agent asked the customer for OTP/PIN/password',
+    'missing_greeting': 'No greeting at the start of the call',
+    'missing_self_introduction': 'Agent has not introduced themselves'
+}
+
+def print_alert(alert):
+    print(json.dumps(alert, ensure_ascii=False))
+
+class LiveMonitor:
+    """Trạng thái theo từng ContactId, mỗi sự kiện chỉ quét cửa sổ WINDOW_SECONDS gần nhất"""
+
+    def __init__(self, on_alert=print_alert, window_seconds=WINDOW_SECONDS):
+        self.on_alert = on_alert
+        self.window_seconds = window_seconds
+        self.calls = {}
+        self.latencies_ms = []
+
+    def get_state(self, contact_id):
+        if contact_id not in self.calls:
+            self.calls[contact_id] = {
+                'window': deque(),
+                'seen': set(),
+                'alerted': set(),
+                'score': 10
+            }
+        return self.calls[contact_id]
+
+    def alert(self, contact_id, state, violation, call_time, started_at):
+        """Phát cảnh báo một lần cho mỗi loại vi phạm của cuộc gọi"""
+        if violation in state['alerted']:
+            return None
+        state['alerted'].add(violation)
+        state['score'] = max(1, state['score'] - LIVE_PENALTIES[violation])
+        rule = violation.replace('missing_', '')
+        alert = {
+            'contactId': contact_id,
+            'violation': violation,
+            'rule': RULE_NUMBERS[rule],
+            'message': ALERT_MESSAGES[violation],
+            'callTime': call_time,
+            'score': state['score'],
+            'latencyMs': round((time.perf_counter() - started_at) * 1000, 3)
+        }
+        self.on_alert(alert)
+        return alert
+
+    def process(self, event):
+        """Xử lý một đoạn transcript, trả về các cảnh báo mới"""
+        started_at = time.perf_counter()
+        contact_id = event['contactId']
+        state = self.get_state(contact_id)
+        text = clean_conversation(event['text']).strip()
+        call_time = float(event.get('end', 0))
+        is_agent = event.get('role') == AGENT_ROLE
+        
+        # Đoạn final được giữ trong cửa sổ, partial chỉ dùng cho lần quét này
+        window = state['window']
+        if not event.get('isPartial'):
+            window.append((call_time, text, is_agent))
+        while window and window[0][0] < call_time - self.window_seconds:
+            window.popleft()
+        segments = list(window)
+        if event.get('isPartial'):
+            segments.append((call_time, text, is_agent))
+        window_text = ' '.join(segment_text for _, segment_text, _ in segments)
+        # Mỗi đoạn là một vế câu riêng khi tìm lời yêu cầu
+        agent_text = '\n'.join(segment_text for _, segment_text, agent in segments if agent)
+        
+        for label, _, _, negated in find_hits(window_text):
+            if not negated and label != 'sensitive_request':
+                state['seen'].add(label)
+        # Khách hàng tự nhắc tới OTP / mật khẩu, nhân viên dặn dò / cảnh báo không phải vi phạm
+        if find_sensitive_requests(agent_text):
+            state['seen'].add('sensitive_request')
+        
+        alerts = []
+        if 'sensitive_request' in state['seen']:
+            alerts.append(self.alert(contact_id, state, 'sensitive_request', call_time, started_at))
+        if call_time >= OPENING_SECONDS:
+            for label in ('greeting', 'self_introduction'):
+                if label not in state['seen']:
+                    alerts.append(self.alert(contact_id, state, f"missing_{label}", call_time, started_at))
+        
+        self.latencies_ms.append((time.perf_counter() - started_at) * 1000)
+        return [alert for alert in alerts if alert]
+
+    def end_call(self, contact_id):
+        """Kết thúc cuộc gọi, trả về điểm tạm thời và các vi phạm đã cảnh báo"""
+        state = self.calls.pop(contact_id, None)
+        if state is None:
+            return None
+        return {
+            'contactId': contact_id,
+            'score': state['score'],
+            'violations': sorted(state['alerted'])
+        }
+
+def replay_events(path, realtime=False):
+    """Luồng giả lập: đọc sự kiện từ file, realtime=True thì chờ đúng theo mốc thời gian"""
+    started_at = time.time()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if realtime:
+                delay = float(event.get('end', 0)) - (time.time() - started_at)
+                if delay > 0:
+                    time.sleep(delay)
+            yield event
+
+def percentile(values, ratio):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * ratio), len(ordered) - 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay transcript chunks through the in-call compliance monitor')
+    parser.add_argument('events', help='JSON Lines file of transcript chunks')
+    parser.add_argument('--realtime', action='store_true', help='replay chunks at their call timestamps')
+    args = parser.parse_args()
+    
+    monitor = LiveMonitor()
+    for event in replay_events(args.events, args.realtime):
+        monitor.process(event)
+    
+    for contact_id in list(monitor.calls):
+        print(json.dumps(monitor.end_call(contact_id), ensure_ascii=False))
+    if monitor.latencies_ms:
+        print(f"{len(monitor.latencies_ms)} chunks, latency p50 {percentile(monitor.latencies_ms, 0.5):.3f}ms, "
+              f"p99 {percentile(monitor.latencies_ms, 0.99):.3f}ms", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import time
+from collections import deque
+
+# Từ khóa cho các quy định phát hiện được bằng so khớp (chữ thường, giữ dấu)
+PRESCREEN_RULES = {
+    'greeting': [
+        'xin chào', 'kính chào', 'chào anh', 'chào chị', 'chào quý khách', 'alo chào'
+    ],
+    'self_introduction': [
+        'tôi là', 'em là', 'tôi tên', 'em tên', 'mình tên', 'nhân viên', 'tổng đài viên', 'chuyên viên'
+    ],
+    'sensitive_request': [
+        'mã otp', 'otp', 'mật khẩu', 'mã pin', 'số pin', 'mã cvv', 'cvv', 'mã bảo mật'
+    ],
+    'offer_more_help': [
+        'hỗ trợ gì thêm', 'cần hỗ trợ thêm', 'còn cần hỗ trợ', 'cần giúp gì thêm', 'thắc mắc gì thêm'
+    ],
+    'thank_you': [
+        'cảm ơn', 'cám ơn'
+    ],
+    'goodbye': [
+        'tạm biệt', 'hẹn gặp lại', 'chúc anh', 'chúc chị', 'chúc quý khách'
+    ]
+}
+# Quy định tương ứng trong compliance_rules.json
+RULE_NUMBERS = {
+    'greeting': 1, 'self_introduction': 1, 'sensitive_request': 3,
+    'offer_more_help': 5, 'thank_you': 5, 'goodbye': 5
+}
+# Chào hỏi phải ở đầu cuộc gọi, cảm ơn/chào tạm biệt ở cuối (tỷ lệ theo độ dài)
+OPENING_RATIO = 0.2
+CLOSING_RATIO = 0.8
+# Từ khóa chỉ nhân viên nói, dùng để nhận biết người nói là nhân viên
+AGENT_LABELS = ('greeting', 'self_introduction', 'offer_more_help')
+# Các từ phủ định ngay trước từ khóa nhạy cảm: nhân viên đang nhắc khách không cung cấp
+NEGATION_WORDS = ['không', 'đừng', 'chớ', 'tuyệt đối không']
+NEGATION_WINDOW = 25
+# Lời yêu cầu: động từ yêu cầu đứng trước từ khóa nhạy cảm, cách tối đa REQUEST_WINDOW_WORDS từ.
+# Chỉ nhắc tới OTP / mật khẩu (dặn dò, cảnh báo) thì chỉ là gợi ý cho model
+REQUEST_VERBS = [
+    'đọc', 'cung cấp', 'cho em xin', 'cho em biết', 'cho tôi xin', 'cho tôi biết', 'cho mình xin', 'cho mình biết'
+]
+REQUEST_WINDOW_WORDS = 3
+REQUEST_PATTERN = re.compile(
+    r'(?<!\w)(?:' + '|'.join(map(re.escape, REQUEST_VERBS)) + r')(?:\W+\w+){0,%d}\W+$' % REQUEST_WINDOW_WORDS
+)
+# Ngữ cảnh cảnh báo trong cùng vế câu: nhân viên mô tả thủ đoạn lừa đảo, không phải đang yêu cầu
+WARNING_WORDS = ['kẻ gian', 'lừa đảo', 'giả mạo', 'mạo danh', 'có ai', 'ai đó', 'bất kỳ ai', 'bất cứ ai']
+CLAUSE_MARKS = '.,;:?!\n'
+
+# Các trường hợp chắc chắn được trả kết quả không cần gọi model,
+# ví dụ PRESCREEN_SKIP_MODEL_CASES=sensitive_request (phân cách bằng dấu phẩy)
+SKIP_MODEL_CASES = {case.strip() for case in os.environ.get('PRESCREEN_SKIP_MODEL_CASES', '').split(',') if case.strip()}
+SENSITIVE_REQUEST_SCORE = 2
+
+prescreen_stats = {'calls': 0, 'model_skipped': 0, 'total_ms': 0.0}
+
+class AhoCorasick:
+    """Automaton so khớp nhiều từ khóa trong một lần duyệt văn bản"""
+
+    def __init__(self, patterns):
+        # patterns: list (pattern, label)
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for pattern, label in patterns:
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.outputs[state].append((pattern, label))
+        
+        # Tính fail link theo BFS
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def iter_matches(self, text):
+        """Trả về (vị trí bắt đầu, pattern, label) của mọi lần khớp"""
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern, label in self.outputs[state]:
+                yield i - len(pattern) + 1, pattern, label
+
+# Automaton được build một lần cho mỗi container
+matcher = None
+
+def get_matcher():
+    global matcher
+    if matcher is None:
+        matcher = AhoCorasick([
+            (pattern, label) for label, patterns in PRESCREEN_RULES.items() for pattern in patterns
+        ])
+    return matcher
+
+def is_word_boundary(text, start, end):
+    before = text[start - 1] if start > 0 else ' '
+    after = text[end] if end < len(text) else ' '
+    return not before.isalnum() and not after.isalnum()
+
+def is_negated(text, start):
+    window = text[max(0, start - NEGATION_WINDOW):start]
+    return any(word in window for word in NEGATION_WORDS)
+
+def is_request_phrasing(lowered, start):
+    """Từ khóa nhạy cảm tại start nằm trong lời yêu cầu (không phủ định, không phải cảnh báo)"""
+    clause_start = max(lowered.rfind(mark, 0, start) for mark in CLAUSE_MARKS) + 1
+    before = lowered[clause_start:start]
+    if any(word in before for word in NEGATION_WORDS + WARNING_WORDS):
+        return False
+    return REQUEST_PATTERN.search(before) is not None
+
+def find_hits(text):
+    """Các từ khóa khớp trong văn bản: list (label, pattern, vị trí bắt đầu, negated)"""
+    lowered = text.lower()
+    hits = []
+    for start, pattern, label in get_matcher().iter_matches(lowered):
+        if not is_word_boundary(lowered, start, start + len(pattern)):
+            continue
+        negated = label == 'sensitive_request' and is_negated(lowered, start)
+        hits.append((label, pattern, start, negated))
+    return hits
+
+def find_sensitive_requests(text):
+    """Các lần yêu cầu thông tin nhạy cảm: list (pattern, vị trí bắt đầu)"""
+    lowered = text.lower()
+    return [
+        (pattern, start) for label, pattern, start, negated in find_hits(text)
+        if label == 'sensitive_request' and not negated and is_request_phrasing(lowered, start)
+    ]
+
+def prescreen(text, agent_text=None):
+    """
+    Quét hội thoại đã làm sạch, trả về các rule hit có cấu trúc. agent_text là lời nhân viên (khi có
+    speaker label): yêu cầu thông tin nhạy cảm chỉ được tìm trong lời nhân viên, vì khách hàng tự nhắc
+    tới OTP / mật khẩu không phải vi phạm
+    """
+    started_at = time.perf_counter()
+    hits = {label: [] for label in PRESCREEN_RULES}
+    
+    def add_hits(scanned, labels):
+        length = max(len(scanned), 1)
+        lowered = scanned.lower()
+        for label, pattern, start, negated in find_hits(scanned):
+            if label not in labels:
+                continue
+            hit = {'pattern': pattern, 'position': round(start / length, 3)}
+            if label == 'sensitive_request':
+                hit['negated'] = negated
+                hit['requested'] = not negated and is_request_phrasing(lowered, start)
+            hits[label].append(hit)
+    
+    if agent_text is None:
+        add_hits(text, PRESCREEN_RULES)
+    else:
+        add_hits(text, [label for label in PRESCREEN_RULES if label != 'sensitive_request'])
+        add_hits(agent_text, ['sensitive_request'])
+    
+    def found(label, predicate=lambda hit: True):
+        return any(predicate(hit) for hit in hits[label])
+    
+    findings = {
+        'greeting': found('greeting', lambda hit: hit['position'] <= OPENING_RATIO),
+        'self_introduction': found('self_introduction', lambda hit: hit['position'] <= OPENING_RATIO),
+        'sensitive_request': found('sensitive_request', lambda hit: hit['requested']),
+        'offer_more_help': found('offer_more_help'),
+        'thank_you': found('thank_you', lambda hit: hit['position'] >= CLOSING_RATIO),
+        'goodbye': found('goodbye', lambda hit: hit['position'] >= CLOSING_RATIO)
+    }
+    
+    elapsed_ms = (time.perf_counter() - started_at) * 1000
+    prescreen_stats['calls'] += 1
+    prescreen_stats['total_ms'] += elapsed_ms
+    return {
+        'hits': hits,
+        'findings': findings,
+        # Không biết người nói thì sensitive_request chỉ là gợi ý cho model, không được bỏ qua model
+        'speaker_attributed': agent_text is not None,
+        'elapsed_ms': round(elapsed_ms, 3)
+    }
+
+def detect_agent_speaker(segments):
+    """
+    Người nói là nhân viên: người có nhiều câu chào hỏi, xưng danh, hỏi hỗ trợ thêm nhất.
+    Không có từ khóa nào thì lấy người nói đầu tiên (nhân viên thường mở đầu cuộc gọi)
+    """
+    scores = {}
+    for segment in segments:
+        score = sum(1 for label, _, _, _ in find_hits(segment['text']) if label in AGENT_LABELS)
+        scores[segment['speaker']] = scores.get(segment['speaker'], 0) + score
+    
+    if not scores:
+        return None
+    # max giữ người nói xuất hiện trước khi bằng điểm
+    return max(scores, key=lambda speaker: scores[speaker])
+
+def get_skip_case(screen):
+    """Trường hợp rõ ràng (trong SKIP_MODEL_CASES) không cần gọi model, None nếu cần"""
+    if ('sensitive_request' in SKIP_MODEL_CASES and screen['findings']['sensitive_request']
+            and screen.get('speaker_attributed')):
+        return 'sensitive_request'
+    return None
+
+def format_findings(screen):
+    """Mô tả kết quả pre-screen để đưa vào prompt"""
+    labels = {
+        'greeting': 'Greeting at the start',
+        'self_introduction': 'Agent self-introduction at the start',
+        'sensitive_request': 'Agent asks for OTP/PIN/password',
+        'offer_more_help': 'Agent offers further help',
+        'thank_you': 'Thank-you at the end',
+        'goodbye': 'Goodbye at the end'
+    }
+    if not screen.get('speaker_attributed'):
+        labels['sensitive_request'] = 'OTP/PIN/password requested, speaker unknown'
+    lines = [
+        f"- {labels[label]} (rule {RULE_NUMBERS[label]}): {'yes' if value else 'no'}"
+        for label, value in screen['findings'].items()
+    ]
+    # Nhắc tới nhưng không có lời yêu cầu (dặn dò, cảnh báo): model tự đánh giá
+    if not screen['findings']['sensitive_request'] and any(
+            not hit['negated'] for hit in screen['hits']['sensitive_request']):
+        lines.append(f"- OTP/PIN/password mentioned without a request (rule {RULE_NUMBERS['sensitive_request']}): check the context")
+    return "Automated keyword pre-screen (verify against the conversation):\n    " + "\n    ".join(lines)
+
+def build_skip_result(screen, skip_case):
+    """Kết quả theo luật, cùng định dạng output của model"""
+    prescreen_stats['model_skipped'] += 1
+    patterns = sorted({hit['pattern'] for hit in screen['hits']['sensitive_request'] if hit['requested']})
+    analysis = {
+        'compliance_score': SENSITIVE_REQUEST_SCORE,
+        'violations': [f"Yêu cầu khách hàng cung cấp thông tin nhạy cảm ({', '.join(patterns)})"],
+        'recommendations': ['Không yêu cầu khách hàng cung cấp OTP, mã PIN hoặc mật khẩu'],
+        'detailed_analysis': f"Phát hiện tự động bởi pre-screen ({skip_case}), không gọi model.",
+        'customer_emotion': 'Trung tính',
+        'emotion_details': ''
+    }
+    return f"Kết quả pre-screen.\n{json.dumps(analysis, ensure_ascii=False)}"
@@ -0,0 +1,201 @@
+import re
+import json
+from tolerant_json import extract_json
+
+# Ngân sách token cho phần hội thoại trong một prompt
+MAX_CONVERSATION_TOKENS = 2000
+# Hội thoại dài hơn ngưỡng này được chia chunk và phân tích map-reduce
+MAP_REDUCE_TOKENS = 3 * MAX_CONVERSATION_TOKENS
+# Ngân sách token cho lời khách hàng (chỉ dùng đánh giá cảm xúc)
+EMOTION_TOKENS = 600
+# Tỷ lệ ngân sách cho phần đầu (chào hỏi, xưng danh) và phần cuối (tóm tắt, chào tạm biệt)
+HEAD_RATIO = 0.35
+TAIL_RATIO = 0.35
+
+GAP_MARKER = '...'
+TURN_PATTERN = re.compile(r'[^.!?…]+[.!?…]*')
+
+# Các câu ở giữa chứa từ khóa này được ưu tiên giữ lại
+SALIENT_KEYWORDS = [
+    'otp', 'mật khẩu', 'mã pin', 'pin', 'số tài khoản', 'số thẻ', 'cccd', 'căn cước',
+    'xác thực', 'xác minh', 'bảo mật', 'khiếu nại', 'phàn nàn', 'bức xúc', 'không hài lòng',
+    'cam kết', 'thời gian xử lý', 'giải quyết', 'hỗ trợ', 'lãi suất', 'phí', 'khoản vay'
+]
+
+def clean_conversation(text):
+    """Làm sạch và rút gọn cuộc hội thoại"""
+    # Loại bỏ các ký tự đặc biệt và khoảng trắng thừa
+    text = re.sub(r'\s+', ' ', text)
+    # Chỉ giữ lại các đoạn hội thoại chính
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text
+
+def token_weight(text):
+    """
+    Số token ước lượng (số thực) cho tiếng Việt: ký tự có dấu (ngoài ASCII) thường bị
+    tách thành token riêng nên được tính nặng hơn ký tự ASCII
+    """
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return (len(text) - non_ascii) / 3.5 + non_ascii * 0.8
+
+def estimate_tokens(text):
+    return int(token_weight(text)) + 1
+
+def split_long_turn(turn, max_tokens):
+    """
+    Chia một lượt nói dài hơn max_tokens theo từ (transcript không có dấu câu chỉ là một lượt),
+    từ dài hơn max_tokens (không có khoảng trắng) được cắt theo ký tự
+    """
+    pieces = []
+    current = []
+    weight = 0.0
+    for word in turn.split():
+        word_weight = token_weight(word) + 1 / 3.5
+        if word_weight > max_tokens - 1:
+            # Ký tự nặng nhất là 0.8 token
+            step = max(1, int((max_tokens - 1) / 0.8))
+            if current:
+                pieces.append(' '.join(current))
+                current, weight = [], 0.0
+            pieces.extend(word[i:i + step] for i in range(0, len(word), step))
+            continue
+        if current and weight + word_weight > max_tokens - 1:
+            pieces.append(' '.join(current))
+            current, weight = [], 0.0
+        current.append(word)
+        weight += word_weight
+    if current:
+        pieces.append(' '.join(current))
+    return pieces
+
+def split_turns(text, max_tokens=None):
+    """Tách hội thoại thành các câu/lượt nói theo dấu câu, có max_tokens thì chia nhỏ lượt nói quá dài"""
+    turns = [turn.strip() for turn in TURN_PATTERN.findall(text) if turn.strip()]
+    if max_tokens is None:
+        return turns
+    pieces = []
+    for turn in turns:
+        if estimate_tokens(turn) > max_tokens:
+            pieces.extend(split_long_turn(turn, max_tokens))
+        else:
+            pieces.append(turn)
+    return pieces
+
+def salience(turn):
+    lowered = turn.lower()
+    return sum(1 for keyword in SALIENT_KEYWORDS if keyword in lowered)
+
+def window_conversation(text, max_tokens=MAX_CONVERSATION_TOKENS):
+    """Giữ phần đầu, phần cuối và các lượt nói quan trọng ở giữa trong ngân sách token"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    
+    # Lượt nói lớn hơn ngân sách phần đầu sẽ không bao giờ được giữ, nên được chia nhỏ trước
+    head_budget = int(max_tokens * HEAD_RATIO)
+    turns = split_turns(text, head_budget)
+    costs = [estimate_tokens(turn) for turn in turns]
+    keep = [False] * len(turns)
+    
+    # Phần đầu
+    budget = head_budget
+    head_end = 0
+    while head_end < len(turns) and costs[head_end] <= budget:
+        budget -= costs[head_end]
+        keep[head_end] = True
+        head_end += 1
+    
+    # Phần cuối
+    budget = int(max_tokens * TAIL_RATIO)
+    tail_start = len(turns)
+    while tail_start > head_end and costs[tail_start - 1] <= budget:
+        budget -= costs[tail_start - 1]
+        tail_start -= 1
+        keep[tail_start] = True
+    
+    # Các lượt ở giữa: ưu tiên câu có nhiều từ khóa, giữ thứ tự gốc khi ghép lại
+    budget = max_tokens - sum(cost for cost, kept in zip(costs, keep) if kept)
+    middle = sorted(range(head_end, tail_start), key=lambda i: -salience(turns[i]))
+    for i in middle:
+        if salience(turns[i]) == 0:
+            break
+        if costs[i] <= budget:
+            budget -= costs[i]
+            keep[i] = True
+    
+    parts = []
+    for i, turn in enumerate(turns):
+        if keep[i]:
+            parts.append(turn)
+        elif parts and parts[-1] != GAP_MARKER:
+            parts.append(GAP_MARKER)
+    return ' '.join(parts)
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(float(seconds)), 60)
+    return f"[{minutes:02d}:{seconds:02d}]"
+
+def format_turns(segments):
+    """Ghép các đoạn hội thoại, mỗi đoạn bắt đầu bằng mốc thời gian [mm:ss]"""
+    return ' '.join(f"{format_timestamp(segment['start'])} {segment['text']}" for segment in segments)
+
+def split_chunks(text, max_tokens=MAX_CONVERSATION_TOKENS):
+    """Chia hội thoại dài thành các chunk liền nhau theo ranh giới câu"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for turn in split_turns(text, max_tokens):
+        cost = estimate_tokens(turn)
+        if current and current_tokens + cost > max_tokens:
+            chunks.append(' '.join(current))
+            current = []
+            current_tokens = 0
+        current.append(turn)
+        current_tokens += cost
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+def merge_chunk_results(response_texts):
+    """
+    Gộp kết quả phân tích của các chunk thành một kết quả cùng định dạng output của model:
+    điểm thấp nhất, gộp vi phạm/khuyến nghị, cảm xúc lấy theo chunk cuối
+    """
+    analyses = []
+    summaries = []
+    for response_text in response_texts:
+        try:
+            summary, data = extract_json(response_text)
+        except ValueError as e:
+            print(f"Skipping unparseable chunk result: {str(e)}")
+            continue
+        summaries.append(summary)
+        analyses.append(data)
+    
+    if not analyses:
+        raise ValueError('No chunk analysis could be parsed')
+    
+    def unique(field):
+        values = []
+        for data in analyses:
+            for value in data.get(field, []):
+                if value not in values:
+                    values.append(value)
+        return values
+    
+    scores = []
+    for data in analyses:
+        try:
+            scores.append(float(data.get('compliance_score')))
+        except (TypeError, ValueError):
+            pass
+    
+    merged = {
+        'compliance_score': min(scores) if scores else 0,
+        'violations': unique('violations'),
+        'recommendations': unique('recommendations'),
+        'detailed_analysis': ' '.join(data.get('detailed_analysis', '') for data in analyses).strip(),
+        'customer_emotion': analyses[-1].get('customer_emotion', 'Trung tính'),
+        'emotion_details': analyses[-1].get('emotion_details', '')
+    }
+    summary = ' '.join(summary for summary in summaries if summary)
+    return f"{summary}\n{json.dumps(merged, ensure_ascii=False)}".strip()